@@ -1,19 +1,41 @@
 # main.py
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
 import uuid
 import os
+import json
+import asyncio
 import logging
+from concurrent.futures import BrokenExecutor
+from typing import List, Optional
 
-from models.schemas import VisualRequest, VisualResponse
-from services.integrated_visual_service import IntegratedVisualService
+from models.schemas import (
+    VisualRequest, VisualResponse, TaskStatus, VisualPanel, VisualStyle, VideoFormat, AnimatedImageFormat
+)
+from services.integrated_visual_service import IntegratedVisualService, IMAGEN_CONCURRENCY
+from services.animation_service import AnimationService
+from services.slideshow_service import SlideshowService, MEDIA_TYPES
+from services.print_service import PrintService
+from services.task_store import task_store
+from services.retention_service import retention_service, video_cache_sweeper
+from services.manifest_store import manifest_store
+from services.storage_service import storage
+from services.prompt_index import prompt_index
+from services.health_service import HealthService
 from utils.config import settings
+from utils.zip_stream import stream_zip
+from utils.metrics import registry
+from utils.tracing import span, start_trace, waterfall, format_waterfall
+from utils.logging_utils import configure_logging, truncated
+from utils.memory_budget import memory_budget
+from utils.file_serving import serve_file
 
 # Setup logging
 logger = logging.getLogger(__name__)
+configure_logging()
 
 app = FastAPI(
     title="AI-Powered Whiteboard Visual Generator with Imagen v4",
@@ -23,7 +45,6 @@ app = FastAPI(
 
 # Mount static files and templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/outputs", StaticFiles(directory="outputs"), name="outputs")
 templates = Jinja2Templates(directory="templates")
 
 # Initialize integrated service
@@ -31,80 +52,358 @@ try:
     visual_service = IntegratedVisualService()
     logger.info("Successfully initialized visual service")
 except Exception as e:
-    logger.error(f"Failed to initialize visual service: {e}")
+    logger.error("Failed to initialize visual service: %s", e)
     raise
 
+animation_service = AnimationService()
+slideshow_service = SlideshowService()
+print_service = PrintService()
+health_service = HealthService(visual_service.imagen_service)
+
+@app.on_event("startup")
+async def start_retention():
+    """Start the background output retention loop"""
+    app.state.retention_task = asyncio.create_task(retention_service.run_forever())
+    app.state.video_sweep_task = asyncio.create_task(video_cache_sweeper.run_forever())
+
+@app.on_event("shutdown")
+async def stop_retention():
+    """Stop the background output retention loop"""
+    app.state.retention_task.cancel()
+    app.state.video_sweep_task.cancel()
+
+@app.on_event("startup")
+async def start_health_checks():
+    """Start the background dependency checks behind /health and /readyz"""
+    app.state.health_task = asyncio.create_task(health_service.run_forever())
+
+@app.on_event("shutdown")
+async def stop_health_checks():
+    """Stop the background dependency checks"""
+    app.state.health_task.cancel()
+
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """Render the enhanced home page"""
     logger.info("Serving home page")
     return templates.TemplateResponse("visual_index.html", {"request": request})
 
+class ClientDisconnected(Exception):
+    """The client closed the connection before the response was ready"""
+
+async def cancel_on_disconnect(request: Request, coro):
+    """Await coro, cancelling it and raising ClientDisconnected if the client goes away first"""
+    work = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({work}, timeout=settings.DISCONNECT_POLL_SECONDS)
+            if done:
+                return work.result()
+            if await request.is_disconnected():
+                work.cancel()
+                # Let cancelled panels release their limiter slots before returning
+                await asyncio.wait({work})
+                raise ClientDisconnected()
+    finally:
+        work.cancel()
+
 @app.post("/api/create-visuals", response_model=VisualResponse)
-async def create_visuals(req: VisualRequest):
+async def create_visuals(req: VisualRequest, request: Request):
     """Create visual storyboard with Imagen v4"""
-    logger.info(f"Received visual creation request: {req.prompt[:50]}...")
-    logger.debug(f"Full request: {req}")
+    logger.info("Received visual creation request: %s", truncated(req.prompt, 50))
+    logger.debug("Full request: %s", truncated(req))
+    
+    # Reserve the storyboard's peak image memory up front; refuse fast rather than risk an OOM kill
+    reservation = memory_budget.try_reserve(min(req.panels, IMAGEN_CONCURRENCY) * settings.PANEL_MEMORY_BYTES)
+    if reservation is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is at capacity, please retry shortly",
+            headers={"Retry-After": str(settings.ADMISSION_RETRY_AFTER_SECONDS)}
+        )
+    
+    task_id = str(uuid.uuid4())
+    logger.info("Generated task ID: %s", task_id)
     
     try:
-        task_id = str(uuid.uuid4())
-        logger.info(f"Generated task ID: {task_id}")
+        task_store.create(task_id)
+        task_store.update(task_id, status="processing", message="Generating storyboard")
         
-        # Create storyboard with integrated service
+        # Create storyboard with integrated service; everything below is traced under the task
+        start_trace(task_id)
         logger.info("Starting integrated storyboard creation...")
-        panels, image_paths, stats = await visual_service.create_storyboard(
-            req.prompt, req.style, req.panels, task_id
-        )
+        with span("create_storyboard", style=req.style.value, panels=req.panels, progressive=req.progressive):
+            panels, image_paths, stats = await cancel_on_disconnect(request, visual_service.create_storyboard(
+                req.prompt, req.style, req.panels, task_id, req.output_format, req.progressive, reservation
+            ))
         
         if not panels:
             logger.error("No panels were created")
+            task_store.update(task_id, status="failed", message="Failed to generate any panels")
             return VisualResponse(
                 panels=[],
                 image_paths=[],
                 message="Failed to generate any panels",
-                generation_stats=stats
+                generation_stats=stats,
+                task_id=task_id
             )
         
+        for path in image_paths:
+            retention_service.record_file(path)
+        
         # Convert file paths to URLs
-        img_urls = [f"/outputs/images/{os.path.basename(p)}" for p in image_paths]
-        logger.info(f"Generated {len(img_urls)} image URLs")
+        img_urls = [image_url(p, 1 if req.progressive else None) for p in image_paths]
+        logger.info("Generated %s image URLs", len(img_urls))
+        
+        if req.progressive:
+            message = f"Generated {len(panels)} preview panels, upgrading with Imagen v4 in the background"
+        else:
+            message = f"Successfully generated {len(panels)} panels with Imagen v4 and Gemini AI"
+            task_store.update(
+                task_id, status="completed", progress=100, message=message,
+                result={
+                    "style": req.style.value,
+                    "panels": [panel.model_dump(mode="json") for panel in panels],
+                    "image_paths": list(image_paths),
+                    "image_versions": [1] * len(image_paths),
+                    "generation_stats": stats
+                }
+            )
+            manifest_store.save_task(task_id, task_store.get(task_id).result)
         
         # Create response
         response = VisualResponse(
             panels=panels,
             image_paths=img_urls,
-            message=f"Successfully generated {len(panels)} panels with Imagen v4 and Gemini AI",
-            generation_stats=stats
+            message=message,
+            generation_stats=stats,
+            task_id=task_id
         )
         
-        logger.info(f"Request completed successfully: {stats}")
+        logger.info("Request completed successfully: %s", stats)
         return response
         
+    except ClientDisconnected:
+        logger.info("Client disconnected, cancelled generation for task %s", task_id)
+        task_store.update(task_id, status="cancelled", message="Cancelled: client disconnected")
+        # Nobody is listening; 499 is the conventional "client closed request" code
+        raise HTTPException(status_code=499, detail="Client closed request")
+    
     except Exception as e:
         error_msg = f"Visual creation failed: {str(e)}"
         logger.error(error_msg)
-        import traceback
-        logger.debug(traceback.format_exc())
+        task_store.update(task_id, status="failed", message=error_msg)
+        logger.debug("Request failure traceback", exc_info=True)
         
         raise HTTPException(status_code=500, detail=error_msg)
+    
+    finally:
+        # No-op when progressive upgrades took over the reservation
+        reservation.release()
 
-@app.get("/outputs/images/{filename}")
-async def get_image(filename: str):
-    """Serve generated images"""
-    logger.debug(f"Serving image: {filename}")
+def image_url(path: str, version: int = None) -> str:
+    """Public URL of a generated image; the version counter busts caches on upgrade"""
+    url = f"/outputs/images/{os.path.basename(path)}"
+    return f"{url}?v={version}" if version else url
+
+@app.get("/api/tasks/{task_id}", response_model=TaskStatus)
+async def get_task_status(task_id: str):
+    """Get task progress; in progressive mode image URLs change as panels are upgraded"""
+    task = await lookup_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
     
-    full_path = os.path.join(settings.IMAGES_DIR, filename)
+    result = dict(task.result or {})
+    if "image_paths" in result:
+        result["image_paths"] = [
+            image_url(path, version)
+            for path, version in zip(result["image_paths"], result["image_versions"])
+        ]
+    result["files"] = [
+        {key: value for key, value in file_info.items() if key != "path"}
+        for file_info in await asyncio.to_thread(manifest_store.task_files, task_id)
+    ]
     
-    if not os.path.exists(full_path):
-        logger.error(f"Image not found: {full_path}")
-        raise HTTPException(status_code=404, detail="Image not found")
+    return TaskStatus(
+        task_id=task.task_id,
+        status=task.status,
+        progress=task.progress,
+        message=task.message,
+        result=result
+    )
+
+async def lookup_task(task_id: str) -> Optional[TaskStatus]:
+    """Get a task from the live store, or restore a finished one from the manifest"""
+    task = task_store.get(task_id)
+    if task is not None:
+        return task
+    
+    result = await asyncio.to_thread(manifest_store.load_task, task_id)
+    if result is None:
+        return None
+    return TaskStatus(task_id=task_id, status="completed", progress=100,
+                      message="Restored from manifest", result=result)
+
+async def get_finished_task(task_id: str):
+    """Get a task whose panels are available, or raise the matching HTTP error"""
+    task = await lookup_task(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if not (task.result or {}).get("panels"):
+        raise HTTPException(status_code=409, detail="Task has no panels yet")
+    return task
+
+def get_task_panels(task):
+    """Rebuild a finished task's panels and style from its stored result"""
+    panels = [VisualPanel(**panel) for panel in task.result["panels"]]
+    style = VisualStyle(task.result.get("style", VisualStyle.WHITEBOARD.value))
+    return panels, style
+
+async def fetch_task_images(task) -> List[Optional[str]]:
+    """Local paths of a task's images, pulled from shared storage when not cached here"""
+    return [
+        await storage.fetch(os.path.basename(path)) if path else None
+        for path in task.result.get("image_paths", [])
+    ]
+
+@app.get("/api/tasks/{task_id}/animation.{video_format}")
+async def export_animation(task_id: str, video_format: VideoFormat):
+    """Export a storyboard as a whiteboard draw-on animation (MP4 or WebM)"""
+    task = await get_finished_task(task_id)
+    
+    if task_store.get(task_id) is None:
+        # Restored from the manifest; track it again so export progress can be reported
+        task_store.add(task)
+    
+    video_path = os.path.join(settings.VIDEOS_DIR, f"{task_id}.{video_format.value}")
+    panels, style = get_task_panels(task)
+    image_paths = await fetch_task_images(task)
+    
+    def report_progress(done: int, total: int):
+        task_store.update(task_id, result={"animation": {
+            "format": video_format.value,
+            "segments_done": done,
+            "segments_total": total
+        }})
+    
+    try:
+        # Encoding is CPU bound; keep it off the event loop. Unchanged panel
+        # segments and an up-to-date joined video are reused from disk.
+        await asyncio.to_thread(
+            animation_service.export_storyboard, panels, style, video_path, video_format,
+            image_paths, report_progress
+        )
+    except (RuntimeError, OSError, BrokenExecutor) as e:
+        # ffmpeg missing or failing, disk errors, a crashed render pool
+        logger.error("Animation export failed for task %s: %s", task_id, e)
+        raise HTTPException(status_code=503, detail=f"Animation export unavailable: {e}")
+    except Exception as e:
+        logger.error("Animation export failed for task %s: %s", task_id, e)
+        logger.debug("Animation export failure traceback", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Animation export failed: {e}")
     
     return FileResponse(
-        full_path,
+        video_path,
+        media_type=f"video/{video_format.value}",
+        filename=f"storyboard_{task_id}.{video_format.value}"
+    )
+
+@app.get("/api/tasks/{task_id}/slideshow.{image_format}")
+async def export_slideshow(task_id: str, image_format: AnimatedImageFormat,
+                           transitions: bool = True, max_kb: Optional[int] = None):
+    """Export a storyboard as a compact animated GIF, APNG or WebP slideshow"""
+    task = await get_finished_task(task_id)
+    panels, style = get_task_panels(task)
+    image_paths = await fetch_task_images(task)
+    
+    data = await asyncio.to_thread(
+        slideshow_service.export, panels, style, image_format,
+        image_paths, transitions, max_kb * 1024 if max_kb else None
+    )
+    
+    return Response(
+        content=data,
+        media_type=MEDIA_TYPES[image_format],
+        headers={"Content-Disposition": f'attachment; filename="storyboard_{task_id}.{image_format.value}"'}
+    )
+
+@app.get("/api/tasks/{task_id}/sheet.png")
+async def export_contact_sheet(task_id: str, columns: Optional[int] = Query(None, ge=1, le=10)):
+    """Export a storyboard as one printable grid image with panel titles"""
+    task = await get_finished_task(task_id)
+    panels, style = get_task_panels(task)
+    image_paths = await fetch_task_images(task)
+    
+    data = await asyncio.to_thread(
+        print_service.contact_sheet, panels, style, image_paths, columns
+    )
+    
+    return Response(
+        content=data,
         media_type="image/png",
-        headers={"Cache-Control": "public, max-age=3600"}
+        headers={"Content-Disposition": f'attachment; filename="storyboard_{task_id}_sheet.png"'}
     )
 
+@app.get("/api/tasks/{task_id}/storyboard.pdf")
+async def export_pdf(task_id: str):
+    """Stream a storyboard as a multi-page PDF, one panel per page"""
+    task = await get_finished_task(task_id)
+    panels, style = get_task_panels(task)
+    image_paths = await fetch_task_images(task)
+    
+    # The generator is synchronous, so pages are built in the threadpool as the client reads
+    return StreamingResponse(
+        print_service.pdf_chunks(panels, style, image_paths),
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="storyboard_{task_id}.pdf"'}
+    )
+
+@app.get("/api/tasks/{task_id}/bundle.zip")
+async def download_bundle(task_id: str):
+    """Stream a ZIP of a task's panel images, panel JSON and generation stats"""
+    task = await get_finished_task(task_id)
+    result = task.result
+    image_paths = await fetch_task_images(task)
+    
+    # Images are already compressed, so they are stored as is
+    entries = [(f"images/{os.path.basename(path)}", path, False) for path in image_paths if path]
+    entries.append(("panels.json", json.dumps(result["panels"], indent=2).encode(), True))
+    entries.append((
+        "generation_stats.json",
+        json.dumps(result.get("generation_stats", {}), indent=2, default=str).encode(),
+        True
+    ))
+    
+    return StreamingResponse(
+        stream_zip(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="storyboard_{task_id}.zip"'}
+    )
+
+@app.api_route("/outputs/images/{filename}", methods=["GET", "HEAD"])
+async def get_image(filename: str, request: Request):
+    """Serve generated images with validators, conditional GET and Range support"""
+    logger.debug("Serving image: %s", filename)
+    
+    try:
+        full_path = await storage.fetch(filename)
+    except ValueError:
+        logger.warning("Rejected image path: %r", filename)
+        raise HTTPException(status_code=404, detail="Image not found")
+    if full_path is None:
+        logger.error("Image not found: %s", filename)
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    try:
+        # Image names embed the task id and never change, so they are served as immutable
+        response = serve_file(full_path, request.headers)
+    except FileNotFoundError:
+        logger.error("Image not found: %s", full_path)
+        raise HTTPException(status_code=404, detail="Image not found")
+    
+    retention_service.touch(filename)
+    return response
+
 @app.get("/api/styles")
 async def get_visual_styles():
     """Get available visual styles"""
@@ -117,54 +416,83 @@ async def get_visual_styles():
         ]
     }
 
+@app.get("/metrics")
+async def metrics():
+    """Stage latency histograms and generation counters in the Prometheus text format"""
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/livez")
+async def liveness_check():
+    """Liveness probe: the event loop is serving requests"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness_check():
+    """Readiness probe from the cached dependency checks; 503 until critical checks pass"""
+    body = {"status": health_service.status, "checks": health_service.checks}
+    if not health_service.ready:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
 @app.get("/health")
 async def health_check():
-    """Comprehensive health check"""
-    logger.info("Health check requested")
+    """Comprehensive health check (dependency results are cached by background checks)"""
+    logger.debug("Health check requested")
     
     health_status = {
-        "status": "healthy",
+        "status": health_service.status,
         "service": "imagen_visual_generator",
         "version": "2.0.0",
         "features": {
             "imagen_v4": True,
             "gemini_ai": True,
             "fallback_generation": True
-        }
+        },
+        "checks": health_service.checks
     }
     
-    # Test Google Cloud connection
-    try:
-        # This is a simple check - in production you might want more thorough testing
-        import google.auth
-        credentials, project_id = google.auth.default()
-        health_status["google_cloud_project"] = project_id
-        health_status["authentication"] = "valid"
-    except Exception as e:
-        logger.warning(f"Google Cloud auth check failed: {e}")
-        health_status["authentication"] = "warning"
-        health_status["auth_error"] = str(e)
+    health_status["retention"] = dict(retention_service.stats)
+    health_status["video_cache"] = dict(video_cache_sweeper.stats)
+    health_status["memory_budget"] = memory_budget.snapshot()
+    health_status["prompt_reuse"] = {
+        **prompt_index.stats,
+        "threshold": prompt_index.threshold,
+        "recent_near_matches": list(prompt_index.audit_log),
+    }
+    
+    auth = health_service.checks.get("authentication")
+    if auth is not None:
+        health_status["authentication"] = "valid" if auth["ok"] else "warning"
+        if auth["ok"]:
+            health_status["google_cloud_project"] = auth.get("project")
+        else:
+            health_status["auth_error"] = auth.get("error")
     
     return health_status
 
+@app.get("/api/debug/task/{task_id}/trace")
+async def debug_task_trace(task_id: str, format: str = Query("json", pattern="^(json|text)$")):
+    """Waterfall of a task's trace spans (JSON rows, or text bars with format=text)"""
+    if not settings.DEBUG_MODE:
+        raise HTTPException(status_code=404, detail="Debug mode not enabled")
+    
+    rows = waterfall(task_id)
+    if not rows:
+        raise HTTPException(status_code=404, detail="No trace recorded for this task")
+    if format == "text":
+        return Response(content=format_waterfall(rows), media_type="text/plain; charset=utf-8")
+    return {"task_id": task_id, "spans": rows}
+
 @app.get("/api/debug/task/{task_id}")
 async def debug_task_info(task_id: str):
     """Debug endpoint to check task-related files"""
     if not settings.DEBUG_MODE:
         raise HTTPException(status_code=404, detail="Debug mode not enabled")
     
-    # Find files related to this task
-    task_files = []
-    if os.path.exists(settings.IMAGES_DIR):
-        for filename in os.listdir(settings.IMAGES_DIR):
-            if task_id in filename:
-                filepath = os.path.join(settings.IMAGES_DIR, filename)
-                file_info = {
-                    "filename": filename,
-                    "size": os.path.getsize(filepath),
-                    "exists": os.path.exists(filepath)
-                }
-                task_files.append(file_info)
+    # Files recorded for this task in the manifest (indexed by task id)
+    task_files = await asyncio.to_thread(manifest_store.task_files, task_id)
+    for file_info in task_files:
+        file_info["exists"] = os.path.exists(file_info["path"])
     
     return {
         "task_id": task_id,
@@ -9,6 +9,19 @@ class VisualStyle(str, Enum):
     INFOGRAPHIC = "infographic"
     MINIMAL = "minimal"
 
+class OutputFormat(str, Enum):
+    PNG = "png"
+    SVG = "svg"
+
+class VideoFormat(str, Enum):
+    MP4 = "mp4"
+    WEBM = "webm"
+
+class AnimatedImageFormat(str, Enum):
+    GIF = "gif"
+    APNG = "apng"
+    WEBP = "webp"
+
 class ImageGenerationStatus(str, Enum):
     PENDING = "pending"
     GENERATING = "generating"
@@ -20,6 +33,8 @@ class VisualRequest(BaseModel):
     style: VisualStyle = VisualStyle.WHITEBOARD
     panels: Optional[int] = Field(default=4, ge=1, le=9)
     high_quality: Optional[bool] = Field(default=True)  # Use Imagen v4 high quality mode
+    output_format: OutputFormat = OutputFormat.PNG  # Format of locally rendered panels
+    progressive: Optional[bool] = Field(default=False)  # Return local panels now, upgrade to Imagen in background
 
 class VisualPanel(BaseModel):
     sequence: int
@@ -35,6 +50,7 @@ class VisualResponse(BaseModel):
     image_paths: List[str]
     message: str
     generation_stats: Optional[dict] = None
+    task_id: Optional[str] = None
 
 class TaskStatus(BaseModel):
     task_id: str
@@ -0,0 +1,417 @@
+import os
+import math
+import uuid
+import shutil
+import hashlib
+import logging
+import subprocess
+from concurrent.futures import as_completed
+from typing import Callable, Iterator, List, Optional
+from PIL import Image, ImageDraw, ImageOps
+
+from services.visual_service import VisualService, get_render_pool
+from models.schemas import VisualPanel, VisualStyle, VideoFormat
+from utils.config import settings
+from utils.stroke_extraction import extract_strokes
+
+logger = logging.getLogger(__name__)
+
+# Reveal speeds for the draw-on effect
+STROKE_SPEED = 1400  # Pixels of stroke drawn per second
+TYPING_SPEED = 40  # Characters typed per second
+MIN_OP_DURATION = 0.1  # Seconds, so tiny strokes are still visible
+PANEL_HOLD = 1.5  # Seconds a finished panel stays on screen
+
+# Points used to approximate ellipses as strokes
+ELLIPSE_SEGMENTS = 48
+
+# Raster (Imagen) panels are revealed along their extracted strokes
+RASTER_DRAW_SECONDS = 4.0  # Upper bound on the tracing phase
+RASTER_REVEAL_WIDTH = 14  # Width of the revealed band around each stroke
+RASTER_FILL_SECONDS = 0.5  # Cross-fade to the full image after tracing
+
+# Bump when the frame pipeline changes so cached segments are re-rendered
+SEGMENT_VERSION = 1
+
+# Encoder arguments per container
+ENCODER_ARGS = {
+    VideoFormat.MP4: ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+                      "-pix_fmt", "yuv420p", "-movflags", "+faststart"],
+    VideoFormat.WEBM: ["-c:v", "libvpx-vp9", "-b:v", "0", "-crf", "34", "-deadline", "realtime",
+                       "-cpu-used", "8", "-row-mt", "1", "-pix_fmt", "yuv420p"],
+}
+
+# Per-worker animator instance, so font and stroke caches stay warm across segments
+_WORKER_ANIMATOR = None
+
+def _find_ffmpeg() -> str:
+    """Locate the ffmpeg binary or raise RuntimeError"""
+    ffmpeg = shutil.which(settings.FFMPEG_PATH)
+    if not ffmpeg:
+        raise RuntimeError(f"ffmpeg not found (FFMPEG_PATH={settings.FFMPEG_PATH})")
+    return ffmpeg
+
+def _is_raster_panel(image_path: Optional[str]) -> bool:
+    """Whether a panel image is an Imagen raster to be traced rather than redrawn"""
+    return bool(image_path) and image_path.endswith("_imagen.png") and os.path.exists(image_path)
+
+def _render_segment_in_worker(fps, panel, style, image_path, path, video_format):
+    """Encode one panel segment inside a pool worker process"""
+    global _WORKER_ANIMATOR
+    if _WORKER_ANIMATOR is None or _WORKER_ANIMATOR.fps != fps:
+        _WORKER_ANIMATOR = AnimationService(fps)
+    return _WORKER_ANIMATOR.render_segment(panel, style, image_path, path, video_format)
+
+class StrokeOp:
+    """A recorded shape, revealed along its outline and finished with the original call"""
+    
+    def __init__(self, points, color, width, closed=False, finish=None):
+        self.points = list(points) + ([points[0]] if closed and points else [])
+        self.color = color
+        self.width = max(1, width)
+        self.finish = finish
+        self.segment_lengths = [
+            math.dist(a, b) for a, b in zip(self.points, self.points[1:])
+        ]
+        self.length = sum(self.segment_lengths)
+        self.duration = max(MIN_OP_DURATION, self.length / STROKE_SPEED)
+    
+    def render(self, draw, fraction: float):
+        """Draw the first fraction of the stroke (the finished shape at 1.0)"""
+        if fraction >= 1.0:
+            if self.finish:
+                self.finish(draw)
+            else:
+                draw.line(self.points, fill=self.color, width=self.width, joint="curve")
+            return
+        
+        remaining = self.length * fraction
+        path = [self.points[0]]
+        for (a, b), segment in zip(zip(self.points, self.points[1:]), self.segment_lengths):
+            if remaining >= segment:
+                path.append(b)
+                remaining -= segment
+                continue
+            if segment > 0:
+                t = remaining / segment
+                path.append((a[0] + (b[0] - a[0]) * t, a[1] + (b[1] - a[1]) * t))
+            break
+        
+        if len(path) > 1:
+            draw.line(path, fill=self.color, width=self.width, joint="curve")
+
+class TextOp:
+    """A recorded text call, typed on character by character"""
+    
+    def __init__(self, xy, text, fill, font):
+        self.xy = xy
+        self.text = text
+        self.fill = fill
+        self.font = font
+        self.duration = max(MIN_OP_DURATION, len(text) / TYPING_SPEED)
+    
+    def render(self, draw, fraction: float):
+        """Draw the first fraction of the characters"""
+        count = len(self.text) if fraction >= 1.0 else int(len(self.text) * fraction)
+        if count:
+            draw.text(self.xy, self.text[:count], fill=self.fill, font=self.font)
+
+class StrokeRecorder:
+    """
+    Canvas with the ImageDraw API subset used by VisualService that records
+    each drawing call as a revealable stroke instead of rasterizing it.
+    """
+    
+    def __init__(self):
+        self.ops: List[object] = []
+    
+    def line(self, xy, fill=None, width=1):
+        self.ops.append(StrokeOp(self._points(xy), fill, width))
+    
+    def polygon(self, xy, fill=None, outline=None, width=1):
+        self.ops.append(StrokeOp(
+            self._points(xy), outline or fill, width, closed=True,
+            finish=lambda draw: draw.polygon(xy, fill=fill, outline=outline, width=width)
+        ))
+    
+    def rectangle(self, xy, fill=None, outline=None, width=1):
+        (x0, y0), (x1, y1) = self._points(xy)
+        self.ops.append(StrokeOp(
+            [(x0, y0), (x1, y0), (x1, y1), (x0, y1)], outline or fill, width, closed=True,
+            finish=lambda draw: draw.rectangle(xy, fill=fill, outline=outline, width=width)
+        ))
+    
+    def ellipse(self, xy, fill=None, outline=None, width=1):
+        (x0, y0), (x1, y1) = self._points(xy)
+        cx, cy, rx, ry = (x0 + x1) / 2, (y0 + y1) / 2, (x1 - x0) / 2, (y1 - y0) / 2
+        points = [
+            (cx + rx * math.cos(2 * math.pi * i / ELLIPSE_SEGMENTS - math.pi / 2),
+             cy + ry * math.sin(2 * math.pi * i / ELLIPSE_SEGMENTS - math.pi / 2))
+            for i in range(ELLIPSE_SEGMENTS)
+        ]
+        self.ops.append(StrokeOp(
+            points, outline or fill, width, closed=True,
+            finish=lambda draw: draw.ellipse(xy, fill=fill, outline=outline, width=width)
+        ))
+    
+    def text(self, xy, text, fill=None, font=None):
+        self.ops.append(TextOp(xy, text, fill, font))
+    
+    def textbbox(self, xy, text, font=None):
+        x, y = xy
+        left, top, right, bottom = font.getbbox(text)
+        return (x + left, y + top, x + right, y + bottom)
+    
+    def _points(self, xy):
+        xy = list(xy)
+        if xy and not isinstance(xy[0], (tuple, list)):
+            return list(zip(xy[0::2], xy[1::2]))
+        return xy
+
+class FfmpegWriter:
+    """Pipe raw RGB frames into an ffmpeg subprocess; memory use is one frame"""
+    
+    def __init__(self, path: str, size: tuple, fps: int, video_format: VideoFormat):
+        ffmpeg = _find_ffmpeg()
+        
+        self.path = path
+        self.size = size
+        command = [
+            ffmpeg, "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size[0]}x{size[1]}", "-r", str(fps),
+            "-i", "-", *ENCODER_ARGS[video_format], path
+        ]
+        logger.debug("Starting encoder: %s", command)
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.frames = 0
+    
+    def write(self, frame: Image.Image):
+        self.process.stdin.write(frame.tobytes())
+        self.frames += 1
+    
+    def close(self):
+        self.process.stdin.close()
+        stderr = self.process.stderr.read()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+        logger.info("Encoded %s frames to %s", self.frames, self.path)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.process.kill()
+            self.process.wait()
+
+class AnimationService:
+    """Render storyboards as hand-drawn reveal videos"""
+    
+    def __init__(self, fps: int = settings.ANIMATION_FPS):
+        self.fps = fps
+        self.visual_service = VisualService()
+        self.size = (self.visual_service.canvas_width, self.visual_service.canvas_height)
+    
+    def record_panel(self, panel: VisualPanel, style: VisualStyle) -> List[object]:
+        """Record a panel's drawing calls as an ordered list of reveal operations"""
+        recorder = StrokeRecorder()
+        self.visual_service.draw_panel_content(recorder, recorder, panel, style)
+        return recorder.ops
+    
+    def panel_frames(self, panel: VisualPanel, style: VisualStyle,
+                     image_path: Optional[str] = None) -> Iterator[Image.Image]:
+        """
+        Lazily generate the frames of one panel being drawn.
+        Imagen panels are revealed from their raster; others are redrawn stroke by stroke.
+        Yielded images may be reused by the next frame, so consume them immediately.
+        """
+        if _is_raster_panel(image_path):
+            yield from self.raster_frames(image_path)
+            return
+        
+        canvas = self.visual_service._get_base_canvas(style).copy()
+        draw = ImageDraw.Draw(canvas)
+        
+        for op in self.record_panel(panel, style):
+            steps = max(1, round(op.duration * self.fps))
+            for step in range(1, steps):
+                frame = canvas.copy()
+                op.render(ImageDraw.Draw(frame), step / steps)
+                yield frame
+            
+            # Commit the finished operation to the persistent canvas
+            op.render(draw, 1.0)
+            yield canvas
+        
+        for _ in range(round(PANEL_HOLD * self.fps)):
+            yield canvas
+    
+    def raster_frames(self, image_path: str) -> Iterator[Image.Image]:
+        """Lazily generate frames revealing a raster panel along its extracted strokes"""
+        with Image.open(image_path) as source:
+            image = ImageOps.pad(source.convert("RGB"), self.size, color="white")
+        blank = Image.new("RGB", self.size, "white")
+        mask = Image.new("L", self.size, 0)
+        mask_draw = ImageDraw.Draw(mask)
+        
+        ops = [
+            StrokeOp(stroke, 255, RASTER_REVEAL_WIDTH)
+            for stroke in extract_strokes(image) if len(stroke) > 1
+        ]
+        total_length = sum(op.length for op in ops)
+        steps = round(min(RASTER_DRAW_SECONDS, total_length / STROKE_SPEED) * self.fps)
+        
+        # Reveal the strokes at a constant pen speed, however many there are
+        index, drawn_length = 0, 0.0
+        for step in range(1, steps + 1):
+            target = total_length * step / steps
+            while index < len(ops) and drawn_length + ops[index].length <= target:
+                ops[index].render(mask_draw, 1.0)
+                drawn_length += ops[index].length
+                index += 1
+            if index < len(ops) and ops[index].length > 0:
+                ops[index].render(mask_draw, (target - drawn_length) / ops[index].length)
+            yield Image.composite(image, blank, mask)
+        
+        # Fade in fills and anything the strokes did not cover
+        traced = Image.composite(image, blank, mask)
+        fill_steps = max(1, round(RASTER_FILL_SECONDS * self.fps))
+        for step in range(1, fill_steps + 1):
+            yield Image.blend(traced, image, step / fill_steps)
+        
+        for _ in range(round(PANEL_HOLD * self.fps)):
+            yield image
+    
+    def storyboard_frames(self, panels: List[VisualPanel], style: VisualStyle,
+                          image_paths: Optional[List[str]] = None) -> Iterator[Image.Image]:
+        """Lazily generate the frames of a whole storyboard, panel after panel"""
+        image_paths = image_paths or [None] * len(panels)
+        for panel, image_path in zip(panels, image_paths):
+            yield from self.panel_frames(panel, style, image_path)
+    
+    def segment_key(self, panel: VisualPanel, style: VisualStyle,
+                    image_path: Optional[str], video_format: VideoFormat) -> str:
+        """Hash of everything a panel segment's frames depend on"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{SEGMENT_VERSION}|{style.value}|{video_format.value}|{self.fps}|{self.size}".encode())
+        digest.update(panel.model_dump_json().encode())
+        if _is_raster_panel(image_path):
+            with open(image_path, "rb") as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+    
+    def render_segment(self, panel: VisualPanel, style: VisualStyle, image_path: Optional[str],
+                       path: str, video_format: VideoFormat) -> str:
+        """Encode one panel's animation as a standalone video segment"""
+        self._encode(self.panel_frames(panel, style, image_path), path, video_format)
+        return path
+    
+    def export_storyboard(self, panels: List[VisualPanel], style: VisualStyle,
+                          path: str, video_format: VideoFormat = VideoFormat.MP4,
+                          image_paths: Optional[List[str]] = None,
+                          progress: Optional[Callable[[int, int], None]] = None) -> str:
+        """
+        Encode a storyboard animation to MP4 or WebM; returns the output path.
+        Each panel is encoded as its own segment across the render pool, segments
+        are cached by input hash, and the video is joined without re-encoding.
+        progress(done, total) is called as segments become available.
+        """
+        image_paths = image_paths or [None] * len(panels)
+        keys = [
+            self.segment_key(panel, style, image_path, video_format)
+            for panel, image_path in zip(panels, image_paths)
+        ]
+        segment_paths = [
+            os.path.join(settings.SEGMENTS_DIR, f"{key}.{video_format.value}") for key in keys
+        ]
+        total = len(panels)
+        
+        # The joined video is current if it was built from the same segments
+        storyboard_key = hashlib.blake2b("".join(keys).encode(), digest_size=16).hexdigest()
+        key_path = f"{path}.key"
+        if os.path.exists(path) and os.path.exists(key_path):
+            with open(key_path) as f:
+                if f.read() == storyboard_key:
+                    logger.info("Reusing animation %s", path)
+                    os.utime(path)
+                    if progress:
+                        progress(total, total)
+                    return path
+        
+        missing = []
+        for i, segment_path in enumerate(segment_paths):
+            try:
+                # Marks the cached segment as recently used, so the cache sweep keeps it
+                os.utime(segment_path)
+            except FileNotFoundError:
+                missing.append(i)
+        done = total - len(missing)
+        logger.info("Exporting %s panel animation to %s (%s segments cached)", total, path, done)
+        if progress:
+            progress(done, total)
+        
+        if len(missing) <= 1 or settings.RENDER_WORKERS <= 1:
+            for i in missing:
+                self.render_segment(panels[i], style, image_paths[i], segment_paths[i], video_format)
+                done += 1
+                if progress:
+                    progress(done, total)
+        else:
+            pool = get_render_pool()
+            futures = [
+                pool.submit(_render_segment_in_worker, self.fps, panels[i], style,
+                            image_paths[i], segment_paths[i], video_format)
+                for i in missing
+            ]
+            for future in as_completed(futures):
+                future.result()
+                done += 1
+                if progress:
+                    progress(done, total)
+        
+        self._concat(segment_paths, path, video_format)
+        with open(key_path, "w") as f:
+            f.write(storyboard_key)
+        
+        return path
+    
+    def _encode(self, frames: Iterator[Image.Image], path: str, video_format: VideoFormat):
+        """Encode frames to path via a temporary file, so readers never see a partial video"""
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp.{video_format.value}"
+        try:
+            with FfmpegWriter(tmp_path, self.size, self.fps, video_format) as writer:
+                for frame in frames:
+                    writer.write(frame)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def _concat(self, segment_paths: List[str], path: str, video_format: VideoFormat):
+        """Join encoded segments losslessly with the ffmpeg concat demuxer"""
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp.{video_format.value}"
+        list_path = f"{tmp_path}.txt"
+        with open(list_path, "w") as f:
+            for segment_path in segment_paths:
+                escaped = os.path.abspath(segment_path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        
+        command = [
+            _find_ffmpeg(), "-y", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy"
+        ]
+        if video_format == VideoFormat.MP4:
+            command += ["-movflags", "+faststart"]
+        
+        try:
+            completed = subprocess.run(command + [tmp_path], capture_output=True)
+            if completed.returncode != 0:
+                raise RuntimeError(f"ffmpeg concat failed: {completed.stderr.decode(errors='replace').strip()}")
+            os.replace(tmp_path, path)
+            logger.info("Joined %s segments into %s", len(segment_paths), path)
+        finally:
+            for leftover in (tmp_path, list_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
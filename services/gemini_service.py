@@ -5,6 +5,8 @@ import asyncio
 import logging
 from typing import List
 from utils.config import settings
+from utils.metrics import stage
+from utils.logging_utils import truncated
 from models.schemas import VisualPanel, VisualStyle, ImageGenerationStatus
 
 logger = logging.getLogger(__name__)
@@ -17,19 +19,19 @@ class GeminiService:
             self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
             logger.info("Successfully initialized Gemini service")
         except Exception as e:
-            logger.error(f"Failed to initialize Gemini service: {e}")
+            logger.error("Failed to initialize Gemini service: %s", e)
             raise
 
     def extract_json_from_response(self, raw_text: str) -> str:
         """Extract JSON content from Gemini response"""
-        logger.debug(f"Extracting JSON from response: {raw_text[:100]}...")
+        logger.debug("Extracting JSON from response: %s", truncated(raw_text, 100))
         
         if "```":
             start = raw_text.find("```json") + 7
             end = raw_text.find("```")
             if end != -1:
                 extracted = raw_text[start:end].strip()
-                logger.debug(f"Extracted JSON: {extracted[:100]}...")
+                logger.debug("Extracted JSON: %s", truncated(extracted, 100))
                 return extracted
         elif "```" in raw_text:
             lines = raw_text.split('\n')
@@ -44,19 +46,19 @@ class GeminiService:
                     json_lines.append(line)
             
             extracted = '\n'.join(json_lines)
-            logger.debug(f"Extracted from code block: {extracted[:100]}...")
+            logger.debug("Extracted from code block: %s", truncated(extracted, 100))
             return extracted
         
         # Return cleaned text
         cleaned = raw_text.strip("`\n ")
-        logger.debug(f"Cleaned text: {cleaned[:100]}...")
+        logger.debug("Cleaned text: %s", truncated(cleaned, 100))
         return cleaned
 
     async def generate_visual_storyboard(self, prompt: str, style: VisualStyle, panels: int) -> List[VisualPanel]:
         """Generate storyboard panels optimized for Imagen v4"""
         
-        logger.info(f"Generating storyboard: {panels} panels, style: {style.value}")
-        logger.debug(f"User prompt: {prompt}")
+        logger.info("Generating storyboard: %s panels, style: %s", panels, style.value)
+        logger.debug("User prompt: %s", truncated(prompt))
         
         system_prompt = f"""
         Create exactly {panels} panels for a {style.value} visual storyboard explaining: {prompt}
@@ -85,21 +87,22 @@ class GeminiService:
         
         try:
             logger.debug("Calling Gemini API...")
-            response = await asyncio.to_thread(
-                self.model.generate_content, 
-                system_prompt
-            )
+            with stage("gemini_request"):
+                response = await asyncio.to_thread(
+                    self.model.generate_content, 
+                    system_prompt
+                )
             
             raw_text = response.text
-            logger.debug(f"Gemini raw response: {raw_text}")
+            logger.debug("Gemini raw response: %s", truncated(raw_text, 1000))
             
             # Extract and parse JSON
             json_str = self.extract_json_from_response(raw_text)
-            logger.debug(f"Extracted JSON string: {json_str}")
+            logger.debug("Extracted JSON string: %s", truncated(json_str, 1000))
             
             try:
                 panels_data = json.loads(json_str)
-                logger.info(f"Successfully parsed {len(panels_data)} panels from JSON")
+                logger.info("Successfully parsed %s panels from JSON", len(panels_data))
                 
                 if not isinstance(panels_data, list):
                     logger.error("Parsed data is not a list")
@@ -114,31 +117,31 @@ class GeminiService:
                         
                         panel = VisualPanel(**panel_dict)
                         visual_panels.append(panel)
-                        logger.debug(f"Created panel {i+1}: {panel.title}")
+                        logger.debug("Created panel %d: %s", i + 1, panel.title)
                         
                     except Exception as e:
-                        logger.error(f"Error creating panel {i+1}: {e}")
+                        logger.error("Error creating panel %s: %s", i+1, e)
                         continue
                 
                 if not visual_panels:
                     logger.warning("No valid panels created, using fallback")
                     return self._create_fallback_panels(prompt, panels)
                 
-                logger.info(f"Successfully created {len(visual_panels)} visual panels")
+                logger.info("Successfully created %s visual panels", len(visual_panels))
                 return visual_panels
                 
             except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error: {e}")
-                logger.debug(f"Problematic JSON: {json_str}")
+                logger.error("JSON decode error: %s", e)
+                logger.debug("Problematic JSON: %s", truncated(json_str, 1000))
                 return self._create_fallback_panels(prompt, panels)
                 
         except Exception as e:
-            logger.error(f"Gemini API error: {e}")
+            logger.error("Gemini API error: %s", e)
             return self._create_fallback_panels(prompt, panels)
 
     def _create_fallback_panels(self, prompt: str, num_panels: int) -> List[VisualPanel]:
         """Create fallback panels when Gemini fails"""
-        logger.warning(f"Creating {num_panels} fallback panels for: {prompt}")
+        logger.warning("Creating %s fallback panels for: %s", num_panels, truncated(prompt))
         
         panels = []
         words = prompt.split()
@@ -158,6 +161,6 @@ class GeminiService:
                 image_generation_status=ImageGenerationStatus.PENDING
             )
             panels.append(panel)
-            logger.debug(f"Created fallback panel {i+1}")
+            logger.debug("Created fallback panel %d", i + 1)
             
         return panels
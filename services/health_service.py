@@ -0,0 +1,114 @@
+import time
+import shutil
+import asyncio
+import logging
+from typing import Dict, Tuple
+
+import google.auth
+import httpx
+
+from services.imagen_service import ImagenService
+from utils.config import settings
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODELS_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+
+# A failing critical check makes the service not ready; the others only degrade it
+# (Gemini and Imagen failures fall back to local panels)
+CRITICAL_CHECKS = ("disk", "authentication")
+
+class HealthService:
+    """
+    Dependency checks (Google Cloud auth, Gemini reachability, recent Imagen
+    failures, free disk for images) run periodically in the background.
+    Probe endpoints only read the cached results, so frequent probing costs
+    nothing and never blocks the event loop.
+    """
+    
+    def __init__(self, imagen_service: ImagenService,
+                 timeout: float = settings.HEALTH_CHECK_TIMEOUT,
+                 min_free_bytes: int = settings.HEALTH_MIN_FREE_BYTES):
+        self.imagen_service = imagen_service
+        self.timeout = timeout
+        self.min_free_bytes = min_free_bytes
+        # name -> {"ok": bool, "checked_at": unix time, "duration_ms": float, ...details}
+        self.checks: Dict[str, dict] = {}
+    
+    @property
+    def ready(self) -> bool:
+        """Every critical check has run and passed"""
+        return all(self.checks.get(name, {}).get("ok") for name in CRITICAL_CHECKS)
+    
+    @property
+    def status(self) -> str:
+        if not self.ready:
+            return "unhealthy"
+        return "healthy" if all(check["ok"] for check in self.checks.values()) else "degraded"
+    
+    async def run_checks(self) -> Dict[str, dict]:
+        """Run all checks concurrently and cache their results"""
+        checks = {
+            "authentication": self._check_auth,
+            "gemini": self._check_gemini,
+            "imagen": self._check_imagen,
+            "disk": self._check_disk,
+        }
+        results = await asyncio.gather(*[self._run_check(check) for check in checks.values()])
+        for name, result in zip(checks, results):
+            # Log state changes only, not every run
+            previous = self.checks.get(name)
+            if not result["ok"] and (previous is None or previous["ok"]):
+                logger.warning("Health check %s failing: %s", name, result.get("error"))
+            elif result["ok"] and previous is not None and not previous["ok"]:
+                logger.info("Health check %s recovered", name)
+            self.checks[name] = result
+        return self.checks
+    
+    async def run_forever(self, interval: int = settings.HEALTH_CHECK_INTERVAL_SECONDS):
+        """Refresh the cached check results in the background until cancelled"""
+        logger.info("Starting background health checks every %ss", interval)
+        while True:
+            try:
+                await self.run_checks()
+            except Exception as e:
+                logger.error("Health checks failed: %s", e)
+            await asyncio.sleep(interval)
+    
+    async def _run_check(self, check) -> dict:
+        started = time.perf_counter()
+        try:
+            ok, details = await asyncio.wait_for(check(), self.timeout)
+        except Exception as e:
+            ok, details = False, {"error": str(e) or type(e).__name__}
+        return {"ok": ok, "checked_at": time.time(),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1), **details}
+    
+    async def _check_auth(self) -> Tuple[bool, dict]:
+        # google.auth.default() may read files or query the metadata server
+        _, project_id = await asyncio.to_thread(google.auth.default)
+        return True, {"project": project_id}
+    
+    async def _check_gemini(self) -> Tuple[bool, dict]:
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.get(GEMINI_MODELS_URL, params={"pageSize": 1},
+                                        headers={"x-goog-api-key": settings.GEMINI_API_KEY or ""})
+        if response.status_code != 200:
+            return False, {"error": f"HTTP {response.status_code}"}
+        return True, {}
+    
+    async def _check_imagen(self) -> Tuple[bool, dict]:
+        failures = self.imagen_service.consecutive_failures
+        details = {"consecutive_failures": failures}
+        if failures >= settings.IMAGEN_FAILURE_THRESHOLD:
+            details["error"] = f"{failures} consecutive failed attempts"
+            return False, details
+        return True, details
+    
+    async def _check_disk(self) -> Tuple[bool, dict]:
+        usage = await asyncio.to_thread(shutil.disk_usage, settings.IMAGES_DIR)
+        details = {"free_bytes": usage.free, "total_bytes": usage.total}
+        if usage.free < self.min_free_bytes:
+            details["error"] = f"{usage.free} bytes free in {settings.IMAGES_DIR}"
+            return False, details
+        return True, details
@@ -1,32 +1,96 @@
-# services/hybrid_visual_service.py
-from PIL import Image, ImageDraw, ImageFont
-import io, os
-from services.gemini_service import GeminiService
+from PIL import Image, ImageColor, ImageDraw, ImageOps
+import io
+import time
+import logging
+
+from services.imagen_service import ImagenService
+from services.visual_service import STYLE_COLORS
+from services.manifest_store import manifest_store
+from services.storage_service import storage
+from models.schemas import VisualPanel, VisualStyle
+from utils.metrics import PANELS, stage
+from utils.text_layout import layout_text, draw_text_lines
+
+logger = logging.getLogger(__name__)
+
+# Exact output size of hybrid panels
+OUTPUT_SIZE = (1200, 800)
+
+# Opacity of the bands behind overlay text (0-255)
+BAND_ALPHA = 215
+
+def _composite_overlay(base_image: Image.Image, style: VisualStyle, title: str, text_content: str) -> Image.Image:
+    """
+    Composite a panel's text overlay onto an RGBA image in place: translucent
+    title and content bands with their text. Only the two bands are allocated,
+    not a full-frame overlay.
+    """
+    width, height = base_image.size
+    colors = STYLE_COLORS.get(style, STYLE_COLORS[VisualStyle.WHITEBOARD])
+    
+    # Lay out both text blocks first so the bands fit them exactly
+    title_lines, title_bottom = layout_text([
+        {"text": title, "size": 40, "min_size": 26, "max_lines": 2,
+         "max_width": width - 120, "line_height": 48, "fill": colors['text']}
+    ], width, 20)
+    content_lines, content_bottom = layout_text([
+        {"text": text_content, "size": 24, "min_size": 18, "max_lines": 3,
+         "max_width": width - 120, "line_height": 30, "fill": colors['text']}
+    ], width, 0)
+    
+    band_color = ImageColor.getrgb(colors['bg'])[:3] + (BAND_ALPHA,)
+    title_band = title_bottom + 12
+    content_band = content_bottom + 40
+    
+    # Title band, with the accent line along its bottom edge
+    band = Image.new("RGBA", (width, title_band + 2), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(band)
+    draw.rectangle([0, 0, width, title_band], fill=band_color)
+    draw.line([(0, title_band), (width, title_band)], fill=colors['accent'], width=3)
+    draw_text_lines(draw, title_lines)
+    base_image.alpha_composite(band, (0, 0))
+    
+    # Content band; its lines were laid out from y=0
+    band = Image.new("RGBA", (width, content_band), band_color)
+    draw = ImageDraw.Draw(band)
+    draw_text_lines(draw, [line._replace(y=line.y + 20) for line in content_lines])
+    base_image.alpha_composite(band, (0, height - content_band))
+    
+    return base_image
 
 class HybridVisualService:
     def __init__(self):
-        self.gemini_service = GeminiService()
+        self.imagen_service = ImagenService()
         
-    async def create_enhanced_panel(self, panel, style, task_id):
+    async def create_enhanced_panel(self, panel: VisualPanel, style: VisualStyle, task_id: str):
         """Create panel with AI-generated visual + text overlay"""
         
-        # Generate base illustration with Gemini
-        visual_prompt = self._create_visual_prompt(panel, style)
-        ai_image_data = await self.gemini_service.generate_panel_image(
-            visual_prompt, style
-        )
+        started = time.perf_counter()
         
-        # Load AI-generated image
-        base_image = Image.open(io.BytesIO(ai_image_data))
-        base_image = base_image.resize((1200, 800))
+        # Generate base illustration with Imagen
+        visual_prompt = self._create_visual_prompt(panel, style)
+        ai_image_data = await self.imagen_service.generate_image_data(visual_prompt, panel.sequence)
         
-        # Add text overlays and enhancements
-        enhanced_image = self._add_text_overlays(base_image, panel, style)
+        if not ai_image_data:
+            logger.error("No base illustration generated for panel %s", panel.sequence)
+            return None
         
-        # Save final image
-        img_path = os.path.join(settings.IMAGES_DIR, f"{task_id}_panel_{panel.sequence}.png")
-        enhanced_image.save(img_path, quality=95)
+        # Load AI-generated image and bring it to the exact output size
+        with stage("hybrid_compose"):
+            base_image = self._fit_to_output(Image.open(io.BytesIO(ai_image_data)))
+            
+            # Add text overlays and enhancements
+            enhanced_image = self._add_text_overlays(base_image, panel, style)
+            
+            # Save final image
+            buffer = io.BytesIO()
+            enhanced_image.save(buffer, "PNG")
+        img_path = await storage.write(f"{task_id}_panel_{panel.sequence}.png", buffer.getvalue())
         
+        logger.info("Hybrid panel saved: %s", img_path)
+        PANELS.inc(method="hybrid")
+        manifest_store.record_file(task_id, img_path, "hybrid", panel.sequence,
+                                   (time.perf_counter() - started) * 1000)
         return img_path
     
     def _create_visual_prompt(self, panel, style):
@@ -43,15 +107,12 @@ class HybridVisualService:
         - Leave space at top and bottom for text overlays
         """
     
+    def _fit_to_output(self, image: Image.Image) -> Image.Image:
+        """Center-crop to the output aspect ratio and resample once to the exact size"""
+        if image.size != OUTPUT_SIZE:
+            image = ImageOps.fit(image, OUTPUT_SIZE, Image.Resampling.LANCZOS)
+        return image.convert("RGBA")
+    
     def _add_text_overlays(self, base_image, panel, style):
-        """Add title and text overlays to AI-generated image"""
-        draw = ImageDraw.Draw(base_image)
-        
-        # Add semi-transparent text backgrounds
-        self._add_text_background(draw, base_image.size)
-        
-        # Add title and content
-        self._draw_title_overlay(draw, panel.title, base_image.size)
-        self._draw_content_overlay(draw, panel.text_content, base_image.size)
-        
-        return base_image
+        """Add title and text overlays to AI-generated image, compositing only the two text bands"""
+        return _composite_overlay(base_image, style, panel.title, panel.text_content).convert("RGB")
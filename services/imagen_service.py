@@ -1,9 +1,11 @@
 # services/imagen_service.py
 import asyncio
-import base64
+import binascii
 import io, os
+import json
 import time
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
+import aiofiles
 from google.cloud import aiplatform
 from google.auth import default
 import httpx
@@ -11,10 +13,48 @@ from PIL import Image
 import logging
 
 from utils.config import settings
+from utils.metrics import IMAGEN_ATTEMPTS, PANELS, stage
+from utils.tracing import mark_error, span
+from utils.logging_utils import truncated
+from services.manifest_store import manifest_store
+from services.storage_service import storage
+from services.prompt_index import prompt_index
 from models.schemas import VisualPanel, VisualStyle, ImageGenerationStatus
 
 logger = logging.getLogger(__name__)
 
+IMAGE_FIELD = b'"bytesBase64Encoded"'
+IMAGE_SIGNATURES = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"RIFF")
+
+def _decode_image_field(content: bytes) -> Optional[bytes]:
+    """Base64-decode the first prediction's image from a raw predict response, or None"""
+    key = content.find(IMAGE_FIELD)
+    if key < 0:
+        return None
+    colon = content.find(b":", key + len(IMAGE_FIELD))
+    start = content.find(b'"', colon) + 1
+    end = content.find(b'"', start)
+    if colon < 0 or start <= 0 or end <= start:
+        return None
+    
+    try:
+        if content.find(b"\\", start, end) >= 0:
+            # JSON escapes (e.g. "\u003d" for "=") would be silently skipped by the
+            # decoder and corrupt the image; parse the body properly instead
+            encoded = json.loads(content)["predictions"][0]["bytesBase64Encoded"]
+            image_data = binascii.a2b_base64(encoded)
+        else:
+            # A memoryview slice shares the response buffer instead of copying the base64 text
+            image_data = binascii.a2b_base64(memoryview(content)[start:end])
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        logger.error("Could not decode image data: %s", e)
+        return None
+    
+    if not image_data.startswith(IMAGE_SIGNATURES):
+        logger.error("Decoded image data is not a PNG, JPEG or WebP image")
+        return None
+    return image_data
+
 class ImagenService:
     def __init__(self):
         logger.info("Initializing Imagen v4 service...")
@@ -27,10 +67,14 @@ class ImagenService:
             
             # Set up authentication
             self.credentials, self.project_id = default()
-            logger.info(f"Successfully initialized Imagen service for project: {self.project_id}")
-            
+            # Imagen calls still finishing for cancelled requests (task id -> calls), kept until done
+            self._detached_calls: Dict[str, Set[asyncio.Future]] = {}
+            # Failed attempts since the last success, for health checks
+            self.consecutive_failures = 0
+            logger.info("Successfully initialized Imagen service for project: %s", self.project_id)
+        
         except Exception as e:
-            logger.error(f"Failed to initialize Imagen service: {e}")
+            logger.error("Failed to initialize Imagen service: %s", e)
             raise Exception(f"Imagen initialization failed: {e}")
     
     async def generate_panel_image(self, panel: VisualPanel, style: VisualStyle, 
@@ -39,7 +83,8 @@ class ImagenService:
         Generate image using Google Cloud Imagen v4
         Returns: (image_path, status_message)
         """
-        logger.info(f"Starting image generation for panel {panel.sequence} (Task: {task_id})")
+        logger.info("Starting image generation for panel %s (Task: %s)", panel.sequence, task_id)
+        started = time.perf_counter()
         
         try:
             # Update panel status
@@ -49,29 +94,117 @@ class ImagenService:
             imagen_prompt = self._create_imagen_prompt(panel, style)
             panel.image_generation_prompt = imagen_prompt
             
-            logger.debug(f"Generated prompt for panel {panel.sequence}: {imagen_prompt}")
+            logger.debug("Generated prompt for panel %s: %s", panel.sequence, truncated(imagen_prompt))
+            
+            # Reuse the image of a near-identical earlier prompt instead of paying for a new one
+            reuse_text = self._reuse_key_text(panel)
+            with stage("prompt_reuse"):
+                reused_path = await self._reuse_similar_image(reuse_text, panel, style, task_id, started)
+            if reused_path:
+                panel.image_generation_status = ImageGenerationStatus.COMPLETED
+                PANELS.inc(method="reuse")
+                return reused_path, "Reused image of a near-identical prompt"
             
             # Generate image with retry logic
-            image_data = await self._generate_with_retry(imagen_prompt, panel.sequence)
+            abandoned = asyncio.Event()
+            generation = self._generate_and_save(imagen_prompt, reuse_text, panel, style, task_id, started, abandoned)
+            if not settings.FINISH_PAID_IMAGEN_CALLS:
+                return await generation
             
-            if image_data:
-                # Save image
-                image_path = await self._save_image(image_data, panel.sequence, task_id)
-                panel.image_generation_status = ImageGenerationStatus.COMPLETED
-                
-                logger.info(f"Successfully generated image for panel {panel.sequence}: {image_path}")
-                return image_path, "Image generated successfully"
-            else:
-                panel.image_generation_status = ImageGenerationStatus.FAILED
-                logger.error(f"Failed to generate image for panel {panel.sequence}")
-                return None, "Image generation failed"
-                
+            # If the request is cancelled (client gone), an Imagen call already sent is
+            # paid for: let it finish into storage and the reuse index, but retry no more
+            generation = asyncio.ensure_future(generation)
+            try:
+                return await asyncio.shield(generation)
+            except asyncio.CancelledError:
+                abandoned.set()
+                if not generation.done():
+                    self._detach(task_id, panel.sequence, generation)
+                raise
+        
         except Exception as e:
             panel.image_generation_status = ImageGenerationStatus.FAILED
             error_msg = f"Error generating image for panel {panel.sequence}: {e}"
             logger.error(error_msg)
             return None, error_msg
     
+    def detached_calls(self, task_id: str) -> List[asyncio.Future]:
+        """Imagen calls of a cancelled task that are still finishing in the background"""
+        return list(self._detached_calls.get(task_id, ()))
+    
+    def _detach(self, task_id: str, panel_sequence: int, generation: asyncio.Future):
+        """Let a cancelled panel's in-flight call finish, up to MAX_DETACHED_IMAGEN_CALLS at once"""
+        if sum(len(calls) for calls in self._detached_calls.values()) >= settings.MAX_DETACHED_IMAGEN_CALLS:
+            logger.warning("Too many detached Imagen calls, dropping panel %s's in-flight call", panel_sequence)
+            generation.cancel()
+            return
+        
+        logger.info("Panel %s cancelled, letting its in-flight Imagen call finish", panel_sequence)
+        calls = self._detached_calls.setdefault(task_id, set())
+        calls.add(generation)
+        
+        def forget(_):
+            calls.discard(generation)
+            if not calls and self._detached_calls.get(task_id) is calls:
+                del self._detached_calls[task_id]
+        generation.add_done_callback(forget)
+    
+    async def _generate_and_save(self, imagen_prompt: str, reuse_text: str, panel: VisualPanel,
+                                 style: VisualStyle, task_id: str, started: float,
+                                 abandoned: Optional[asyncio.Event] = None) -> Tuple[Optional[str], str]:
+        """Generate, save and index a panel's Imagen image"""
+        image_data = await self._generate_with_retry(imagen_prompt, panel.sequence, abandoned)
+        
+        if image_data:
+            # Save image
+            image_path = await self._save_image(
+                image_data, panel.sequence, task_id,
+                generation_ms=(time.perf_counter() - started) * 1000
+            )
+            panel.image_generation_status = ImageGenerationStatus.COMPLETED
+            prompt_index.add(style.value, reuse_text, panel.visual_elements, os.path.basename(image_path))
+            PANELS.inc(method="imagen")
+            
+            logger.info("Successfully generated image for panel %s: %s", panel.sequence, image_path)
+            return image_path, "Image generated successfully"
+        else:
+            panel.image_generation_status = ImageGenerationStatus.FAILED
+            logger.error("Failed to generate image for panel %s", panel.sequence)
+            return None, "Image generation failed"
+    
+    async def generate_image_data(self, prompt: str, panel_sequence: int) -> Optional[bytes]:
+        """Generate raw image bytes for a custom prompt (with retry logic)"""
+        return await self._generate_with_retry(prompt, panel_sequence)
+    
+    def _reuse_key_text(self, panel: VisualPanel) -> str:
+        """The parts of the Imagen prompt that vary between panels of one style"""
+        return f"{panel.title}. {panel.description}. {', '.join(panel.visual_elements)}"
+    
+    async def _reuse_similar_image(self, reuse_text: str, panel: VisualPanel, style: VisualStyle,
+                                   task_id: str, started: float) -> Optional[str]:
+        """Copy the image of a near-identical indexed prompt into this panel, if there is one"""
+        match = prompt_index.find(style.value, reuse_text, panel.visual_elements)
+        if match is None:
+            return None
+        
+        source_path = await storage.fetch(match.filename)
+        if source_path is None:
+            # Evicted by retention since it was indexed
+            prompt_index.discard(match)
+            return None
+        
+        filename = f"{task_id}_panel_{panel.sequence}_imagen.png"
+        if filename == match.filename:
+            return source_path
+        
+        async with aiofiles.open(source_path, "rb") as f:
+            data = await f.read()
+        filepath = await storage.write(filename, data)
+        manifest_store.record_file(task_id, filepath, "reuse", panel.sequence,
+                                   (time.perf_counter() - started) * 1000)
+        logger.info("Reused %s for panel %s (Task: %s)", match.filename, panel.sequence, task_id)
+        return filepath
+    
     def _create_imagen_prompt(self, panel: VisualPanel, style: VisualStyle) -> str:
         """Create optimized prompt for Imagen v4"""
         
@@ -101,32 +234,47 @@ Additional requirements:
 - No text or labels in the image
 - Focus on visual storytelling
 """
-        
-        logger.debug(f"Created Imagen prompt: {prompt[:200]}...")
+
+        logger.debug("Created Imagen prompt: %s", truncated(prompt))
         return prompt.strip()
     
-    async def _generate_with_retry(self, prompt: str, panel_sequence: int) -> Optional[bytes]:
-        """Generate image with retry logic"""
+    async def _generate_with_retry(self, prompt: str, panel_sequence: int,
+                                   abandoned: Optional[asyncio.Event] = None) -> Optional[bytes]:
+        """Generate image with retry logic; no new attempts start once `abandoned` is set"""
         
         for attempt in range(settings.MAX_IMAGE_RETRIES):
+            if abandoned is not None and abandoned.is_set():
+                logger.info("Request abandoned, skipping remaining attempts for panel %s", panel_sequence)
+                return None
             try:
-                logger.info(f"Image generation attempt {attempt + 1}/{settings.MAX_IMAGE_RETRIES} for panel {panel_sequence}")
+                logger.info("Image generation attempt %s/%s for panel %s", attempt + 1, settings.MAX_IMAGE_RETRIES, panel_sequence)
                 
                 # Call Imagen v4 API
-                image_data = await self._call_imagen_api(prompt)
+                with span("imagen.attempt", attempt=attempt + 1, panel=panel_sequence):
+                    with stage("imagen_request"):
+                        image_data = await self._call_imagen_api(prompt)
+                    if not image_data:
+                        mark_error("no image data")
                 
                 if image_data:
-                    logger.info(f"Successfully generated image on attempt {attempt + 1}")
+                    IMAGEN_ATTEMPTS.inc(outcome="success")
+                    self.consecutive_failures = 0
+                    logger.info("Successfully generated image on attempt %s", attempt + 1)
                     return image_data
                 else:
-                    logger.warning(f"Attempt {attempt + 1} returned no data")
-                    
+                    IMAGEN_ATTEMPTS.inc(outcome="empty")
+                    self.consecutive_failures += 1
+                    logger.warning("Attempt %s returned no data", attempt + 1)
+            
             except Exception as e:
-                logger.error(f"Attempt {attempt + 1} failed: {e}")
+                IMAGEN_ATTEMPTS.inc(outcome="error")
+                self.consecutive_failures += 1
+                logger.error("Attempt %s failed: %s", attempt + 1, e)
                 if attempt < settings.MAX_IMAGE_RETRIES - 1:
                     wait_time = (attempt + 1) * 2  # Exponential backoff
-                    logger.info(f"Waiting {wait_time} seconds before retry...")
-                    await asyncio.sleep(wait_time)
+                    logger.info("Waiting %s seconds before retry...", wait_time)
+                    with stage("imagen_backoff"):
+                        await asyncio.sleep(wait_time)
                 else:
                     logger.error("All retry attempts exhausted")
         
@@ -137,9 +285,10 @@ Additional requirements:
         
         try:
             # Get access token
-            credentials, _ = default()
-            credentials.refresh(httpx.Request())
-            access_token = credentials.token
+            with stage("imagen_auth"):
+                credentials, _ = default()
+                credentials.refresh(httpx.Request())
+                access_token = credentials.token
             
             # Prepare API request
             url = f"https://{settings.GOOGLE_CLOUD_LOCATION}-aiplatform.googleapis.com/v1/projects/{settings.GOOGLE_CLOUD_PROJECT}/locations/{settings.GOOGLE_CLOUD_LOCATION}/publishers/google/models/{settings.IMAGEN_MODEL}:predict"
@@ -164,73 +313,78 @@ Additional requirements:
                 }
             }
             
-            logger.debug(f"Making API request to: {url}")
-            logger.debug(f"Payload: {payload}")
+            logger.debug("Making API request to: %s", url)
+            logger.debug("Payload: %s", truncated(payload))
             
             # Make async HTTP request
             async with httpx.AsyncClient(timeout=settings.IMAGE_GENERATION_TIMEOUT) as client:
                 response = await client.post(url, json=payload, headers=headers)
                 
-                logger.debug(f"API response status: {response.status_code}")
+                logger.debug("API response status: %s", response.status_code)
                 
                 if response.status_code == 200:
-                    result = response.json()
-                    logger.debug(f"API response: {str(result)[:200]}...")
+                    logger.debug("API response: %s", truncated(response.content))
+                    
+                    # Decode the image straight out of the response buffer, without
+                    # parsing the multi-MB JSON or copying the base64 text
+                    with stage("image_b64_decode"):
+                        image_data = _decode_image_field(response.content)
+                    if image_data:
+                        logger.info("Successfully decoded image data (%s bytes)", len(image_data))
+                        return image_data
                     
-                    if "predictions" in result and len(result["predictions"]) > 0:
-                        # Extract base64 image data
-                        image_b64 = result["predictions"][0].get("bytesBase64Encoded")
-                        if image_b64:
-                            image_data = base64.b64decode(image_b64)
-                            logger.info(f"Successfully decoded image data ({len(image_data)} bytes)")
-                            return image_data
-                        else:
-                            logger.error("No image data in API response")
+                    result = response.json()
+                    if result.get("predictions"):
+                        logger.error("No image data in API response")
                     else:
                         logger.error("No predictions in API response")
                 else:
-                    error_text = response.text
-                    logger.error(f"API request failed: {response.status_code} - {error_text}")
-                    
+                    logger.error("API request failed: %s - %s", response.status_code, truncated(response.text))
+        
         except Exception as e:
-            logger.error(f"API call failed: {e}")
+            logger.error("API call failed: %s", e)
             raise
         
         return None
     
-    async def _save_image(self, image_data: bytes, panel_sequence: int, task_id: str) -> str:
+    async def _save_image(self, image_data: bytes, panel_sequence: int, task_id: str,
+                          generation_ms: Optional[float] = None) -> str:
         """Save generated image to disk"""
         
         try:
-            # Load image and verify
-            image = Image.open(io.BytesIO(image_data))
-            logger.info(f"Image loaded: {image.size} pixels, mode: {image.mode}")
-            
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-                logger.debug("Converted image to RGB mode")
-            
-            # Resize if needed (maintain aspect ratio)
-            if image.width > 1200 or image.height > 800:
-                image.thumbnail((1200, 800), Image.Resampling.LANCZOS)
-                logger.debug(f"Resized image to: {image.size}")
+            with stage("image_decode"):
+                # Load image and verify
+                image = Image.open(io.BytesIO(image_data))
+                image.load()
+                logger.info("Image loaded: %s pixels, mode: %s", image.size, image.mode)
+                
+                # Convert to RGB if necessary
+                if image.mode != 'RGB':
+                    image = image.convert('RGB')
+                    logger.debug("Converted image to RGB mode")
+                
+                # Resize if needed (maintain aspect ratio)
+                if image.width > 1200 or image.height > 800:
+                    image.thumbnail((1200, 800), Image.Resampling.LANCZOS)
+                    logger.debug("Resized image to: %s", image.size)
             
-            # Save to file
+            # Save to storage without blocking the event loop
             filename = f"{task_id}_panel_{panel_sequence}_imagen.png"
-            filepath = os.path.join(settings.IMAGES_DIR, filename)
-            
-            image.save(filepath, "PNG", quality=95, optimize=True)
-            logger.info(f"Image saved to: {filepath}")
+            with stage("image_encode"):
+                buffer = io.BytesIO()
+                image.save(buffer, "PNG", optimize=True)
+            filepath = await storage.write(filename, buffer.getvalue())
+            logger.info("Image saved to: %s", filepath)
             
             # Verify file was created
             if os.path.exists(filepath):
                 file_size = os.path.getsize(filepath)
-                logger.info(f"File verified: {filepath} ({file_size} bytes)")
+                logger.info("File verified: %s (%s bytes)", filepath, file_size)
+                manifest_store.record_file(task_id, filepath, "imagen", panel_sequence, generation_ms)
                 return filepath
             else:
                 raise Exception("File was not created successfully")
-                
+        
         except Exception as e:
-            logger.error(f"Error saving image: {e}")
+            logger.error("Error saving image: %s", e)
             raise
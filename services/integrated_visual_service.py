@@ -1,40 +1,61 @@
 # services/integrated_visual_service.py
 import asyncio
 import os
+import time
 import logging
-from typing import List, Tuple
-from PIL import Image, ImageDraw, ImageFont
+from typing import List, Optional, Tuple
+from PIL import Image, ImageDraw
 import io
 
 from services.imagen_service import ImagenService
 from services.gemini_service import GeminiService
-from models.schemas import VisualPanel, VisualStyle, ImageGenerationStatus
-from utils.config import settings
+from services.task_store import task_store
+from services.manifest_store import manifest_store
+from services.storage_service import storage
+from models.schemas import VisualPanel, VisualStyle, ImageGenerationStatus, OutputFormat
+from utils.metrics import PANELS, STORYBOARDS, record_stage, stage, start_stage_breakdown
+from utils.tracing import span
+from utils.memory_budget import Reservation
+from utils.text_layout import layout_text, draw_text_lines
+from utils.svg_canvas import SvgCanvas
 
 logger = logging.getLogger(__name__)
 
+IMAGEN_CONCURRENCY = 2  # Max concurrent image generations per storyboard
+
 class IntegratedVisualService:
     def __init__(self):
         logger.info("Initializing Integrated Visual Service...")
         self.imagen_service = ImagenService()
         self.gemini_service = GeminiService()
+        # Keep references to background upgrade tasks so they are not garbage collected
+        self._background_tasks = set()
         logger.info("Successfully initialized Integrated Visual Service")
     
     async def create_storyboard(self, prompt: str, style: VisualStyle, 
-                               panels_count: int, task_id: str) -> Tuple[List[VisualPanel], List[str], dict]:
+                               panels_count: int, task_id: str,
+                               output_format: OutputFormat = OutputFormat.PNG,
+                               progressive: bool = False,
+                               reservation: Optional[Reservation] = None) -> Tuple[List[VisualPanel], List[str], dict]:
         """
         Create complete storyboard with Gemini + Imagen v4
+        In progressive mode, local panels are returned immediately and upgraded
+        to Imagen images in the background (see the task status API); the
+        caller's memory reservation is then held until the upgrades finish.
         Returns: (panels, image_paths, generation_stats)
         """
-        logger.info(f"Creating storyboard - Task: {task_id}, Panels: {panels_count}, Style: {style.value}")
+        logger.info("Creating storyboard - Task: %s, Panels: %s, Style: %s", task_id, panels_count, style.value)
         
         generation_stats = {
             "total_panels": panels_count,
             "successful_generations": 0,
             "failed_generations": 0,
             "fallback_generations": 0,
-            "start_time": asyncio.get_event_loop().time()
+            "start_time": asyncio.get_event_loop().time(),
+            # Summed per stage; concurrent panels overlap, so totals can exceed total_time
+            "stage_breakdown": start_stage_breakdown()
         }
+        mode = "progressive" if progressive else "standard"
         
         try:
             # Step 1: Generate storyboard structure with Gemini
@@ -43,20 +64,31 @@ class IntegratedVisualService:
             
             if not panels:
                 logger.error("No panels generated by Gemini")
+                STORYBOARDS.inc(mode=mode, outcome="failed")
                 return [], [], generation_stats
             
-            logger.info(f"Generated {len(panels)} panels")
+            logger.info("Generated %s panels", len(panels))
+            
+            if progressive:
+                return await self._create_progressive_storyboard(
+                    panels, style, task_id, output_format, generation_stats, reservation
+                )
             
             # Step 2: Generate images for each panel with Imagen v4
             logger.info("Step 2: Generating images with Imagen v4...")
             image_paths = []
             
             # Process panels concurrently (but limit concurrency to avoid rate limits)
-            semaphore = asyncio.Semaphore(2)  # Max 2 concurrent image generations
+            semaphore = asyncio.Semaphore(IMAGEN_CONCURRENCY)
             
             async def generate_panel_with_semaphore(panel):
-                async with semaphore:
-                    return await self._generate_panel_image_with_fallback(panel, style, task_id)
+                with span("panel", sequence=panel.sequence):
+                    with stage("imagen_queue"):
+                        await semaphore.acquire()
+                    try:
+                        return await self._generate_panel_image_with_fallback(panel, style, task_id, output_format)
+                    finally:
+                        semaphore.release()
             
             # Generate all images
             generation_results = await asyncio.gather(
@@ -67,7 +99,7 @@ class IntegratedVisualService:
             # Process results
             for i, result in enumerate(generation_results):
                 if isinstance(result, Exception):
-                    logger.error(f"Panel {i+1} generation failed with exception: {result}")
+                    logger.error("Panel %s generation failed with exception: %s", i+1, result)
                     generation_stats["failed_generations"] += 1
                     image_paths.append(None)
                 else:
@@ -75,11 +107,11 @@ class IntegratedVisualService:
                     if image_path:
                         image_paths.append(image_path)
                         generation_stats["successful_generations"] += 1
-                        logger.info(f"Panel {i+1} generated successfully: {status}")
+                        logger.info("Panel %s generated successfully: %s", i+1, status)
                     else:
                         image_paths.append(None)
                         generation_stats["failed_generations"] += 1
-                        logger.error(f"Panel {i+1} generation failed: {status}")
+                        logger.error("Panel %s generation failed: %s", i+1, status)
             
             # Filter out None values and get corresponding panels
             valid_results = [(panel, path) for panel, path in zip(panels, image_paths) if path is not None]
@@ -89,122 +121,213 @@ class IntegratedVisualService:
                 generation_stats["end_time"] = asyncio.get_event_loop().time()
                 generation_stats["total_time"] = generation_stats["end_time"] - generation_stats["start_time"]
                 
-                logger.info(f"Storyboard creation completed: {len(final_paths)}/{len(panels)} panels successful")
+                logger.info("Storyboard creation completed: %s/%s panels successful", len(final_paths), len(panels))
+                STORYBOARDS.inc(mode=mode, outcome="completed")
                 return list(final_panels), list(final_paths), generation_stats
             else:
                 logger.error("No panels were successfully generated")
+                STORYBOARDS.inc(mode=mode, outcome="failed")
                 return [], [], generation_stats
                 
+        except asyncio.CancelledError:
+            # Client went away; pending panel tasks are cancelled with the gather
+            logger.info("Storyboard creation cancelled for task %s", task_id)
+            STORYBOARDS.inc(mode=mode, outcome="cancelled")
+            # In-flight Imagen calls left to finish still hold their memory
+            detached = self.imagen_service.detached_calls(task_id)
+            if reservation is not None and detached:
+                release = reservation.transfer()
+                asyncio.gather(*detached, return_exceptions=True).add_done_callback(lambda _: release())
+            raise
         except Exception as e:
-            logger.error(f"Error in storyboard creation: {e}")
+            logger.error("Error in storyboard creation: %s", e)
+            STORYBOARDS.inc(mode=mode, outcome="failed")
             generation_stats["end_time"] = asyncio.get_event_loop().time()
             return [], [], generation_stats
     
+    async def _create_progressive_storyboard(self, panels: List[VisualPanel], style: VisualStyle,
+                                             task_id: str, output_format: OutputFormat,
+                                             generation_stats: dict,
+                                             reservation: Optional[Reservation] = None) -> Tuple[List[VisualPanel], List[str], dict]:
+        """Render all panels locally right away and schedule their Imagen upgrades"""
+        logger.info("Step 2: Rendering %s local panels (progressive mode)...", len(panels))
+        
+        final_panels = []
+        final_paths = []
+        for panel in panels:
+            try:
+                with span("fallback", sequence=panel.sequence):
+                    final_paths.append(await self._create_fallback_panel(panel, style, task_id, output_format))
+                final_panels.append(panel)
+                generation_stats["fallback_generations"] += 1
+            except Exception as e:
+                logger.error("Local rendering failed for panel %s: %s", panel.sequence, e)
+                generation_stats["failed_generations"] += 1
+        
+        generation_stats["end_time"] = asyncio.get_event_loop().time()
+        generation_stats["total_time"] = generation_stats["end_time"] - generation_stats["start_time"]
+        generation_stats["progressive"] = True
+        generation_stats["pending_upgrades"] = len(final_panels)
+        
+        STORYBOARDS.inc(mode="progressive", outcome="completed" if final_panels else "failed")
+        if not final_panels:
+            logger.error("No panels were successfully generated")
+            return [], [], generation_stats
+        
+        task_store.update(
+            task_id, status="upgrading", progress=0,
+            message=f"Upgrading {len(final_panels)} panels with Imagen v4",
+            result={
+                "style": style.value,
+                "panels": [panel.model_dump(mode="json") for panel in final_panels],
+                "image_paths": list(final_paths),
+                "image_versions": [1] * len(final_paths),
+                "generation_stats": dict(generation_stats)
+            }
+        )
+        
+        upgrade = asyncio.create_task(self._upgrade_panels(final_panels, style, task_id))
+        self._background_tasks.add(upgrade)
+        upgrade.add_done_callback(self._background_tasks.discard)
+        if reservation is not None:
+            release = reservation.transfer()
+            upgrade.add_done_callback(lambda _: release())
+        
+        logger.info("Progressive storyboard ready: %s local panels, upgrades scheduled", len(final_paths))
+        return final_panels, final_paths, generation_stats
+    
+    async def _upgrade_panels(self, panels: List[VisualPanel], style: VisualStyle, task_id: str):
+        """Replace local panels with Imagen images as they complete"""
+        semaphore = asyncio.Semaphore(IMAGEN_CONCURRENCY)
+        completed = 0
+        upgraded = 0
+        
+        async def upgrade_panel(index: int, panel: VisualPanel):
+            nonlocal completed, upgraded
+            with span("panel.upgrade", sequence=panel.sequence):
+                with stage("imagen_queue"):
+                    await semaphore.acquire()
+                try:
+                    image_path, status = await self.imagen_service.generate_panel_image(panel, style, task_id)
+                except Exception as e:
+                    image_path, status = None, str(e)
+                finally:
+                    semaphore.release()
+            
+            completed += 1
+            task = task_store.get(task_id)
+            if task is None:
+                return
+            
+            result = task.result
+            if image_path and os.path.exists(image_path):
+                upgraded += 1
+                result["image_paths"][index] = image_path
+                result["image_versions"][index] += 1
+                result["panels"][index] = panel.model_dump(mode="json")
+                # The panel was counted as a fallback when its preview was rendered
+                result["generation_stats"]["fallback_generations"] -= 1
+                result["generation_stats"]["successful_generations"] += 1
+                logger.info("Panel %s upgraded to Imagen v4", panel.sequence)
+            else:
+                logger.warning("Panel %s keeps its local rendering: %s", panel.sequence, status)
+            
+            task_store.update(
+                task_id,
+                progress=int(100 * completed / len(panels)),
+                message=f"Upgraded {upgraded}/{len(panels)} panels with Imagen v4"
+            )
+        
+        await asyncio.gather(*[upgrade_panel(i, panel) for i, panel in enumerate(panels)])
+        
+        task = task_store.get(task_id)
+        if task is not None:
+            task.result["generation_stats"]["pending_upgrades"] = 0
+            task_store.update(task_id, status="completed", progress=100,
+                              message=f"Upgraded {upgraded}/{len(panels)} panels with Imagen v4")
+            manifest_store.save_task(task_id, task.result)
+        logger.info("Progressive upgrade finished for task %s: %s/%s panels", task_id, upgraded, len(panels))
+    
     async def _generate_panel_image_with_fallback(self, panel: VisualPanel, 
-                                                 style: VisualStyle, task_id: str) -> Tuple[str, str]:
+                                                 style: VisualStyle, task_id: str,
+                                                 output_format: OutputFormat = OutputFormat.PNG) -> Tuple[str, str]:
         """Generate panel image with fallback to text-based generation"""
         
         try:
             # Try Imagen v4 first
-            logger.info(f"Attempting Imagen v4 generation for panel {panel.sequence}")
+            logger.info("Attempting Imagen v4 generation for panel %s", panel.sequence)
             image_path, status = await self.imagen_service.generate_panel_image(panel, style, task_id)
             
             if image_path and os.path.exists(image_path):
-                logger.info(f"Imagen v4 successful for panel {panel.sequence}")
+                logger.info("Imagen v4 successful for panel %s", panel.sequence)
                 return image_path, f"Generated with Imagen v4: {status}"
             else:
-                logger.warning(f"Imagen v4 failed for panel {panel.sequence}, trying fallback")
+                logger.warning("Imagen v4 failed for panel %s, trying fallback", panel.sequence)
                 
         except Exception as e:
-            logger.error(f"Imagen v4 error for panel {panel.sequence}: {e}")
+            logger.error("Imagen v4 error for panel %s: %s", panel.sequence, e)
         
         # Fallback to text-based generation
         try:
-            logger.info(f"Using fallback generation for panel {panel.sequence}")
-            fallback_path = await self._create_fallback_panel(panel, style, task_id)
+            logger.info("Using fallback generation for panel %s", panel.sequence)
+            with span("fallback", sequence=panel.sequence):
+                fallback_path = await self._create_fallback_panel(panel, style, task_id, output_format)
             return fallback_path, "Generated with fallback method"
             
         except Exception as e:
-            logger.error(f"Fallback generation failed for panel {panel.sequence}: {e}")
+            logger.error("Fallback generation failed for panel %s: %s", panel.sequence, e)
             return None, f"All generation methods failed: {e}"
     
-    async def _create_fallback_panel(self, panel: VisualPanel, style: VisualStyle, task_id: str) -> str:
+    async def _create_fallback_panel(self, panel: VisualPanel, style: VisualStyle, task_id: str,
+                                     output_format: OutputFormat = OutputFormat.PNG) -> str:
         """Create fallback panel with text and basic graphics"""
         
-        logger.info(f"Creating fallback panel {panel.sequence}")
+        logger.info("Creating fallback panel %s", panel.sequence)
+        started = time.perf_counter()
         
-        # Create basic text-based panel
-        img = Image.new("RGB", (1200, 800), "white")
-        draw = ImageDraw.Draw(img)
+        # Create basic text-based panel (vector or raster, same drawing calls)
+        if output_format == OutputFormat.SVG:
+            img = draw = SvgCanvas(1200, 800, "white")
+        else:
+            img = Image.new("RGB", (1200, 800), "white")
+            draw = ImageDraw.Draw(img)
         
-        # Load fonts
-        try:
-            title_font = ImageFont.truetype("arial.ttf", 36)
-            text_font = ImageFont.truetype("arial.ttf", 24)
-        except:
-            title_font = ImageFont.load_default()
-            text_font = ImageFont.load_default()
-        
-        # Draw title
-        title_bbox = draw.textbbox((0, 0), panel.title, font=title_font)
-        title_width = title_bbox - title_bbox
-        title_x = (1200 - title_width) // 2
-        draw.text((title_x, 50), panel.title, fill="black", font=title_font)
-        
-        # Draw description
-        desc_lines = self._wrap_text(panel.description, 80)
-        y_pos = 150
-        for line in desc_lines:
-            line_bbox = draw.textbbox((0, 0), line, font=text_font)
-            line_width = line_bbox - line_bbox
-            line_x = (1200 - line_width) // 2
-            draw.text((line_x, y_pos), line, fill="gray", font=text_font)
-            y_pos += 30
-        
-        # Draw visual elements list
-        y_pos += 50
-        draw.text((100, y_pos), "Visual Elements:", fill="blue", font=text_font)
-        y_pos += 40
-        for element in panel.visual_elements:
-            draw.text((120, y_pos), f"-  {element}", fill="blue", font=text_font)
-            y_pos += 30
-        
-        # Draw text content
-        y_pos += 50
-        content_lines = self._wrap_text(panel.text_content, 80)
-        for line in content_lines:
-            line_bbox = draw.textbbox((0, 0), line, font=text_font)
-            line_width = line_bbox - line_bbox
-            line_x = (1200 - line_width) // 2
-            draw.text((line_x, y_pos), line, fill="black", font=text_font)
-            y_pos += 30
+        # Lay out title, description, element list and content in one pass
+        content_width = 1000
+        element_blocks = [
+            {"text": f"-  {element}", "size": 24, "fill": "blue", "align": "left", "x": 120,
+             "max_width": content_width - 20, "max_lines": 1, "min_size": 16, "line_height": 30}
+            for element in panel.visual_elements
+        ]
+        if element_blocks:
+            element_blocks[-1]["gap"] = 50
+        
+        lines, _ = layout_text([
+            {"text": panel.title, "size": 36, "min_size": 24, "max_lines": 2,
+             "max_width": content_width, "line_height": 45, "gap": 55, "fill": "black"},
+            {"text": panel.description, "size": 24, "min_size": 18, "max_lines": 6,
+             "max_width": content_width, "line_height": 30, "gap": 50, "fill": "gray"},
+            {"text": "Visual Elements:", "size": 24, "fill": "blue", "align": "left", "x": 100,
+             "line_height": 40},
+            *element_blocks,
+            {"text": panel.text_content, "size": 24, "min_size": 18, "max_lines": 4,
+             "max_width": content_width, "line_height": 30, "fill": "black"},
+        ], 1200, 50, max_y=800 - 30)
+        draw_text_lines(draw, lines)
         
         # Save fallback image
-        filename = f"{task_id}_panel_{panel.sequence}_fallback.png"
-        filepath = os.path.join(settings.IMAGES_DIR, filename)
-        img.save(filepath, quality=95)
+        filename = f"{task_id}_panel_{panel.sequence}_fallback.{output_format.value}"
+        if output_format == OutputFormat.SVG:
+            data = img.to_svg().encode("utf-8")
+        else:
+            buffer = io.BytesIO()
+            img.save(buffer, "PNG")
+            data = buffer.getvalue()
+        record_stage("fallback_render", time.perf_counter() - started)
+        filepath = await storage.write(filename, data)
         
-        logger.info(f"Fallback panel saved: {filepath}")
+        logger.info("Fallback panel saved: %s", filepath)
+        PANELS.inc(method="fallback")
+        manifest_store.record_file(task_id, filepath, "fallback", panel.sequence,
+                                   (time.perf_counter() - started) * 1000)
         return filepath
-    
-    def _wrap_text(self, text: str, width: int) -> List[str]:
-        """Wrap text to specified width"""
-        words = text.split()
-        lines = []
-        current_line = []
-        current_length = 0
-        
-        for word in words:
-            if current_length + len(word) + 1 <= width:
-                current_line.append(word)
-                current_length += len(word) + 1
-            else:
-                if current_line:
-                    lines.append(' '.join(current_line))
-                current_line = [word]
-                current_length = len(word)
-        
-        if current_line:
-            lines.append(' '.join(current_line))
-        
-        return lines
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import queue
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import List, Optional, Tuple
+
+from utils.config import settings
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS task_files (
+    filename TEXT PRIMARY KEY,
+    task_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    panel_sequence INTEGER,
+    method TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    generation_ms REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS task_files_task_id ON task_files (task_id);
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+class ManifestStore:
+    """
+    SQLite index of the files each task produced and of finished task
+    results. Lookups by task id hit an index instead of scanning IMAGES_DIR,
+    and finished tasks outlive the in-memory task store.
+    
+    Connections are per thread and per process, so panel render workers
+    can record their files too. Recording never raises: a manifest problem
+    must not fail a generation.
+    
+    Writes made on an event loop are handed to a background writer thread,
+    which commits whatever has queued up in one transaction, so request
+    handlers never wait on SQLite locks or fsyncs. Reads first wait for the
+    writes queued before them, so they always see them; reads block, so call
+    them off the event loop. Writes from other threads and processes (render
+    workers) run directly.
+    """
+    
+    def __init__(self, path: str = settings.MANIFEST_DB):
+        self.path = path
+        self._local = threading.local()
+        self._connection().executescript(_SCHEMA)
+        self._queue: "queue.SimpleQueue[Tuple[str, tuple, str]]" = queue.SimpleQueue()
+        # Writes are numbered as they are queued; reads wait until their number is committed
+        self._queued = 0
+        self._committed = 0
+        self._progress = threading.Condition()
+        self._writer = None
+        self._writer_pid = None
+    
+    def record_file(self, task_id: str, path: str, method: str,
+                    panel_sequence: Optional[int] = None, generation_ms: Optional[float] = None):
+        """Record a generated file once it is fully written"""
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning("Could not record %s in manifest: %s", path, e)
+            return
+        self._write(
+            "INSERT OR REPLACE INTO task_files "
+            "(filename, task_id, path, panel_sequence, method, size, generation_ms, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (os.path.basename(path), task_id, path, panel_sequence, method, size, generation_ms, time.time()),
+            f"record {path}"
+        )
+    
+    def task_files(self, task_id: str) -> List[dict]:
+        """All recorded files of a task, in panel order"""
+        self._wait_for_writes()
+        rows = self._connection().execute(
+            "SELECT filename, path, panel_sequence, method, size, generation_ms, created_at "
+            "FROM task_files WHERE task_id = ? ORDER BY panel_sequence, created_at",
+            (task_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def task_id_for(self, filename: str) -> Optional[str]:
+        """Task that produced a file, if recorded"""
+        self._wait_for_writes()
+        row = self._connection().execute(
+            "SELECT task_id FROM task_files WHERE filename = ?", (filename,)
+        ).fetchone()
+        return row["task_id"] if row else None
+    
+    def remove_file(self, filename: str):
+        """Forget a file that was deleted"""
+        self._write("DELETE FROM task_files WHERE filename = ?", (filename,), f"remove {filename}")
+    
+    def save_task(self, task_id: str, result: dict):
+        """Persist a finished task's result (panels, image paths, stats)"""
+        try:
+            # Serialized now, so later changes to the live result are not picked up
+            encoded = json.dumps(result, default=str)
+        except (TypeError, ValueError) as e:
+            logger.warning("Could not save task %s to manifest: %s", task_id, e)
+            return
+        self._write(
+            "INSERT OR REPLACE INTO tasks (task_id, result, updated_at) VALUES (?, ?, ?)",
+            (task_id, encoded, time.time()), f"save task {task_id}"
+        )
+    
+    def load_task(self, task_id: str) -> Optional[dict]:
+        """A finished task's persisted result, if any"""
+        self._wait_for_writes()
+        row = self._connection().execute(
+            "SELECT result FROM tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        return json.loads(row["result"]) if row else None
+    
+    def _write(self, sql: str, params: tuple, description: str):
+        """Run a write, through the writer thread when called on an event loop"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self._execute_batch([(sql, params, description)])
+            return
+        
+        with self._progress:
+            self._queued += 1
+            if self._writer is None or not self._writer.is_alive() or self._writer_pid != os.getpid():
+                self._writer = threading.Thread(target=self._write_forever, name="manifest-writer", daemon=True)
+                self._writer_pid = os.getpid()
+                self._writer.start()
+        self._queue.put((sql, params, description))
+    
+    def _write_forever(self):
+        """Commit queued writes, batching whatever has queued up into one transaction"""
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._execute_batch(batch)
+            except Exception as e:
+                logger.error("Manifest writer failed on %d changes: %s", len(batch), e)
+            finally:
+                # Counted even when lost, so waiting reads never hang
+                with self._progress:
+                    self._committed += len(batch)
+                    self._progress.notify_all()
+    
+    def _execute_batch(self, batch: List[Tuple[str, tuple, str]]):
+        try:
+            connection = self._connection()
+            connection.execute("BEGIN")
+        except sqlite3.Error as e:
+            logger.warning("Could not write %d manifest changes: %s", len(batch), e)
+            return
+        for sql, params, description in batch:
+            try:
+                connection.execute(sql, params)
+            except sqlite3.Error as e:
+                logger.warning("Could not %s in manifest: %s", description, e)
+        try:
+            connection.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.warning("Could not commit %d manifest changes: %s", len(batch), e)
+            try:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+            except sqlite3.Error as e:
+                logger.warning("Could not roll back manifest changes: %s", e)
+    
+    def _wait_for_writes(self):
+        """Block until the writes queued before this call are committed"""
+        with self._progress:
+            target = self._queued
+            self._progress.wait_for(lambda: self._committed >= target)
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Connection for the current thread, reopened after a fork"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+manifest_store = ManifestStore()
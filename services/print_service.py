@@ -0,0 +1,145 @@
+import io
+import math
+import logging
+from typing import Iterator, List, Optional
+
+from PIL import Image, ImageDraw, ImageOps
+
+from services.visual_service import VisualService, STYLE_COLORS
+from models.schemas import VisualPanel, VisualStyle
+from utils.pdf_writer import PdfStreamWriter, pdf_text
+from utils.text_layout import fit_text, measure_text
+
+logger = logging.getLogger(__name__)
+
+# Contact sheet geometry
+SHEET_CELL_SIZE = (400, 267)
+SHEET_MARGIN = 24
+SHEET_GAP = 16
+SHEET_TITLE_HEIGHT = 36
+
+# PDF pages are A4 landscape, in points
+PAGE_SIZE = (842, 595)
+PAGE_MARGIN = 36
+PAGE_TITLE_SIZE = 20
+PAGE_FOOTER_SIZE = 9
+PAGE_DPI = 144  # Images are downscaled to this print resolution
+PAGE_JPEG_QUALITY = 85
+
+class PrintService:
+    """Export storyboards as printable contact sheets and PDFs"""
+    
+    def __init__(self):
+        self.visual_service = VisualService()
+    
+    def contact_sheet(self, panels: List[VisualPanel], style: VisualStyle,
+                      image_paths: Optional[List[str]] = None, columns: Optional[int] = None) -> bytes:
+        """
+        Composite the panels into one titled grid image (PNG).
+        Panels are decoded and shrunk one at a time, so only the sheet itself stays in memory.
+        """
+        image_paths = image_paths or [None] * len(panels)
+        columns = max(1, min(columns or math.ceil(math.sqrt(len(panels))), len(panels)))
+        rows = math.ceil(len(panels) / columns)
+        cell_width, cell_height = SHEET_CELL_SIZE
+        pitch_x = cell_width + SHEET_GAP
+        pitch_y = cell_height + SHEET_TITLE_HEIGHT + SHEET_GAP
+        colors = STYLE_COLORS[style]
+        
+        sheet = Image.new(
+            "RGB",
+            (2 * SHEET_MARGIN + columns * pitch_x - SHEET_GAP,
+             2 * SHEET_MARGIN + rows * pitch_y - SHEET_GAP),
+            colors['bg']
+        )
+        draw = ImageDraw.Draw(sheet)
+        
+        for i, (panel, image_path) in enumerate(zip(panels, image_paths)):
+            x = SHEET_MARGIN + (i % columns) * pitch_x
+            y = SHEET_MARGIN + (i // columns) * pitch_y
+            
+            image = self.visual_service.load_panel_image(panel, style, image_path)
+            thumbnail = ImageOps.pad(image, SHEET_CELL_SIZE, Image.LANCZOS, color="white")
+            image.close()
+            sheet.paste(thumbnail, (x, y))
+            draw.rectangle([x, y, x + cell_width - 1, y + cell_height - 1], outline=colors['border'])
+            
+            font, lines = fit_text(f"{panel.sequence}. {panel.title}", cell_width - 16, 18,
+                                   max_lines=1, min_size=12)
+            if lines:
+                text_x = x + (cell_width - measure_text(lines[0], font)) // 2
+                draw.text((text_x, y + cell_height + 8), lines[0], fill=colors['text'], font=font)
+        
+        buffer = io.BytesIO()
+        sheet.save(buffer, "PNG", optimize=True)
+        logger.info("Built %sx%s contact sheet for %s panels", columns, rows, len(panels))
+        return buffer.getvalue()
+    
+    def pdf_chunks(self, panels: List[VisualPanel], style: VisualStyle,
+                   image_paths: Optional[List[str]] = None) -> Iterator[bytes]:
+        """
+        Generate a multi-page PDF, one panel per page, as byte chunks.
+        Each page's image is decoded, JPEG-encoded and released before the
+        next one is loaded, so memory use is bounded by a single panel.
+        """
+        image_paths = image_paths or [None] * len(panels)
+        writer = PdfStreamWriter()
+        page_width, page_height = PAGE_SIZE
+        
+        # Fixed objects: 1 catalog, 2 page tree, 3-4 fonts; each page then
+        # takes three objects (image, content stream, page)
+        yield writer.header()
+        yield writer.object(3, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+        yield writer.object(4, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        
+        box_width = page_width - 2 * PAGE_MARGIN
+        box_height = page_height - 2 * PAGE_MARGIN - PAGE_TITLE_SIZE - PAGE_FOOTER_SIZE - 24
+        max_pixels = (round(box_width * PAGE_DPI / 72), round(box_height * PAGE_DPI / 72))
+        
+        page_numbers = []
+        for i, (panel, image_path) in enumerate(zip(panels, image_paths)):
+            image_number, content_number, page_number = 5 + 3 * i, 6 + 3 * i, 7 + 3 * i
+            
+            image = self.visual_service.load_panel_image(panel, style, image_path)
+            image.thumbnail(max_pixels, Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=PAGE_JPEG_QUALITY, optimize=True)
+            pixel_width, pixel_height = image.size
+            image.close()
+            
+            yield writer.stream(
+                image_number,
+                f"/Type /XObject /Subtype /Image /Width {pixel_width} /Height {pixel_height} "
+                f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode",
+                buffer.getvalue()
+            )
+            del buffer
+            
+            # Fit the image in the box below the title, centered
+            scale = min(box_width / pixel_width, box_height / pixel_height)
+            draw_width, draw_height = pixel_width * scale, pixel_height * scale
+            draw_x = PAGE_MARGIN + (box_width - draw_width) / 2
+            draw_y = PAGE_MARGIN + PAGE_FOOTER_SIZE + 12 + (box_height - draw_height) / 2
+            title_y = page_height - PAGE_MARGIN - PAGE_TITLE_SIZE
+            
+            content = (
+                f"q {draw_width:.2f} 0 0 {draw_height:.2f} {draw_x:.2f} {draw_y:.2f} cm /Im Do Q\n"
+                f"BT /F1 {PAGE_TITLE_SIZE} Tf {PAGE_MARGIN} {title_y} Td "
+                f"{pdf_text(f'{panel.sequence}. {panel.title}')} Tj ET\n"
+                f"BT /F2 {PAGE_FOOTER_SIZE} Tf {PAGE_MARGIN} {PAGE_MARGIN} Td "
+                f"{pdf_text(f'Panel {i + 1} of {len(panels)}')} Tj ET\n"
+            )
+            yield writer.stream(content_number, "", content.encode("latin-1"))
+            yield writer.object(
+                page_number,
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width} {page_height}] "
+                f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> /XObject << /Im {image_number} 0 R >> >> "
+                f"/Contents {content_number} 0 R >>"
+            )
+            page_numbers.append(page_number)
+        
+        kids = " ".join(f"{number} 0 R" for number in page_numbers)
+        yield writer.object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_numbers)} >>")
+        yield writer.object(1, "<< /Type /Catalog /Pages 2 0 R >>")
+        yield writer.trailer(root=1)
+        logger.info("Streamed %s page PDF (%s bytes)", len(page_numbers), writer.offset)
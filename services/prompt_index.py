@@ -0,0 +1,179 @@
+import re
+import hashlib
+import logging
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from utils.config import settings
+from utils.metrics import PROMPT_REUSE, PROMPT_REUSE_SUSPECT
+
+logger = logging.getLogger(__name__)
+
+SIMHASH_BITS = 64
+LSH_BANDS = 8  # Near-duplicates within BANDS - 1 differing bits always share a band
+BAND_BITS = SIMHASH_BITS // LSH_BANDS
+AUDIT_LOG_SIZE = 20
+
+STOP_WORDS = frozenset("""
+a an and are as at be by for from has have in into is it its of on or that the their them
+then there these this those to was were will with showing shows show include including
+""".split())
+
+def normalize_tokens(text: str) -> FrozenSet[str]:
+    """
+    Bag of content words: lowercased, punctuation and stop-words dropped,
+    simple plurals folded. Word order and repetition do not matter.
+    """
+    tokens = set()
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        if token in STOP_WORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.add(token)
+    return frozenset(tokens)
+
+def simhash(tokens: FrozenSet[str]) -> int:
+    """64-bit SimHash of a token set"""
+    weights = [0] * SIMHASH_BITS
+    for token in tokens:
+        value = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+@dataclass
+class IndexedPrompt:
+    key: int
+    style: str
+    tokens: FrozenSet[str]
+    elements: FrozenSet[str]
+    fingerprint: int
+    filename: str
+    text: str
+
+class PromptIndex:
+    """
+    Bounded, in-memory locality-sensitive index of prompts whose images were
+    generated, for reusing an image instead of generating a near-identical one.
+    
+    Prompts are reduced to a token set and a SimHash; the hash is split into
+    bands, and prompts sharing any band with the same style are candidates.
+    A candidate is a match when the Jaccard similarity of the token sets
+    reaches the threshold. The least recently used prompts are evicted once
+    max_entries is reached.
+    
+    Every reuse is audited: a match whose visual elements differ from the
+    source panel's is counted as a suspect reuse, to help tune the threshold.
+    """
+    
+    def __init__(self, threshold: float = settings.PROMPT_REUSE_THRESHOLD,
+                 max_entries: int = settings.PROMPT_INDEX_SIZE):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, IndexedPrompt]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, int], Set[int]] = {}
+        self._next_key = 0
+        self.audit_log = deque(maxlen=AUDIT_LOG_SIZE)
+        self.stats = {
+            "hits": 0,
+            "exact_hits": 0,
+            "misses": 0,
+            "stale": 0,
+            "evictions": 0,
+            "suspect_reuses": 0,
+            "indexed": 0,
+        }
+    
+    @property
+    def enabled(self) -> bool:
+        return 0 < self.threshold <= 1 and self.max_entries > 0
+    
+    def find(self, style: str, text: str, elements: List[str]) -> Optional[IndexedPrompt]:
+        """Most similar indexed prompt at or above the threshold, if any"""
+        if not self.enabled:
+            return None
+        
+        tokens = normalize_tokens(text)
+        candidates = set()
+        for band_key in self._band_keys(style, simhash(tokens)):
+            candidates |= self._buckets.get(band_key, set())
+        
+        best, best_similarity = None, 0.0
+        for key in candidates:
+            entry = self._entries[key]
+            similarity = _jaccard(tokens, entry.tokens)
+            if similarity > best_similarity:
+                best, best_similarity = entry, similarity
+        
+        if best is None or best_similarity < self.threshold:
+            self.stats["misses"] += 1
+            PROMPT_REUSE.inc(result="miss")
+            return None
+        
+        self._entries.move_to_end(best.key)
+        self.stats["hits"] += 1
+        if best_similarity == 1.0:
+            self.stats["exact_hits"] += 1
+            PROMPT_REUSE.inc(result="exact")
+        else:
+            PROMPT_REUSE.inc(result="near")
+            suspect = normalize_tokens(" ".join(elements)) != best.elements
+            if suspect:
+                self.stats["suspect_reuses"] += 1
+                PROMPT_REUSE_SUSPECT.inc()
+            self.audit_log.append({
+                "similarity": round(best_similarity, 3),
+                "suspect": suspect,
+                "prompt": text,
+                "reused_prompt": best.text,
+                "reused_file": best.filename,
+            })
+        logger.info("Prompt matches %s (similarity %.2f)", best.filename, best_similarity)
+        return best
+    
+    def add(self, style: str, text: str, elements: List[str], filename: str):
+        """Index the prompt of a freshly generated image"""
+        if not self.enabled:
+            return
+        
+        tokens = normalize_tokens(text)
+        entry = IndexedPrompt(self._next_key, style, tokens, normalize_tokens(" ".join(elements)),
+                              simhash(tokens), filename, text)
+        self._next_key += 1
+        self._entries[entry.key] = entry
+        for band_key in self._band_keys(style, entry.fingerprint):
+            self._buckets.setdefault(band_key, set()).add(entry.key)
+        
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+        self.stats["indexed"] = len(self._entries)
+    
+    def discard(self, entry: IndexedPrompt):
+        """Forget a prompt whose image no longer exists"""
+        if entry.key in self._entries:
+            self._remove(entry.key)
+            self.stats["stale"] += 1
+            self.stats["indexed"] = len(self._entries)
+    
+    def _remove(self, key: int):
+        entry = self._entries.pop(key)
+        for band_key in self._band_keys(entry.style, entry.fingerprint):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+    
+    def _band_keys(self, style: str, fingerprint: int):
+        mask = (1 << BAND_BITS) - 1
+        return [(style, band, fingerprint >> (band * BAND_BITS) & mask) for band in range(LSH_BANDS)]
+
+def _jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+prompt_index = PromptIndex()
@@ -0,0 +1,263 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from services.task_store import task_store
+from services.manifest_store import manifest_store
+from services.storage_service import LocalStorage, storage
+from utils.config import settings
+
+logger = logging.getLogger(__name__)
+
+def task_id_of(filename: str) -> str:
+    """Task id encoded in a generated file name ({task_id}_panel_...)"""
+    return filename.split("_panel_", 1)[0]
+
+class RetentionService:
+    """
+    Keep a file store within a maximum age and a total byte budget,
+    evicting least recently served files first. Files of tasks that are
+    still running are never evicted.
+    
+    The store is indexed incrementally: each pass scans at most scan_batch
+    files and resumes where the previous pass stopped, so a pass costs the
+    same however many files the store holds.
+    """
+    
+    def __init__(self, file_storage: LocalStorage = storage,
+                 max_age_hours: float = settings.RETENTION_MAX_AGE_HOURS,
+                 max_bytes: int = settings.RETENTION_MAX_BYTES,
+                 scan_batch: int = settings.RETENTION_SCAN_BATCH):
+        self.storage = file_storage
+        self.max_age_seconds = max_age_hours * 3600
+        self.max_bytes = max_bytes
+        self.scan_batch = scan_batch
+        
+        # name -> [size, mtime, last access]
+        self._files: Dict[str, List[float]] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._scanner = None
+        self._seen = set()
+        
+        self.stats = {
+            "passes": 0,
+            "deleted_files": 0,
+            "reclaimed_bytes": 0,
+            "tracked_files": 0,
+            "tracked_bytes": 0,
+        }
+    
+    def touch(self, filename: str):
+        """Record that a file was just served, for LRU eviction"""
+        with self._lock:
+            entry = self._files.get(filename)
+            if entry:
+                entry[2] = time.time()
+    
+    def record_file(self, path: str):
+        """Index a newly written file without waiting for the scanner to reach it"""
+        try:
+            file_stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        self._upsert(os.path.basename(path), file_stat.st_size, file_stat.st_mtime, file_stat.st_mtime)
+    
+    def run_pass(self) -> dict:
+        """Advance the index scan and evict expired and over-budget files"""
+        scanned = self._scan_batch()
+        now = time.time()
+        deleted, reclaimed = 0, 0
+        
+        if self.max_age_seconds > 0:
+            with self._lock:
+                expired = [
+                    name for name, (_, mtime, _) in self._files.items()
+                    if now - mtime > self.max_age_seconds
+                ]
+            for name in expired:
+                freed = self._evict(name)
+                if freed is not None:
+                    deleted += 1
+                    reclaimed += freed
+        
+        if self.max_bytes > 0 and self._total_bytes > self.max_bytes:
+            # Heapify is linear; only the files actually evicted pay log n each
+            with self._lock:
+                by_last_access = [(entry[2], name) for name, entry in self._files.items()]
+            heapq.heapify(by_last_access)
+            while by_last_access and self._total_bytes > self.max_bytes:
+                _, name = heapq.heappop(by_last_access)
+                freed = self._evict(name)
+                if freed is not None:
+                    deleted += 1
+                    reclaimed += freed
+        
+        with self._lock:
+            self.stats["passes"] += 1
+            self.stats["deleted_files"] += deleted
+            self.stats["reclaimed_bytes"] += reclaimed
+            self.stats["tracked_files"] = len(self._files)
+            self.stats["tracked_bytes"] = self._total_bytes
+        
+        report = {"scanned": scanned, "deleted_files": deleted, "reclaimed_bytes": reclaimed}
+        if deleted:
+            logger.info("Retention pass reclaimed %d bytes from %d files (%d bytes tracked)",
+                        reclaimed, deleted, self._total_bytes)
+        else:
+            logger.debug("Retention pass: %s", report)
+        return report
+    
+    async def run_forever(self, interval: int = settings.RETENTION_INTERVAL_SECONDS):
+        """Run retention passes in the background until cancelled"""
+        logger.info("Starting retention for %s: max age %gh, budget %d bytes",
+                    self.storage.root, self.max_age_seconds / 3600, self.max_bytes)
+        while True:
+            try:
+                await asyncio.to_thread(self.run_pass)
+            except Exception as e:
+                logger.error("Retention pass failed: %s", e)
+            await asyncio.sleep(interval)
+    
+    def _scan_batch(self) -> int:
+        """Index up to scan_batch stored files, resuming the previous sweep"""
+        if self._scanner is None:
+            self._scanner = self.storage.scan()
+            with self._lock:
+                self._seen = set()
+        
+        scanned = 0
+        while scanned < self.scan_batch:
+            entry = next(self._scanner, None)
+            if entry is None:
+                self._finish_sweep()
+                break
+            scanned += 1
+            try:
+                file_stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            self._upsert(entry.name, file_stat.st_size, file_stat.st_mtime,
+                         max(file_stat.st_atime, file_stat.st_mtime))
+        return scanned
+    
+    def _finish_sweep(self):
+        """Close a completed sweep and forget files that disappeared during it"""
+        self._scanner.close()
+        self._scanner = None
+        with self._lock:
+            for name in set(self._files) - self._seen:
+                self._total_bytes -= self._files.pop(name)[0]
+            self._seen = set()
+    
+    def _upsert(self, name: str, size: int, mtime: float, last_access: float):
+        """Index a file and mark it seen, so the current sweep does not drop it"""
+        with self._lock:
+            self._seen.add(name)
+            entry = self._files.get(name)
+            if entry is None:
+                self._files[name] = [size, mtime, last_access]
+                self._total_bytes += size
+            else:
+                self._total_bytes += size - entry[0]
+                entry[0], entry[1] = size, mtime
+                entry[2] = max(entry[2], last_access)
+    
+    def _evict(self, name: str) -> Optional[int]:
+        """Delete this node's copy of a file unless its task is in flight; returns bytes freed or None"""
+        task_id = manifest_store.task_id_for(name) or task_id_of(name)
+        if task_store.is_active(task_id):
+            return None
+        
+        # Shared backends keep the object for other nodes; only the local cache copy goes
+        try:
+            removed = self.storage.evict_local(name)
+        except Exception as e:
+            logger.warning("Could not evict %s: %s", name, e)
+            return None
+        
+        if not self.storage.shared:
+            manifest_store.remove_file(name)
+        with self._lock:
+            entry = self._files.pop(name, None)
+            if entry is None:
+                return None
+            self._total_bytes -= entry[0]
+        if not removed:
+            # Already gone; nothing reclaimed by this pass
+            return 0
+        logger.debug("Evicted %s (%d bytes)", name, entry[0])
+        return entry[0]
+
+class DirectorySweeper:
+    """
+    Keep a cache directory (and its subdirectories) within a maximum age and
+    byte budget, deleting the least recently modified files first. Files
+    modified within min_idle_seconds are skipped, so an export in progress
+    never loses its inputs; readers refresh a cached file's mtime on reuse.
+    """
+    
+    def __init__(self, root: str, max_age_hours: float, max_bytes: int, min_idle_seconds: float = 600):
+        self.root = root
+        self.max_age_seconds = max_age_hours * 3600
+        self.max_bytes = max_bytes
+        self.min_idle_seconds = min_idle_seconds
+        self.stats = {"passes": 0, "deleted_files": 0, "reclaimed_bytes": 0, "tracked_bytes": 0}
+    
+    def run_pass(self) -> dict:
+        """Delete expired files, then the oldest ones until the directory fits its budget"""
+        now = time.time()
+        files = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    file_stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((file_stat.st_mtime, file_stat.st_size, path))
+        
+        total = sum(size for _, size, _ in files)
+        deleted, reclaimed = 0, 0
+        for mtime, size, path in sorted(files):
+            idle = now - mtime
+            if idle < self.min_idle_seconds:
+                break
+            expired = self.max_age_seconds > 0 and idle > self.max_age_seconds
+            over_budget = self.max_bytes > 0 and total > self.max_bytes
+            if not (expired or over_budget):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= size
+            deleted += 1
+            reclaimed += size
+        
+        self.stats["passes"] += 1
+        self.stats["deleted_files"] += deleted
+        self.stats["reclaimed_bytes"] += reclaimed
+        self.stats["tracked_bytes"] = total
+        if deleted:
+            logger.info("Swept %d files (%d bytes) from %s", deleted, reclaimed, self.root)
+        return {"deleted_files": deleted, "reclaimed_bytes": reclaimed}
+    
+    async def run_forever(self, interval: int = settings.RETENTION_INTERVAL_SECONDS):
+        """Run sweeps in the background until cancelled"""
+        while True:
+            try:
+                await asyncio.to_thread(self.run_pass)
+            except Exception as e:
+                logger.error("Sweep of %s failed: %s", self.root, e)
+            await asyncio.sleep(interval)
+
+retention_service = RetentionService()
+
+# Joined animations and their cached panel segments
+video_cache_sweeper = DirectorySweeper(settings.VIDEOS_DIR, settings.RETENTION_MAX_AGE_HOURS,
+                                       settings.VIDEO_CACHE_MAX_BYTES)
@@ -0,0 +1,146 @@
+import io
+import logging
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from services.visual_service import VisualService
+from models.schemas import VisualPanel, VisualStyle, AnimatedImageFormat
+
+logger = logging.getLogger(__name__)
+
+# Slideshow geometry and timing
+SLIDESHOW_SIZE = (800, 534)  # At full quality; panels are letterboxed to fit
+PANEL_HOLD_MS = 2500
+TRANSITION_FRAMES = 5
+TRANSITION_FRAME_MS = 80
+
+# Palette slot reserved for "unchanged since the previous frame" in delta frames
+TRANSPARENT_INDEX = 255
+
+# Encoding attempts from best to smallest: (scale, palette colors, WebP quality)
+QUALITY_LADDER = [
+    (1.0, 255, 80),
+    (0.75, 255, 70),
+    (0.75, 128, 60),
+    (0.5, 128, 50),
+    (0.5, 64, 40),
+    (0.35, 64, 30),
+]
+
+MEDIA_TYPES = {
+    AnimatedImageFormat.GIF: "image/gif",
+    AnimatedImageFormat.APNG: "image/apng",
+    AnimatedImageFormat.WEBP: "image/webp",
+}
+
+class SlideshowService:
+    """Export storyboards as compact animated images for LMS embeds"""
+    
+    def __init__(self):
+        self.visual_service = VisualService()
+    
+    def export(self, panels: List[VisualPanel], style: VisualStyle, image_format: AnimatedImageFormat,
+               image_paths: Optional[List[str]] = None, transitions: bool = True,
+               max_bytes: Optional[int] = None) -> bytes:
+        """
+        Encode the panels as an animated GIF, APNG or WebP slideshow.
+        With max_bytes, steps down size and palette/quality until the result
+        fits, returning the smallest attempt if none does.
+        """
+        image_paths = image_paths or [None] * len(panels)
+        stills = [
+            ImageOps.pad(self.visual_service.load_panel_image(panel, style, image_path), SLIDESHOW_SIZE,
+                         Image.LANCZOS, color="white")
+            for panel, image_path in zip(panels, image_paths)
+        ]
+        
+        smallest = None
+        for scale, colors, quality in QUALITY_LADDER:
+            size = (round(SLIDESHOW_SIZE[0] * scale), round(SLIDESHOW_SIZE[1] * scale))
+            scaled = [still.resize(size, Image.LANCZOS) if scale != 1.0 else still for still in stills]
+            data = self._encode(scaled, image_format, transitions, colors, quality)
+            logger.info("Encoded %s slideshow at %dx%d, %d colors, quality %d: %d bytes",
+                        image_format.value, size[0], size[1], colors, quality, len(data))
+            
+            if smallest is None or len(data) < len(smallest):
+                smallest = data
+            if max_bytes is None or len(data) <= max_bytes:
+                return data
+        
+        logger.warning("Slideshow does not fit in %s bytes, returning %s bytes", max_bytes, len(smallest))
+        return smallest
+    
+    def _frames(self, stills: List[Image.Image], transitions: bool) -> List[Tuple[Image.Image, int]]:
+        """Build (frame, duration ms) pairs, merging consecutive identical frames"""
+        frames = []
+        for i, still in enumerate(stills):
+            frames.append((still, PANEL_HOLD_MS))
+            if transitions and i + 1 < len(stills):
+                for step in range(1, TRANSITION_FRAMES + 1):
+                    blended = Image.blend(still, stills[i + 1], step / (TRANSITION_FRAMES + 1))
+                    frames.append((blended, TRANSITION_FRAME_MS))
+        
+        deduplicated = [frames[0]]
+        for frame, duration in frames[1:]:
+            previous, previous_duration = deduplicated[-1]
+            if frame.tobytes() == previous.tobytes():
+                deduplicated[-1] = (previous, previous_duration + duration)
+            else:
+                deduplicated.append((frame, duration))
+        return deduplicated
+    
+    def _encode(self, stills: List[Image.Image], image_format: AnimatedImageFormat,
+                transitions: bool, colors: int, quality: int) -> bytes:
+        """Encode one attempt of the slideshow"""
+        frames = self._frames(stills, transitions)
+        images = [frame for frame, _ in frames]
+        durations = [duration for _, duration in frames]
+        buffer = io.BytesIO()
+        
+        if image_format == AnimatedImageFormat.WEBP:
+            # libwebp computes changed sub-rectangles and blending itself
+            images[0].save(
+                buffer, "WEBP", save_all=True, append_images=images[1:], duration=durations,
+                loop=0, quality=quality, method=4, minimize_size=True, allow_mixed=True
+            )
+            return buffer.getvalue()
+        
+        images = self._delta_frames(images, stills, colors)
+        options = dict(save_all=True, append_images=images[1:], duration=durations,
+                       loop=0, transparency=TRANSPARENT_INDEX)
+        if image_format == AnimatedImageFormat.GIF:
+            images[0].save(buffer, "GIF", disposal=1, optimize=False, **options)
+        else:
+            images[0].save(buffer, "PNG", disposal=0, blend=1, **options)
+        return buffer.getvalue()
+    
+    def _delta_frames(self, images: List[Image.Image], stills: List[Image.Image],
+                      colors: int) -> List[Image.Image]:
+        """
+        Quantize every frame to one global palette built from the panels, then
+        mark pixels unchanged since the previous frame as transparent, so each
+        frame only carries its changed region and compresses to long runs.
+        """
+        montage = Image.new("RGB", (stills[0].width, stills[0].height * len(stills)))
+        for i, still in enumerate(stills):
+            montage.paste(still, (0, i * still.height))
+        palette = montage.quantize(min(colors, TRANSPARENT_INDEX), method=Image.Quantize.MEDIANCUT)
+        # Pad to 256 entries so the transparent slot exists in every container
+        palette_data = palette.getpalette()
+        palette_data += [0] * (768 - len(palette_data))
+        
+        delta_frames = []
+        previous = None
+        for image in images:
+            indexed = np.asarray(image.quantize(palette=palette, dither=Image.Dither.NONE))
+            delta = indexed.copy()
+            if previous is not None:
+                delta[indexed == previous] = TRANSPARENT_INDEX
+            previous = indexed
+            
+            frame = Image.fromarray(delta, "P")
+            frame.putpalette(palette_data)
+            delta_frames.append(frame)
+        return delta_frames
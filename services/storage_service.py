@@ -0,0 +1,253 @@
+import os
+import hmac
+import uuid
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Optional
+from urllib.parse import quote, urlsplit
+
+import aiofiles
+import aiofiles.os
+import httpx
+
+from utils.config import settings
+from utils.metrics import stage
+from utils.logging_utils import truncated
+
+logger = logging.getLogger(__name__)
+
+class LocalStorage:
+    """
+    Generated files on the local filesystem, spread over hash-prefix
+    subdirectories (root/ab/cd/name) so no single directory grows large
+    enough to slow down file creation and lookups.
+    
+    Writes go to a hidden temp file in the target directory and are renamed
+    into place, so readers never see a partial file. Files written by older
+    versions directly under root are still found.
+    """
+    
+    shared = False  # Whether other nodes can still serve a file after evict_local
+    
+    def __init__(self, root: str = settings.IMAGES_DIR, shard_depth: int = settings.STORAGE_SHARD_DEPTH):
+        self.root = root
+        self.shard_depth = shard_depth
+    
+    def path(self, name: str) -> str:
+        """Local path of a file; raises ValueError for names that could escape the store"""
+        _check_name(name)
+        digest = hashlib.blake2b(name.encode(), digest_size=8).hexdigest()
+        shards = [digest[2 * i:2 * i + 2] for i in range(self.shard_depth)]
+        return os.path.join(self.root, *shards, name)
+    
+    def write_sync(self, name: str, data: bytes) -> str:
+        """Atomically write a file and return its local path (for worker processes)"""
+        path = self.path(name)
+        tmp_path = self._temp_path(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return path
+    
+    async def write(self, name: str, data: bytes) -> str:
+        """Atomically write a file without blocking the event loop; returns its local path"""
+        path = self.path(name)
+        tmp_path = self._temp_path(path)
+        with stage("storage_write"):
+            await aiofiles.os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                async with aiofiles.open(tmp_path, "wb") as f:
+                    await f.write(data)
+                await aiofiles.os.replace(tmp_path, path)
+            finally:
+                if await aiofiles.os.path.exists(tmp_path):
+                    await aiofiles.os.remove(tmp_path)
+        return path
+    
+    async def fetch(self, name: str) -> Optional[str]:
+        """Local path of a stored file, or None if it does not exist"""
+        return self._local_path(name)
+    
+    def evict_local(self, name: str) -> bool:
+        """Drop this node's copy of a file; returns False if it was not present"""
+        path = self._local_path(name)
+        if path is None:
+            return False
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+    
+    def scan(self) -> Iterator[os.DirEntry]:
+        """Lazily yield every stored file, shard by shard"""
+        yield from self._scan_directory(self.root, self.shard_depth)
+    
+    def _scan_directory(self, directory: str, depth: int) -> Iterator[os.DirEntry]:
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        # In-progress writes
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if depth > 0:
+                            yield from self._scan_directory(entry.path, depth - 1)
+                    elif entry.is_file(follow_symlinks=False):
+                        yield entry
+        except FileNotFoundError:
+            return
+    
+    def _local_path(self, name: str) -> Optional[str]:
+        """Sharded path if present, else the pre-sharding flat path if present"""
+        path = self.path(name)
+        if os.path.isfile(path):
+            return path
+        legacy_path = os.path.join(self.root, name)
+        if os.path.isfile(legacy_path):
+            return legacy_path
+        return None
+    
+    def _temp_path(self, path: str) -> str:
+        directory, name = os.path.split(path)
+        return os.path.join(directory, f".{name}.{uuid.uuid4().hex}.tmp")
+
+class S3Storage(LocalStorage):
+    """
+    Files shared through an S3-compatible bucket (AWS S3, MinIO, Ceph, ...),
+    so several app nodes can serve each other's outputs. The local sharded
+    store acts as a write-through cache: writes land locally and are
+    uploaded, and reads download into the cache on a miss.
+    
+    Requests use path-style URLs and Signature Version 4, so a local
+    stand-in such as MinIO works by pointing S3_ENDPOINT_URL at it.
+    
+    Only the local cache is subject to retention (evict_local); expiring
+    objects in the bucket is left to an S3 lifecycle rule.
+    """
+    
+    shared = True
+    
+    def __init__(self, root: str = settings.IMAGES_DIR, shard_depth: int = settings.STORAGE_SHARD_DEPTH,
+                 endpoint_url: str = settings.S3_ENDPOINT_URL, bucket: str = settings.S3_BUCKET,
+                 region: str = settings.S3_REGION, access_key: str = settings.S3_ACCESS_KEY_ID,
+                 secret_key: str = settings.S3_SECRET_ACCESS_KEY, prefix: str = settings.S3_PREFIX):
+        super().__init__(root, shard_depth)
+        if not (endpoint_url and bucket and access_key and secret_key):
+            raise ValueError("S3 storage needs S3_ENDPOINT_URL, S3_BUCKET, S3_ACCESS_KEY_ID and S3_SECRET_ACCESS_KEY")
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.bucket = bucket
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.prefix = prefix
+    
+    def write_sync(self, name: str, data: bytes) -> str:
+        path = super().write_sync(name, data)
+        response = httpx.put(self._url(name), content=data,
+                             headers=self._signed_headers("PUT", name, data), timeout=settings.S3_TIMEOUT)
+        response.raise_for_status()
+        return path
+    
+    async def write(self, name: str, data: bytes) -> str:
+        path = await super().write(name, data)
+        with stage("storage_upload"):
+            async with httpx.AsyncClient(timeout=settings.S3_TIMEOUT) as client:
+                response = await client.put(self._url(name), content=data,
+                                            headers=self._signed_headers("PUT", name, data))
+        response.raise_for_status()
+        return path
+    
+    async def fetch(self, name: str) -> Optional[str]:
+        path = self._local_path(name)
+        if path is not None:
+            return path
+        
+        try:
+            async with httpx.AsyncClient(timeout=settings.S3_TIMEOUT) as client:
+                response = await client.get(self._url(name), headers=self._signed_headers("GET", name))
+        except httpx.HTTPError as e:
+            logger.error("Could not fetch %s from S3: %s", name, e)
+            return None
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            logger.error("S3 GET %s failed: %s - %s", name, response.status_code, truncated(response.text))
+            return None
+        
+        logger.debug("Fetched %s from S3 into the local cache (%d bytes)", name, len(response.content))
+        return await super().write(name, response.content)
+    
+    def _url(self, name: str) -> str:
+        return f"{self.endpoint_url}/{self.bucket}/{quote(self.prefix + name)}"
+    
+    def _signed_headers(self, method: str, name: str, payload: bytes = b"") -> Dict[str, str]:
+        return sign_v4(method, self._url(name), {}, hashlib.sha256(payload).hexdigest(),
+                       self.region, self.access_key, self.secret_key)
+
+def _check_name(name: str):
+    """Reject names that are not a single plain path component"""
+    if not name or name != os.path.basename(name) or name.startswith(".") or "\\" in name:
+        raise ValueError(f"invalid file name {name!r}")
+
+def sign_v4(method: str, url: str, headers: Dict[str, str], payload_hash: str, region: str,
+            access_key: str, secret_key: str, service: str = "s3",
+            now: Optional[datetime] = None) -> Dict[str, str]:
+    """
+    Sign a request with AWS Signature Version 4 and return the headers to
+    send, including Authorization. The URL must already be percent-encoded.
+    """
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    date = amz_date[:8]
+    
+    parts = urlsplit(url)
+    signed = {key.lower(): value.strip() for key, value in headers.items()}
+    signed["host"] = parts.netloc
+    signed["x-amz-content-sha256"] = payload_hash
+    signed["x-amz-date"] = amz_date
+    
+    query = "&".join(sorted(
+        f"{quote(key, safe='-_.~')}={quote(value, safe='-_.~')}"
+        for key, _, value in (pair.partition("=") for pair in parts.query.split("&") if pair)
+    ))
+    signed_names = ";".join(sorted(signed))
+    canonical_request = "\n".join([
+        method,
+        parts.path or "/",
+        query,
+        "".join(f"{key}:{signed[key]}\n" for key in sorted(signed)),
+        signed_names,
+        payload_hash,
+    ])
+    
+    scope = f"{date}/{region}/{service}/aws4_request"
+    string_to_sign = "\n".join([
+        "AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()
+    ])
+    key = f"AWS4{secret_key}".encode()
+    for part in (date, region, service, "aws4_request"):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    
+    signed["authorization"] = (
+        f"AWS4-HMAC-SHA256 Credential={access_key}/{scope}, "
+        f"SignedHeaders={signed_names}, Signature={signature}"
+    )
+    return signed
+
+def create_storage() -> LocalStorage:
+    """Storage backend selected by STORAGE_BACKEND"""
+    if settings.STORAGE_BACKEND == "s3":
+        return S3Storage()
+    if settings.STORAGE_BACKEND != "local":
+        raise ValueError(f"Unknown STORAGE_BACKEND {settings.STORAGE_BACKEND!r}")
+    return LocalStorage()
+
+storage = create_storage()
@@ -0,0 +1,61 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from models.schemas import TaskStatus
+from utils.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Statuses of tasks that may still write files; "completed", "failed" and "cancelled" are final
+ACTIVE_STATUSES = ("pending", "processing", "upgrading")
+
+class TaskStore:
+    """In-memory registry of storyboard tasks, backing the task status API"""
+    
+    def __init__(self, max_tasks: int = settings.MAX_TRACKED_TASKS):
+        self.max_tasks = max_tasks
+        self._tasks: "OrderedDict[str, TaskStatus]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def create(self, task_id: str, message: str = "Task queued") -> TaskStatus:
+        """Register a new, pending task"""
+        return self.add(TaskStatus(task_id=task_id, status="pending", progress=0, message=message, result={}))
+    
+    def add(self, task: TaskStatus) -> TaskStatus:
+        """Register a task (e.g. one restored from the manifest), evicting the oldest ones beyond max_tasks"""
+        with self._lock:
+            self._tasks[task.task_id] = task
+            while len(self._tasks) > self.max_tasks:
+                evicted_id, _ = self._tasks.popitem(last=False)
+                logger.debug("Evicted task from status store: %s", evicted_id)
+        
+        return task
+    
+    def get(self, task_id: str) -> Optional[TaskStatus]:
+        """Get a task's current status"""
+        return self._tasks.get(task_id)
+    
+    def update(self, task_id: str, **fields) -> Optional[TaskStatus]:
+        """Update status fields of a task; result keys are merged"""
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if task is None:
+                logger.warning("Status update for unknown task: %s", task_id)
+                return None
+            
+            result = fields.pop("result", None)
+            for name, value in fields.items():
+                setattr(task, name, value)
+            if result:
+                task.result = {**(task.result or {}), **result}
+        
+        return task
+    
+    def is_active(self, task_id: str) -> bool:
+        """Whether a task is still producing files"""
+        task = self._tasks.get(task_id)
+        return task is not None and task.status in ACTIVE_STATUSES
+
+task_store = TaskStore()
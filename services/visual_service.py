@@ -1,58 +1,279 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+import io
 import os
+import re
 import math
-from models.schemas import VisualPanel, VisualStyle
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from models.schemas import VisualPanel, VisualStyle, OutputFormat
 from utils.config import settings
+from utils.metrics import PANELS, stage
+from services.manifest_store import manifest_store
+from services.storage_service import storage
+from utils.fonts import get_font
+from utils.svg_canvas import SvgCanvas
+from utils.text_layout import fit_text, layout_text, draw_text_lines, measure_text
+
+logger = logging.getLogger(__name__)
+
+# Color schemes for the different styles
+STYLE_COLORS = {
+    VisualStyle.WHITEBOARD: {
+        'bg': 'white', 'text': 'black', 'accent': '#2196F3', 
+        'secondary': '#4CAF50', 'border': '#666666'
+    },
+    VisualStyle.SKETCH: {
+        'bg': '#F5F5DC', 'text': '#333333', 'accent': '#8B4513',
+        'secondary': '#CD853F', 'border': '#A0522D' 
+    },
+    VisualStyle.INFOGRAPHIC: {
+        'bg': 'white', 'text': '#2C3E50', 'accent': '#3498DB',
+        'secondary': '#E74C3C', 'border': '#34495E'
+    },
+    VisualStyle.MINIMAL: {
+        'bg': 'white', 'text': '#444444', 'accent': '#666666',
+        'secondary': '#999999', 'border': '#CCCCCC'
+    }
+}
+
+# Pre-rendered base canvases, keyed by (style, output format, width, height)
+_BASE_CANVAS_CACHE = {}
+
+# Keyword table for visual elements: (shape, keywords, color role), in priority order
+SHAPE_KEYWORDS = [
+    ('arrow', ['arrow', 'direction', 'flow', 'point'], 'accent'),
+    ('circle', ['circle', 'round', 'cycle', 'wheel'], 'accent'),
+    ('rectangle', ['square', 'box', 'rectangle', 'block'], 'accent'),
+    ('triangle', ['triangle', 'mountain', 'peak'], 'accent'),
+    ('star', ['star', 'sparkle'], 'accent'),
+    ('line', ['line', 'connection', 'link'], 'accent'),
+    ('sun', ['sun', 'light', 'ray'], 'secondary'),
+    ('tree', ['tree', 'plant', 'leaf'], 'secondary'),
+    ('house', ['house', 'building', 'home'], 'accent'),
+    ('stick_figure', ['person', 'human', 'figure', 'stick'], 'text'),
+    ('water_drop', ['water', 'wave', 'drop'], 'accent'),
+]
+DEFAULT_SHAPE = ('default_shape', 'accent')
+
+SHAPE_DRAWERS = {shape: f"_draw_{shape}" for shape, _, _ in SHAPE_KEYWORDS}
+SHAPE_DRAWERS[DEFAULT_SHAPE[0]] = f"_draw_{DEFAULT_SHAPE[0]}"
+
+_KEYWORD_PRIORITY = {}
+for _priority, (_shape, _keywords, _role) in enumerate(SHAPE_KEYWORDS):
+    for _keyword in _keywords:
+        _KEYWORD_PRIORITY.setdefault(_keyword, _priority)
+
+# Zero-width lookahead finds keywords at every offset, including overlapping ones
+# ("sunlight"); alternatives are ordered by priority so each offset yields its best
+_SHAPE_MATCHER = re.compile(
+    "(?=(" + "|".join(re.escape(k) for k in sorted(_KEYWORD_PRIORITY, key=_KEYWORD_PRIORITY.get)) + "))"
+)
+
+# Sprite rendering: margin covers strokes drawn outside the shape size (sun rays)
+SPRITE_MARGIN = 24
+SPRITE_SUPERSAMPLE = 4
+
+# Pre-rasterized glyph sprites, keyed by (shape, size, color)
+_SPRITE_CACHE = {}
+
+# Shared process pool for panel rendering, created on first use
+_RENDER_POOL = None
+
+# Single thread for in-process rendering when RENDER_WORKERS <= 1; the renderer
+# and its caches are not thread-safe, so in-process renders are serialized
+_INLINE_RENDER_THREAD = None
+
+# Per-worker renderer instance, so its caches stay warm across panels
+_WORKER_SERVICE = None
+
+def get_render_pool() -> ProcessPoolExecutor:
+    """Get the process-wide rendering pool, shared by panels and animation segments"""
+    global _RENDER_POOL
+    if _RENDER_POOL is None or getattr(_RENDER_POOL, "_broken", False):
+        logger.info("Starting panel render pool with %s workers", settings.RENDER_WORKERS)
+        # Forking the threaded server process is unsafe; workers fork from a clean
+        # forkserver process instead (spawn where forkserver is unavailable)
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        context = multiprocessing.get_context(method)
+        if method == "forkserver":
+            context.set_forkserver_preload([__name__])
+        _RENDER_POOL = ProcessPoolExecutor(max_workers=settings.RENDER_WORKERS, mp_context=context)
+    return _RENDER_POOL
+
+def get_inline_render_thread() -> ThreadPoolExecutor:
+    """Get the single thread used for rendering without a process pool"""
+    global _INLINE_RENDER_THREAD
+    if _INLINE_RENDER_THREAD is None:
+        _INLINE_RENDER_THREAD = ThreadPoolExecutor(max_workers=1, thread_name_prefix="panel-render")
+    return _INLINE_RENDER_THREAD
+
+def _render_panel_in_worker(panel, style, task_id, output_format):
+    """Render one panel inside a pool worker process"""
+    global _WORKER_SERVICE
+    if _WORKER_SERVICE is None:
+        _WORKER_SERVICE = VisualService()
+    return _WORKER_SERVICE._create_enhanced_panel(panel, style, task_id, output_format)
+
+@lru_cache(maxsize=4096)
+def match_shape(element: str):
+    """Match a visual element description to (shape, color role)"""
+    best = len(SHAPE_KEYWORDS)
+    for match in _SHAPE_MATCHER.finditer(element.lower()):
+        best = min(best, _KEYWORD_PRIORITY[match.group(1)])
+        if best == 0:
+            break
+    
+    if best == len(SHAPE_KEYWORDS):
+        return DEFAULT_SHAPE
+    shape, _, color_role = SHAPE_KEYWORDS[best]
+    return shape, color_role
 
 class VisualService:
     def __init__(self):
         self.canvas_width = 1200
         self.canvas_height = 900
         
-    def create_panels(self, panels, style, task_id):
-        print(f"Creating enhanced visual panels for task: {task_id}")
+    def create_panels(self, panels, style, task_id, output_format=OutputFormat.PNG):
+        """Render panels across the process pool; returns paths of the panels that succeeded"""
+        results = self.render_panels(panels, style, task_id, output_format)
+        return [path for path, error in results if path]
+    
+    async def create_panels_async(self, panels, style, task_id, output_format=OutputFormat.PNG):
+        """Async variant of create_panels that does not block the event loop"""
+        results = await self.render_panels_async(panels, style, task_id, output_format)
+        return [path for path, error in results if path]
+    
+    def render_panels(self, panels, style, task_id,
+                      output_format=OutputFormat.PNG) -> List[Tuple[Optional[str], Optional[str]]]:
+        """
+        Render panels concurrently across CPU cores.
+        Returns one (image_path, error) tuple per panel, in panel order.
+        """
+        logger.info("Creating enhanced visual panels for task: %s", task_id)
         
         os.makedirs(settings.IMAGES_DIR, exist_ok=True)
         
         if not panels:
             return []
         
-        paths = []
+        # Not worth the inter-process round trip for a single panel
+        if len(panels) == 1 or settings.RENDER_WORKERS <= 1:
+            return [self._render_panel_safely(panel, style, task_id, output_format) for panel in panels]
         
-        for i, panel in enumerate(panels):
+        pool = get_render_pool()
+        futures = [
+            pool.submit(_render_panel_in_worker, panel, style, task_id, output_format)
+            for panel in panels
+        ]
+        
+        results = []
+        for panel, future in zip(panels, futures):
             try:
-                img_path = self._create_enhanced_panel(panel, style, task_id)
-                if img_path:
-                    paths.append(img_path)
+                results.append((future.result(), None))
             except Exception as e:
-                print(f"Error creating panel {i+1}: {e}")
-                continue
+                logger.error("Error creating panel %s: %s", panel.sequence, e)
+                results.append((None, str(e)))
         
-        return paths
+        return results
     
-    def _create_enhanced_panel(self, panel: VisualPanel, style: VisualStyle, task_id: str):
-        """Create a panel with actual visual elements"""
+    async def render_panels_async(self, panels, style, task_id,
+                                  output_format=OutputFormat.PNG) -> List[Tuple[Optional[str], Optional[str]]]:
+        """Async variant of render_panels for use from request handlers"""
+        logger.info("Creating enhanced visual panels for task: %s", task_id)
+        
+        os.makedirs(settings.IMAGES_DIR, exist_ok=True)
+        
+        if not panels:
+            return []
+        
+        loop = asyncio.get_running_loop()
+        executor = get_render_pool() if settings.RENDER_WORKERS > 1 else get_inline_render_thread()
         
-        # Create canvas
-        img = Image.new("RGB", (self.canvas_width, self.canvas_height), "white")
-        draw = ImageDraw.Draw(img)
+        async def render(panel):
+            # Timed from here: pool workers are separate processes and cannot report themselves
+            with stage("local_render"):
+                return await loop.run_in_executor(executor, _render_panel_in_worker, panel, style, task_id, output_format)
         
-        # Load fonts
+        outcomes = await asyncio.gather(*[render(panel) for panel in panels], return_exceptions=True)
+        
+        results = []
+        for panel, outcome in zip(panels, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error("Error creating panel %s: %s", panel.sequence, outcome)
+                results.append((None, str(outcome)))
+            else:
+                results.append((outcome, None))
+                PANELS.inc(method="local")
+        
+        return results
+    
+    def _render_panel_safely(self, panel, style, task_id, output_format):
+        """Render a single panel in-process, capturing its error"""
         try:
-            title_font = ImageFont.truetype("arial.ttf", 48)
-            text_font = ImageFont.truetype("arial.ttf", 24)
-            element_font = ImageFont.truetype("arial.ttf", 18)
-        except:
-            title_font = ImageFont.load_default()
-            text_font = ImageFont.load_default() 
-            element_font = ImageFont.load_default()
+            return self._create_enhanced_panel(panel, style, task_id, output_format), None
+        except Exception as e:
+            logger.error("Error creating panel %s: %s", panel.sequence, e)
+            return None, str(e)
+    
+    def _create_enhanced_panel(self, panel: VisualPanel, style: VisualStyle, task_id: str,
+                               output_format: OutputFormat = OutputFormat.PNG):
+        """Create a panel with actual visual elements"""
+        
+        started = time.perf_counter()
+        
+        # Start from a copy of the cached style canvas
+        img = self._get_base_canvas(style, output_format).copy()
+        draw = img if isinstance(img, SvgCanvas) else ImageDraw.Draw(img)
+        
+        self.draw_panel_content(img, draw, panel, style)
+        
+        # Save image
+        # Render workers are plain processes, so this write is synchronous
+        img_filename = f"{task_id}_panel_{panel.sequence}.{output_format.value}"
+        if output_format == OutputFormat.SVG:
+            data = img.to_svg().encode("utf-8")
+        else:
+            buffer = io.BytesIO()
+            img.save(buffer, "PNG")
+            data = buffer.getvalue()
+        img_path = storage.write_sync(img_filename, data)
+        
+        manifest_store.record_file(task_id, img_path, "local", panel.sequence,
+                                   (time.perf_counter() - started) * 1000)
+        return img_path
+    
+    def render_panel_image(self, panel: VisualPanel, style: VisualStyle) -> Image.Image:
+        """Render a panel in memory as a PIL image, without saving it"""
+        img = self._get_base_canvas(style).copy()
+        self.draw_panel_content(img, ImageDraw.Draw(img), panel, style)
+        return img
+    
+    def load_panel_image(self, panel: VisualPanel, style: VisualStyle,
+                         image_path: Optional[str] = None) -> Image.Image:
+        """Load a panel's stored raster, or re-render it when stored as SVG or missing"""
+        if image_path and not image_path.endswith(".svg") and os.path.exists(image_path):
+            with Image.open(image_path) as img:
+                return img.convert("RGB")
+        return self.render_panel_image(panel, style)
+    
+    def draw_panel_content(self, img, draw, panel: VisualPanel, style: VisualStyle):
+        """
+        Draw everything above the base canvas: title, visual elements, text and
+        panel number. Works with any canvas exposing the ImageDraw API.
+        """
+        # Load fonts (cached process-wide)
+        title_font = get_font(48)
+        text_font = get_font(24)
+        element_font = get_font(18)
         
         # Style configuration
         colors = self._get_style_colors(style)
         
-        # Draw background elements based on style
-        self._draw_background(draw, style, colors)
-        
         # Title area (top 15% of canvas)
         title_y = 50
         self._draw_title(draw, panel.title, title_font, colors, title_y)
@@ -60,8 +281,8 @@ class VisualService:
         # Main visual area (middle 60% of canvas) 
         visual_start_y = 150
         visual_height = 500
-        self._draw_visual_elements(draw, panel.visual_elements, colors, 
-                                 visual_start_y, visual_height)
+        self._draw_visual_elements(img, draw, panel.visual_elements, colors, 
+                                 visual_start_y, visual_height, element_font)
         
         # Text content area (bottom 25% of canvas)
         text_start_y = 700
@@ -69,35 +290,29 @@ class VisualService:
         
         # Panel number badge
         self._draw_panel_number(draw, panel.sequence, colors)
-        
-        # Save image
-        img_filename = f"{task_id}_panel_{panel.sequence}.png"
-        img_path = os.path.join(settings.IMAGES_DIR, img_filename)
-        img.save(img_path, quality=95)
-        
-        return img_path
     
     def _get_style_colors(self, style: VisualStyle):
-        """Define color schemes for different styles"""
-        color_schemes = {
-            VisualStyle.WHITEBOARD: {
-                'bg': 'white', 'text': 'black', 'accent': '#2196F3', 
-                'secondary': '#4CAF50', 'border': '#666666'
-            },
-            VisualStyle.SKETCH: {
-                'bg': '#F5F5DC', 'text': '#333333', 'accent': '#8B4513',
-                'secondary': '#CD853F', 'border': '#A0522D' 
-            },
-            VisualStyle.INFOGRAPHIC: {
-                'bg': 'white', 'text': '#2C3E50', 'accent': '#3498DB',
-                'secondary': '#E74C3C', 'border': '#34495E'
-            },
-            VisualStyle.MINIMAL: {
-                'bg': 'white', 'text': '#444444', 'accent': '#666666',
-                'secondary': '#999999', 'border': '#CCCCCC'
-            }
-        }
-        return color_schemes.get(style, color_schemes[VisualStyle.WHITEBOARD])
+        """Get the precomputed color scheme for a style"""
+        return STYLE_COLORS.get(style, STYLE_COLORS[VisualStyle.WHITEBOARD])
+    
+    def _get_base_canvas(self, style: VisualStyle, output_format: OutputFormat = OutputFormat.PNG):
+        """Get the cached base canvas (background and badge slot) for a style"""
+        key = (style, output_format, self.canvas_width, self.canvas_height)
+        canvas = _BASE_CANVAS_CACHE.get(key)
+        
+        if canvas is None:
+            colors = self._get_style_colors(style)
+            if output_format == OutputFormat.SVG:
+                canvas = SvgCanvas(self.canvas_width, self.canvas_height, "white")
+                draw = canvas
+            else:
+                canvas = Image.new("RGB", (self.canvas_width, self.canvas_height), "white")
+                draw = ImageDraw.Draw(canvas)
+            self._draw_background(draw, style, colors)
+            self._draw_badge_slot(draw, colors)
+            _BASE_CANVAS_CACHE[key] = canvas
+        
+        return canvas
     
     def _draw_background(self, draw, style, colors):
         """Draw style-specific background elements"""
@@ -115,20 +330,22 @@ class VisualService:
                     draw.ellipse([x-2, y-2, x+2, y+2], fill='#E0E0E0')
     
     def _draw_title(self, draw, title, font, colors, y_pos):
-        """Draw the panel title with underline"""
-        title_bbox = draw.textbbox((0, 0), title, font=font)
-        title_width = title_bbox[2] - title_bbox[0]
+        """Draw the panel title with underline, shrinking it to fit one line"""
+        font, lines = fit_text(title, self.canvas_width - 160, font.size,
+                               max_lines=1, min_size=28)
+        title = lines[0] if lines else ""
+        title_width = int(measure_text(title, font))
         title_x = (self.canvas_width - title_width) // 2
         
         # Draw title
         draw.text((title_x, y_pos), title, fill=colors['text'], font=font)
         
-        # Draw underline
-        underline_y = y_pos + title_bbox[3] + 10
+        # Draw underline below the font's full line height
+        underline_y = y_pos + sum(font.getmetrics()) + 10
         draw.line([(title_x, underline_y), (title_x + title_width, underline_y)], 
                  fill=colors['accent'], width=3)
     
-    def _draw_visual_elements(self, draw, visual_elements, colors, start_y, height):
+    def _draw_visual_elements(self, img, draw, visual_elements, colors, start_y, height, font):
         """Draw actual visual representations of the elements"""
         if not visual_elements:
             return
@@ -152,54 +369,49 @@ class VisualService:
             y = start_y + row * element_height + element_height // 2
             
             # Draw the visual element
-            self._draw_single_visual_element(draw, element, x, y, colors, element_width//3)
+            self._draw_single_visual_element(img, draw, element, x, y, colors, element_width//3)
             
             # Add label
             label_y = y + element_height//3 + 20
-            self._draw_centered_text(draw, element, x, label_y, colors['text'])
+            self._draw_centered_text(draw, element, x, label_y, colors['text'], font)
     
-    def _draw_single_visual_element(self, draw, element, center_x, center_y, colors, size):
+    def _draw_single_visual_element(self, img, draw, element, center_x, center_y, colors, size):
         """Draw individual visual elements based on description"""
-        element_lower = element.lower()
+        shape, color_role = match_shape(element)
+        color = colors[color_role]
         
-        if any(word in element_lower for word in ['arrow', 'direction', 'flow', 'point']):
-            self._draw_arrow(draw, center_x, center_y, colors['accent'], size)
-            
-        elif any(word in element_lower for word in ['circle', 'round', 'cycle', 'wheel']):
-            self._draw_circle(draw, center_x, center_y, colors['accent'], size)
-            
-        elif any(word in element_lower for word in ['square', 'box', 'rectangle', 'block']):
-            self._draw_rectangle(draw, center_x, center_y, colors['accent'], size)
-            
-        elif any(word in element_lower for word in ['triangle', 'mountain', 'peak']):
-            self._draw_triangle(draw, center_x, center_y, colors['accent'], size)
-            
-        elif any(word in element_lower for word in ['star', 'sparkle']):
-            self._draw_star(draw, center_x, center_y, colors['accent'], size)
-            
-        elif any(word in element_lower for word in ['line', 'connection', 'link']):
-            self._draw_line(draw, center_x, center_y, colors['accent'], size)
-            
-        elif any(word in element_lower for word in ['sun', 'light', 'ray']):
-            self._draw_sun(draw, center_x, center_y, colors['secondary'], size)
-            
-        elif any(word in element_lower for word in ['tree', 'plant', 'leaf']):
-            self._draw_tree(draw, center_x, center_y, colors['secondary'], size)
-            
-        elif any(word in element_lower for word in ['house', 'building', 'home']):
-            self._draw_house(draw, center_x, center_y, colors['accent'], size)
-            
-        elif any(word in element_lower for word in ['person', 'human', 'figure', 'stick']):
-            self._draw_stick_figure(draw, center_x, center_y, colors['text'], size)
-            
-        elif any(word in element_lower for word in ['water', 'wave', 'drop']):
-            self._draw_water_drop(draw, center_x, center_y, colors['accent'], size)
-            
+        # Raster canvases get a pre-rendered sprite; other backends draw directly
+        if isinstance(img, Image.Image):
+            sprite = self._get_sprite(shape, size, color)
+            half = sprite.width // 2
+            img.paste(sprite, (center_x - half, center_y - half), sprite)
         else:
-            # Default: simple geometric shape
-            self._draw_default_shape(draw, center_x, center_y, colors['accent'], size)
+            self._draw_shape(draw, shape, center_x, center_y, color, size)
+    
+    def _draw_shape(self, draw, shape, x, y, color, size, scale=1):
+        """Draw a named shape with its primitive drawing method"""
+        getattr(self, SHAPE_DRAWERS[shape])(draw, x, y, color, size, scale)
+    
+    def _get_sprite(self, shape, size, color):
+        """Get the cached anti-aliased RGBA sprite for (shape, size, color)"""
+        key = (shape, size, color)
+        sprite = _SPRITE_CACHE.get(key)
+        
+        if sprite is None:
+            # Render supersampled, then downsample once for anti-aliasing;
+            # the center sits on a pixel center so 1px strokes stay crisp
+            half = size + SPRITE_MARGIN
+            scale = SPRITE_SUPERSAMPLE
+            center = half * scale + scale // 2
+            tile = Image.new("RGBA", (2 * half * scale, 2 * half * scale), (0, 0, 0, 0))
+            self._draw_shape(ImageDraw.Draw(tile), shape, center, center,
+                             color, size * scale, scale)
+            sprite = tile.resize((2 * half, 2 * half), Image.Resampling.LANCZOS)
+            _SPRITE_CACHE[key] = sprite
+        
+        return sprite
     
-    def _draw_arrow(self, draw, x, y, color, size):
+    def _draw_arrow(self, draw, x, y, color, size, scale=1):
         """Draw an arrow"""
         points = [
             (x - size, y),
@@ -209,22 +421,24 @@ class VisualService:
             (x + size//2, y + size//3),
             (x + size//2, y)
         ]
-        draw.polygon(points, fill=color, outline=color)
+        draw.polygon(points, fill=color, outline=color, width=scale)
+        # Shaft (the polygon above is degenerate along it)
+        draw.line([(x - size, y), (x + size//2, y)], fill=color, width=scale)
     
-    def _draw_circle(self, draw, x, y, color, size):
+    def _draw_circle(self, draw, x, y, color, size, scale=1):
         """Draw a circle"""
-        draw.ellipse([x-size, y-size, x+size, y+size], outline=color, width=4)
+        draw.ellipse([x-size, y-size, x+size, y+size], outline=color, width=4*scale)
     
-    def _draw_rectangle(self, draw, x, y, color, size):
+    def _draw_rectangle(self, draw, x, y, color, size, scale=1):
         """Draw a rectangle"""
-        draw.rectangle([x-size, y-size//2, x+size, y+size//2], outline=color, width=4)
+        draw.rectangle([x-size, y-size//2, x+size, y+size//2], outline=color, width=4*scale)
     
-    def _draw_triangle(self, draw, x, y, color, size):
+    def _draw_triangle(self, draw, x, y, color, size, scale=1):
         """Draw a triangle"""
         points = [(x, y-size), (x-size, y+size), (x+size, y+size)]
-        draw.polygon(points, outline=color, width=4)
+        draw.polygon(points, outline=color, width=4*scale)
     
-    def _draw_star(self, draw, x, y, color, size):
+    def _draw_star(self, draw, x, y, color, size, scale=1):
         """Draw a 5-pointed star"""
         points = []
         for i in range(10):
@@ -233,13 +447,13 @@ class VisualService:
             px = x + radius * math.cos(angle - math.pi/2)
             py = y + radius * math.sin(angle - math.pi/2)
             points.append((px, py))
-        draw.polygon(points, outline=color, width=3)
+        draw.polygon(points, outline=color, width=3*scale)
     
-    def _draw_line(self, draw, x, y, color, size):
+    def _draw_line(self, draw, x, y, color, size, scale=1):
         """Draw a simple line"""
-        draw.line([(x-size, y), (x+size, y)], fill=color, width=4)
+        draw.line([(x-size, y), (x+size, y)], fill=color, width=4*scale)
     
-    def _draw_sun(self, draw, x, y, color, size):
+    def _draw_sun(self, draw, x, y, color, size, scale=1):
         """Draw a sun with rays"""
         # Central circle
         draw.ellipse([x-size//2, y-size//2, x+size//2, y+size//2], 
@@ -247,13 +461,13 @@ class VisualService:
         # Rays
         for i in range(8):
             angle = i * math.pi / 4
-            x1 = x + (size//2 + 10) * math.cos(angle)
-            y1 = y + (size//2 + 10) * math.sin(angle)
-            x2 = x + (size + 20) * math.cos(angle)
-            y2 = y + (size + 20) * math.sin(angle)
-            draw.line([(x1, y1), (x2, y2)], fill=color, width=3)
+            x1 = x + (size//2 + 10*scale) * math.cos(angle)
+            y1 = y + (size//2 + 10*scale) * math.sin(angle)
+            x2 = x + (size + 20*scale) * math.cos(angle)
+            y2 = y + (size + 20*scale) * math.sin(angle)
+            draw.line([(x1, y1), (x2, y2)], fill=color, width=3*scale)
     
-    def _draw_tree(self, draw, x, y, color, size):
+    def _draw_tree(self, draw, x, y, color, size, scale=1):
         """Draw a simple tree"""
         # Trunk
         trunk_width = size // 6
@@ -263,33 +477,33 @@ class VisualService:
         # Leaves (circle)
         draw.ellipse([x-size//2, y-size, x+size//2, y], fill=color, outline=color)
     
-    def _draw_house(self, draw, x, y, color, size):
+    def _draw_house(self, draw, x, y, color, size, scale=1):
         """Draw a simple house"""
         # Base
-        draw.rectangle([x-size, y, x+size, y+size], outline=color, width=3)
+        draw.rectangle([x-size, y, x+size, y+size], outline=color, width=3*scale)
         # Roof
         roof_points = [(x-size, y), (x, y-size//2), (x+size, y)]
-        draw.polygon(roof_points, outline=color, width=3)
+        draw.polygon(roof_points, outline=color, width=3*scale)
         # Door
         door_width = size // 3
         draw.rectangle([x-door_width//2, y+size//2, x+door_width//2, y+size], 
-                      outline=color, width=2)
+                      outline=color, width=2*scale)
     
-    def _draw_stick_figure(self, draw, x, y, color, size):
+    def _draw_stick_figure(self, draw, x, y, color, size, scale=1):
         """Draw a stick figure"""
         # Head
         head_size = size // 4
         draw.ellipse([x-head_size, y-size, x+head_size, y-size+2*head_size], 
-                    outline=color, width=3)
+                    outline=color, width=3*scale)
         # Body
-        draw.line([(x, y-size+2*head_size), (x, y+size//2)], fill=color, width=3)
+        draw.line([(x, y-size+2*head_size), (x, y+size//2)], fill=color, width=3*scale)
         # Arms
-        draw.line([(x-size//2, y-size//2), (x+size//2, y-size//2)], fill=color, width=3)
+        draw.line([(x-size//2, y-size//2), (x+size//2, y-size//2)], fill=color, width=3*scale)
         # Legs
-        draw.line([(x, y+size//2), (x-size//3, y+size)], fill=color, width=3)
-        draw.line([(x, y+size//2), (x+size//3, y+size)], fill=color, width=3)
+        draw.line([(x, y+size//2), (x-size//3, y+size)], fill=color, width=3*scale)
+        draw.line([(x, y+size//2), (x+size//3, y+size)], fill=color, width=3*scale)
     
-    def _draw_water_drop(self, draw, x, y, color, size):
+    def _draw_water_drop(self, draw, x, y, color, size, scale=1):
         """Draw a water drop"""
         # Teardrop shape using polygon approximation
         points = []
@@ -302,68 +516,48 @@ class VisualService:
             px = x + radius * math.cos(angle + math.pi/2)
             py = y + size * math.cos(angle/2)
             points.append((px, py))
-        draw.polygon(points, fill=color, outline=color)
+        draw.polygon(points, fill=color, outline=color, width=scale)
     
-    def _draw_default_shape(self, draw, x, y, color, size):
+    def _draw_default_shape(self, draw, x, y, color, size, scale=1):
         """Draw default shape when element type is unclear"""
         # Diamond shape
         points = [(x, y-size), (x+size, y), (x, y+size), (x-size, y)]
-        draw.polygon(points, outline=color, width=4)
+        draw.polygon(points, outline=color, width=4*scale)
     
     def _draw_text_content(self, draw, text, font, colors, start_y):
-        """Draw wrapped text content"""
-        wrapped_lines = self._wrap_text(text, 80)
-        line_height = 30
-        
-        for i, line in enumerate(wrapped_lines[:5]):  # Limit to 5 lines
-            y = start_y + i * line_height
-            text_bbox = draw.textbbox((0, 0), line, font=font)
-            text_width = text_bbox[2] - text_bbox[0]
-            x = (self.canvas_width - text_width) // 2
-            draw.text((x, y), line, fill=colors['text'], font=font)
+        """Draw wrapped text content, shrinking it to fit 5 lines"""
+        lines, _ = layout_text([{
+            "text": text, "size": font.size, "min_size": 16, "max_lines": 5,
+            "max_width": self.canvas_width - 200, "line_height": 30, "fill": colors['text']
+        }], self.canvas_width, start_y, max_y=self.canvas_height - 20)
+        draw_text_lines(draw, lines)
     
-    def _draw_panel_number(self, draw, sequence, colors):
-        """Draw panel sequence number in corner"""
+    def _badge_position(self):
+        """Get the position and size of the panel number badge"""
         circle_size = 40
-        x = self.canvas_width - circle_size - 20
-        y = 20
-        
-        # Circle background
+        return self.canvas_width - circle_size - 20, 20, circle_size
+    
+    def _draw_badge_slot(self, draw, colors):
+        """Draw the circle background of the panel number badge"""
+        x, y, circle_size = self._badge_position()
         draw.ellipse([x, y, x + circle_size, y + circle_size], 
                     fill=colors['accent'], outline=colors['accent'])
+    
+    def _draw_panel_number(self, draw, sequence, colors):
+        """Draw panel sequence number into the badge slot"""
+        x, y, circle_size = self._badge_position()
         
         # Number text
         number_text = str(sequence)
-        text_bbox = draw.textbbox((0, 0), number_text)
-        text_x = x + (circle_size - (text_bbox[2] - text_bbox[0])) // 2
-        text_y = y + (circle_size - (text_bbox[3] - text_bbox[1])) // 2
-        draw.text((text_x, text_y), number_text, fill='white')
+        font = get_font(20)
+        text_bbox = draw.textbbox((0, 0), number_text, font=font)
+        text_x = x + (circle_size - (text_bbox[2] - text_bbox[0])) // 2 - text_bbox[0]
+        text_y = y + (circle_size - (text_bbox[3] - text_bbox[1])) // 2 - text_bbox[1]
+        draw.text((text_x, text_y), number_text, fill='white', font=font)
     
-    def _draw_centered_text(self, draw, text, x, y, color):
+    def _draw_centered_text(self, draw, text, x, y, color, font=None):
         """Draw text centered at position"""
-        text_bbox = draw.textbbox((0, 0), text)
-        text_width = text_bbox[2] - text_bbox[0]
+        font = font or get_font(18)
+        text_width = int(measure_text(text, font))
         text_x = x - text_width // 2
-        draw.text((text_x, y), text, fill=color)
-    
-    def _wrap_text(self, text, width):
-        """Wrap text to specified width"""
-        words = text.split()
-        lines = []
-        current_line = []
-        current_length = 0
-        
-        for word in words:
-            if current_length + len(word) + 1 <= width:
-                current_line.append(word)
-                current_length += len(word) + 1
-            else:
-                if current_line:
-                    lines.append(' '.join(current_line))
-                current_line = [word]
-                current_length = len(word)
-        
-        if current_line:
-            lines.append(' '.join(current_line))
-        
-        return lines
+        draw.text((text_x, y), text, fill=color, font=font)
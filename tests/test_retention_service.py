@@ -0,0 +1,37 @@
+import pytest
+
+import services.retention_service as retention_module
+from services.retention_service import RetentionService
+from services.storage_service import LocalStorage
+from services.task_store import TaskStore
+
+@pytest.fixture
+def tasks(monkeypatch):
+    store = TaskStore()
+    monkeypatch.setattr(retention_module, "task_store", store)
+    return store
+
+def make_retention(tmp_path, *names):
+    storage = LocalStorage(str(tmp_path), 2)
+    for name in names:
+        storage.write_sync(name, b"x" * 100)
+    # Any stored byte is over budget
+    return storage, RetentionService(storage, max_age_hours=0, max_bytes=1, scan_batch=100)
+
+@pytest.mark.parametrize("status", ["completed", "failed", "cancelled"])
+def test_evicts_files_of_finished_tasks(tmp_path, tasks, status):
+    tasks.create("done")
+    tasks.update("done", status=status)
+    storage, retention = make_retention(tmp_path, "done_panel_1_imagen.png")
+    
+    assert retention.run_pass()["deleted_files"] == 1
+    assert not storage.evict_local("done_panel_1_imagen.png")
+
+@pytest.mark.parametrize("status", ["pending", "processing", "upgrading"])
+def test_keeps_files_of_active_tasks(tmp_path, tasks, status):
+    tasks.create("busy")
+    tasks.update("busy", status=status)
+    storage, retention = make_retention(tmp_path, "busy_panel_1_imagen.png")
+    
+    assert retention.run_pass()["deleted_files"] == 0
+    assert storage.evict_local("busy_panel_1_imagen.png")
@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import httpx
+import pytest
+
+from services.storage_service import LocalStorage, S3Storage, sign_v4
+
+ACCESS_KEY = "AKIDEXAMPLE"
+SECRET_KEY = "wJalrXUtnFEMI/K7MDENG+bPxRfiCYEXAMPLEKEY"
+REGION = "us-east-1"
+BUCKET = "outputs"
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    """In-memory S3 stand-in that rejects requests without a valid SigV4 signature"""
+    
+    objects = {}
+    requests = []
+    
+    def log_message(self, *args):
+        pass
+    
+    def _authorized(self, body: bytes) -> bool:
+        payload_hash = self.headers["x-amz-content-sha256"]
+        if payload_hash != hashlib.sha256(body).hexdigest():
+            return False
+        now = datetime.strptime(self.headers["x-amz-date"] + "+0000", "%Y%m%dT%H%M%SZ%z")
+        url = f"http://{self.headers['host']}{self.path}"
+        expected = sign_v4(self.command, url, {}, payload_hash, REGION, ACCESS_KEY, SECRET_KEY, now=now)
+        return self.headers["authorization"] == expected["authorization"]
+    
+    def _handle(self, body: bytes = b""):
+        self.requests.append((self.command, self.path))
+        if not self._authorized(body):
+            self.send_response(403)
+            self.end_headers()
+            return
+        key = unquote(self.path)
+        if self.command == "PUT":
+            self.objects[key] = body
+            status, content = 200, b""
+        else:
+            content = self.objects.get(key)
+            status = 404 if content is None else 200
+            content = content or b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+    
+    def do_PUT(self):
+        self._handle(self.rfile.read(int(self.headers["Content-Length"])))
+    
+    def do_GET(self):
+        self._handle()
+
+@pytest.fixture
+def s3_server():
+    FakeS3Handler.objects = {}
+    FakeS3Handler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeS3Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def make_storage(tmp_path, endpoint, node="a", secret_key=SECRET_KEY):
+    return S3Storage(str(tmp_path / node), 2, endpoint, BUCKET, REGION, ACCESS_KEY, secret_key, "images/")
+
+def test_write_uploads_signed_object(tmp_path, s3_server):
+    storage = make_storage(tmp_path, s3_server)
+    path = asyncio.run(storage.write("task_panel_1_imagen.png", b"png-bytes"))
+    
+    assert open(path, "rb").read() == b"png-bytes"
+    assert FakeS3Handler.objects[f"/{BUCKET}/images/task_panel_1_imagen.png"] == b"png-bytes"
+
+def test_write_sync_uploads(tmp_path, s3_server):
+    storage = make_storage(tmp_path, s3_server)
+    storage.write_sync("task_panel_2_fallback.png", b"fallback")
+    
+    assert FakeS3Handler.objects[f"/{BUCKET}/images/task_panel_2_fallback.png"] == b"fallback"
+
+def test_fetch_downloads_into_another_nodes_cache(tmp_path, s3_server):
+    writer = make_storage(tmp_path, s3_server, "a")
+    reader = make_storage(tmp_path, s3_server, "b")
+    asyncio.run(writer.write("task_panel_1_imagen.png", b"shared"))
+    
+    path = asyncio.run(reader.fetch("task_panel_1_imagen.png"))
+    
+    assert path == reader.path("task_panel_1_imagen.png")
+    assert open(path, "rb").read() == b"shared"
+    # Served from the local cache afterwards
+    requests_before = len(FakeS3Handler.requests)
+    assert asyncio.run(reader.fetch("task_panel_1_imagen.png")) == path
+    assert len(FakeS3Handler.requests) == requests_before
+
+def test_fetch_missing_object(tmp_path, s3_server):
+    storage = make_storage(tmp_path, s3_server)
+    assert asyncio.run(storage.fetch("task_panel_9_imagen.png")) is None
+
+def test_evict_local_keeps_shared_object(tmp_path, s3_server):
+    storage = make_storage(tmp_path, s3_server)
+    asyncio.run(storage.write("task_panel_1_imagen.png", b"data"))
+    
+    assert storage.evict_local("task_panel_1_imagen.png")
+    assert FakeS3Handler.objects[f"/{BUCKET}/images/task_panel_1_imagen.png"] == b"data"
+    assert open(asyncio.run(storage.fetch("task_panel_1_imagen.png")), "rb").read() == b"data"
+
+def test_bad_signature_is_rejected(tmp_path, s3_server):
+    storage = make_storage(tmp_path, s3_server, secret_key="wrong")
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(storage.write("task_panel_1_imagen.png", b"data"))
+    assert not FakeS3Handler.objects
+
+def test_local_storage_evict_local_deletes(tmp_path):
+    storage = LocalStorage(str(tmp_path), 2)
+    storage.write_sync("task_panel_1_fallback.png", b"data")
+    
+    assert not storage.shared
+    assert storage.evict_local("task_panel_1_fallback.png")
+    assert not storage.evict_local("task_panel_1_fallback.png")
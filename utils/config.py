@@ -16,7 +16,69 @@ class Settings:
     # Application settings
     OUTPUT_DIR: str = "outputs"
     IMAGES_DIR: str = "outputs/images"
+    VIDEOS_DIR: str = "outputs/videos"
+    SEGMENTS_DIR: str = "outputs/videos/segments"
+    MANIFEST_DB: str = os.getenv("MANIFEST_DB", "outputs/manifest.sqlite3")  # Per-task file index
     DEBUG_MODE: bool = os.getenv("DEBUG_MODE", "false").lower() == "true"
+    FONTS_DIR: str = os.getenv(
+        "FONTS_DIR",
+        os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "fonts")
+    )
+    MAX_TRACKED_TASKS: int = int(os.getenv("MAX_TRACKED_TASKS", "1000"))  # Tasks kept in the status store
+    RENDER_WORKERS: int = int(os.getenv("RENDER_WORKERS", os.cpu_count() or 1))  # Local panel render processes
+    
+    # Animation export settings
+    FFMPEG_PATH: str = os.getenv("FFMPEG_PATH", "ffmpeg")
+    ANIMATION_FPS: int = int(os.getenv("ANIMATION_FPS", "30"))
+    
+    # Output storage settings ("local" or "s3"; S3 keeps the local store as a cache)
+    STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "local").lower()
+    STORAGE_SHARD_DEPTH: int = int(os.getenv("STORAGE_SHARD_DEPTH", "2"))  # Hash-prefix directory levels
+    S3_ENDPOINT_URL: str = os.getenv("S3_ENDPOINT_URL")
+    S3_BUCKET: str = os.getenv("S3_BUCKET")
+    S3_REGION: str = os.getenv("S3_REGION", "us-east-1")
+    S3_ACCESS_KEY_ID: str = os.getenv("S3_ACCESS_KEY_ID")
+    S3_SECRET_ACCESS_KEY: str = os.getenv("S3_SECRET_ACCESS_KEY")
+    S3_PREFIX: str = os.getenv("S3_PREFIX", "images/")
+    S3_TIMEOUT: int = int(os.getenv("S3_TIMEOUT", "30"))
+    
+    # Near-duplicate prompt reuse (token-set similarity, e.g. 0.85; opt-in, 0 disables)
+    PROMPT_REUSE_THRESHOLD: float = float(os.getenv("PROMPT_REUSE_THRESHOLD", "0"))
+    PROMPT_INDEX_SIZE: int = int(os.getenv("PROMPT_INDEX_SIZE", "5000"))  # Indexed prompts kept
+    
+    # Memory admission control (0 budget disables it)
+    MEMORY_BUDGET_BYTES: int = int(os.getenv("MEMORY_BUDGET_MB", "1024")) * 1024 ** 2
+    PANEL_MEMORY_BYTES: int = int(os.getenv("PANEL_MEMORY_MB", "32")) * 1024 ** 2  # Peak per in-flight Imagen panel
+    ADMISSION_RETRY_AFTER_SECONDS: int = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "15"))
+    
+    # Client disconnects (generation is cancelled when the client goes away before the response)
+    DISCONNECT_POLL_SECONDS: float = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.5"))
+    FINISH_PAID_IMAGEN_CALLS: bool = os.getenv("FINISH_PAID_IMAGEN_CALLS", "true").lower() == "true"  # Keep in-flight results for reuse
+    MAX_DETACHED_IMAGEN_CALLS: int = int(os.getenv("MAX_DETACHED_IMAGEN_CALLS", "8"))  # Beyond this they are dropped
+    
+    # Background health checks (probe endpoints only read the cached results)
+    HEALTH_CHECK_INTERVAL_SECONDS: int = int(os.getenv("HEALTH_CHECK_INTERVAL_SECONDS", "30"))
+    HEALTH_CHECK_TIMEOUT: float = float(os.getenv("HEALTH_CHECK_TIMEOUT", "5"))
+    HEALTH_MIN_FREE_BYTES: int = int(os.getenv("HEALTH_MIN_FREE_MB", "500")) * 1024 ** 2  # Free disk under IMAGES_DIR
+    IMAGEN_FAILURE_THRESHOLD: int = int(os.getenv("IMAGEN_FAILURE_THRESHOLD", "5"))  # Consecutive failed attempts
+    
+    # Tracing (spans exported as OTLP/JSON lines when a path is set)
+    TRACE_EXPORT_PATH: str = os.getenv("TRACE_EXPORT_PATH", "")
+    TRACE_EXPORT_MAX_BYTES: int = int(os.getenv("TRACE_EXPORT_MAX_MB", "100")) * 1024 ** 2  # Then rotated to .1
+    TRACE_MAX_TASKS: int = int(os.getenv("TRACE_MAX_TASKS", "200"))  # Tasks kept for the waterfall view
+    
+    # Logging ("name=LEVEL,..." per-logger levels; "text" or "json" output)
+    LOG_LEVELS: str = os.getenv("LOG_LEVELS", "httpx=WARNING")
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "text").lower()
+    LOG_SAMPLE_BURST: int = int(os.getenv("LOG_SAMPLE_BURST", "100"))  # Records per message per minute before sampling
+    LOG_SAMPLE_EVERY: int = int(os.getenv("LOG_SAMPLE_EVERY", "10"))  # Then keep 1 in N (1 disables sampling)
+    
+    # Output retention settings (0 disables a limit)
+    RETENTION_MAX_AGE_HOURS: float = float(os.getenv("RETENTION_MAX_AGE_HOURS", "168"))
+    RETENTION_MAX_BYTES: int = int(os.getenv("RETENTION_MAX_BYTES", str(5 * 1024 ** 3)))
+    RETENTION_INTERVAL_SECONDS: int = int(os.getenv("RETENTION_INTERVAL_SECONDS", "300"))
+    RETENTION_SCAN_BATCH: int = int(os.getenv("RETENTION_SCAN_BATCH", "2000"))  # Directory entries per pass
+    VIDEO_CACHE_MAX_BYTES: int = int(os.getenv("VIDEO_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))  # Videos and segments
     
     # Imagen v4 specific settings
     IMAGEN_MODEL: str = "imagen-3.0-generate-001"  # Latest available model
@@ -28,6 +90,8 @@ settings = Settings()
 # Create directories
 os.makedirs(settings.OUTPUT_DIR, exist_ok=True)
 os.makedirs(settings.IMAGES_DIR, exist_ok=True)
+os.makedirs(settings.VIDEOS_DIR, exist_ok=True)
+os.makedirs(settings.SEGMENTS_DIR, exist_ok=True)
 
 # Debug logging setup
 import logging
@@ -0,0 +1,155 @@
+import os
+import stat
+import logging
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Mapping, Optional, Tuple
+
+import aiofiles
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Generated files are never rewritten under the same name, so caches may keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+class FileRangeResponse(Response):
+    """
+    Response for a file or a byte range of it. Uses the ASGI zero-copy send
+    or path send extensions when the server offers them, and falls back
+    to chunked async reads otherwise.
+    """
+    
+    def __init__(self, path: str, start: int, end: int, status_code: int,
+                 headers: Mapping[str, str], media_type: str, file_size: int):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.file_size = file_size
+        self.status_code = status_code
+        self.media_type = media_type
+        self.background = None
+        if status_code != 304:
+            headers = {**headers, "content-length": str(end - start)}
+        self.init_headers(headers)
+    
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD" or self.status_code == 304:
+            await send({"type": "http.response.body", "body": b""})
+            return
+        
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as f:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": f,
+                    "offset": self.start,
+                    "count": self.end - self.start,
+                })
+        elif "http.response.pathsend" in extensions and self.start == 0 and self.end == self.file_size:
+            await send({"type": "http.response.pathsend", "path": self.path})
+        else:
+            async with aiofiles.open(self.path, "rb") as f:
+                await f.seek(self.start)
+                remaining = self.end - self.start
+                while remaining > 0:
+                    chunk = await f.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                if remaining > 0:
+                    # File shrank underneath us; end the body rather than hang the client
+                    await send({"type": "http.response.body", "body": b""})
+
+def file_etag(file_stat: os.stat_result) -> str:
+    """Strong validator from the file's size and modification time"""
+    return f'"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"'
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range "bytes=" header into a [start, end) pair.
+    Returns None when the header should be ignored (malformed, last < first
+    or multi-range); raises ValueError when a valid range cannot be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    
+    first, _, last = spec.strip().partition("-")
+    if not (first or last) or not all(part == "" or part.isdigit() for part in (first, last)):
+        return None
+    
+    if first and last and int(last) < int(first):
+        # Invalid rather than unsatisfiable: RFC 9110 says to ignore the header
+        return None
+    
+    if not first:
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(last)), size
+    else:
+        start = int(first)
+        end = min(int(last) + 1, size) if last else size
+    
+    if start >= size or end <= start:
+        raise ValueError(f"range {header!r} not satisfiable for {size} bytes")
+    return start, end
+
+def serve_file(path: str, request_headers: Mapping[str, str],
+               cache_control: str = IMMUTABLE_CACHE_CONTROL) -> Response:
+    """
+    Serve a file with strong ETag and Last-Modified validators, answering
+    conditional requests with 304 and Range requests with 206.
+    Raises FileNotFoundError if the path is missing or not a regular file.
+    """
+    file_stat = os.stat(path)
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise FileNotFoundError(path)
+    
+    etag = file_etag(file_stat)
+    last_modified = formatdate(file_stat.st_mtime, usegmt=True)
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    headers = {
+        "etag": etag,
+        "last-modified": last_modified,
+        "cache-control": cache_control,
+        "accept-ranges": "bytes",
+    }
+    size = file_stat.st_size
+    
+    if _not_modified(request_headers, etag, file_stat.st_mtime):
+        return FileRangeResponse(path, 0, 0, 304, headers, media_type, size)
+    
+    range_header = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() in (etag, last_modified)):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+        if byte_range:
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+            return FileRangeResponse(path, start, end, 206, headers, media_type, size)
+    
+    return FileRangeResponse(path, 0, size, 200, headers, media_type, size)
+
+def _not_modified(request_headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    """Evaluate If-None-Match, or If-Modified-Since when no ETags were sent"""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # Weak comparison, as required for If-None-Match
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
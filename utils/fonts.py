@@ -0,0 +1,45 @@
+import os
+import logging
+from functools import lru_cache
+from PIL import ImageFont
+
+from utils.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Bundled, open-licensed fonts (see assets/fonts/OFL.txt)
+FONT_FAMILIES = {
+    "regular": "Lato-Regular.ttf",
+}
+
+DEFAULT_FAMILY = "regular"
+
+@lru_cache(maxsize=None)
+def _resolve_font_path(family: str) -> str:
+    """Resolve the TrueType file for a font family once per process"""
+    filename = FONT_FAMILIES.get(family, FONT_FAMILIES[DEFAULT_FAMILY])
+    path = os.path.join(settings.FONTS_DIR, filename)
+    
+    if not os.path.exists(path):
+        logger.warning("Font file not found for family '%s': %s", family, path)
+        return ""
+    
+    logger.debug("Resolved font family '%s' to %s", family, path)
+    return path
+
+@lru_cache(maxsize=None)
+def get_font(size: int, family: str = DEFAULT_FAMILY) -> ImageFont.ImageFont:
+    """
+    Get a font from the process-wide registry.
+    Each (family, size) pair is loaded from disk at most once per process.
+    """
+    path = _resolve_font_path(family)
+    
+    if path:
+        try:
+            return ImageFont.truetype(path, size)
+        except OSError as e:
+            logger.error("Failed to load font %s: %s", path, e)
+    
+    # Pillow's own scalable default font keeps metrics sane without a TTF
+    return ImageFont.load_default(size)
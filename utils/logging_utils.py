@@ -0,0 +1,136 @@
+import json
+import reprlib
+import logging
+import threading
+
+from utils.config import settings
+from utils.tracing import TraceContextFilter
+
+TRUNCATE_LIMIT = 200
+SAMPLED_TEMPLATES_MAX = 1000
+
+class _Truncated:
+    """Log argument that renders a bounded repr of a payload, only if the record is emitted"""
+    
+    __slots__ = ("obj", "limit")
+    
+    def __init__(self, obj, limit: int):
+        self.obj = obj
+        self.limit = limit
+    
+    def __str__(self) -> str:
+        # reprlib slices strings and caps container items before formatting them,
+        # so a multi-MB base64 payload is never serialized in full
+        limiter = reprlib.Repr()
+        limiter.maxstring = limiter.maxother = self.limit
+        limiter.maxlist = limiter.maxtuple = limiter.maxdict = limiter.maxset = 10
+        limiter.maxlevel = 4
+        obj = self.obj
+        if isinstance(obj, (bytes, bytearray, memoryview)):
+            # reprlib has no bytes support and would repr the whole buffer
+            obj = bytes(obj[:self.limit])
+            return repr(obj) + ("..." if len(self.obj) > self.limit else "")
+        return limiter.repr(obj)
+
+def truncated(obj, limit: int = TRUNCATE_LIMIT) -> _Truncated:
+    """Wrap a potentially huge log argument: logger.debug("Response: %s", truncated(result))"""
+    return _Truncated(obj, limit)
+
+class SamplingFilter(logging.Filter):
+    """
+    Let through the first `burst` records of each message template per window,
+    then one in `every`. Warnings and errors always pass. The next record let
+    through carries the number suppressed since the previous one.
+    """
+    
+    def __init__(self, burst: int = settings.LOG_SAMPLE_BURST, every: int = settings.LOG_SAMPLE_EVERY,
+                 window: float = 60.0):
+        super().__init__()
+        self.burst = burst
+        self.every = every
+        self.window = window
+        # (logger, template) -> [window start, records seen, suppressed]
+        self._counts = {}
+        self._lock = threading.Lock()
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.every <= 1:
+            return True
+        
+        key = (record.name, record.msg)
+        with self._lock:
+            state = self._counts.get(key)
+            if state is None or record.created - state[0] >= self.window:
+                if state is None and len(self._counts) >= SAMPLED_TEMPLATES_MAX:
+                    self._counts.clear()
+                state = self._counts[key] = [record.created, 0, state[2] if state else 0]
+            state[1] += 1
+            if state[1] <= self.burst or (state[1] - self.burst) % self.every == 0:
+                record.suppressed = state[2]
+                state[2] = 0
+                return True
+            state[2] += 1
+            return False
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "task_id": getattr(record, "task_id", "-"),
+            "message": record.getMessage(),
+        }
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def parse_logger_levels(spec: str) -> dict:
+    """Parse "name=LEVEL,other=LEVEL" into {name: level}"""
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+class TextFormatter(logging.Formatter):
+    """Plain text lines with the task id, noting records sampled away since the last one"""
+    
+    def __init__(self):
+        super().__init__("%(levelname)s:%(name)s:[%(task_id)s] %(message)s")
+    
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{line} (+{suppressed} suppressed)" if suppressed else line
+
+def configure_logging():
+    """
+    Apply per-logger levels and install task correlation, sampling and the
+    chosen format on the app's own root handler. It replaces the default
+    basicConfig handler; other handlers on the root logger are left alone.
+    Safe to call more than once.
+    """
+    for name, level in parse_logger_levels(settings.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+    
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if getattr(handler, "app_handler", False) or _is_basic_config_handler(handler):
+            root.removeHandler(handler)
+    
+    handler = logging.StreamHandler()
+    handler.app_handler = True
+    handler.addFilter(TraceContextFilter())
+    handler.addFilter(SamplingFilter())
+    handler.setFormatter(JsonFormatter() if settings.LOG_FORMAT == "json" else TextFormatter())
+    root.addHandler(handler)
+
+def _is_basic_config_handler(handler: logging.Handler) -> bool:
+    return (type(handler) is logging.StreamHandler and handler.formatter is not None
+            and handler.formatter._fmt == logging.BASIC_FORMAT)
@@ -0,0 +1,66 @@
+import threading
+import logging
+from typing import Callable, Optional
+
+from utils.config import settings
+
+logger = logging.getLogger(__name__)
+
+class Reservation:
+    """Bytes held against a MemoryBudget until released"""
+    
+    def __init__(self, budget: "MemoryBudget", nbytes: int):
+        self.budget = budget
+        self.nbytes = nbytes
+        self._released = False
+        self._transferred = False
+    
+    def release(self):
+        """Return the bytes to the budget; idempotent, and a no-op once transferred"""
+        if not self._transferred:
+            self._release()
+    
+    def transfer(self) -> Callable[[], None]:
+        """Hand ownership to background work; returns the callback that releases the bytes"""
+        self._transferred = True
+        return self._release
+    
+    def _release(self):
+        with self.budget._lock:
+            if self._released:
+                return
+            self._released = True
+            self.budget.reserved -= self.nbytes
+
+class MemoryBudget:
+    """
+    Process-wide byte budget for memory-heavy work. Callers reserve their
+    estimated peak usage up front and are refused immediately when it does
+    not fit, instead of queuing until the process runs out of memory.
+    """
+    
+    def __init__(self, capacity: int = settings.MEMORY_BUDGET_BYTES):
+        self.capacity = capacity
+        self.reserved = 0
+        self._lock = threading.Lock()
+        self.stats = {"admitted": 0, "rejected": 0, "peak_reserved": 0}
+    
+    def try_reserve(self, nbytes: int) -> Optional[Reservation]:
+        """Reserve nbytes (capped to the capacity) if they fit right now, else None"""
+        nbytes = min(nbytes, self.capacity)
+        with self._lock:
+            if self.capacity > 0 and self.reserved + nbytes > self.capacity:
+                self.stats["rejected"] += 1
+                logger.warning("Memory budget exhausted: %d of %d bytes reserved, %d requested",
+                               self.reserved, self.capacity, nbytes)
+                return None
+            self.reserved += nbytes
+            self.stats["admitted"] += 1
+            self.stats["peak_reserved"] = max(self.stats["peak_reserved"], self.reserved)
+        return Reservation(self, nbytes)
+    
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"capacity": self.capacity, "reserved": self.reserved, **self.stats}
+
+memory_budget = MemoryBudget()
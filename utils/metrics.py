@@ -0,0 +1,178 @@
+import math
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+from utils.tracing import span
+
+# Seconds; spans fast PIL work through slow Imagen calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+class _Metric:
+    kind = ""
+    
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str], lock: threading.Lock):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = lock
+    
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+    
+    def _format_labels(self, key: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+    
+    @property
+    def sample_name(self) -> str:
+        return self.name
+    
+    def render(self) -> Iterator[str]:
+        # Text format 0.0.4: metadata is keyed by the exposed sample name
+        yield f"# HELP {self.sample_name} {self.help_text}"
+        yield f"# TYPE {self.sample_name} {self.kind}"
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally split by labels"""
+    kind = "counter"
+    
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._values: Dict[Tuple[str, ...], float] = {}
+    
+    @property
+    def sample_name(self) -> str:
+        return f"{self.name}_total"
+    
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def render(self) -> Iterator[str]:
+        yield from super().render()
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.sample_name}{self._format_labels(key)} {value:g}"
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed cumulative buckets"""
+    kind = "histogram"
+    
+    def __init__(self, *args, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(*args)
+        self.buckets = tuple(buckets)
+        # key -> [per-bucket counts, sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+    
+    def render(self) -> Iterator[str]:
+        yield from super().render()
+        with self._lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else f"{bound:g}"
+                yield f"{self.name}_bucket{self._format_labels(key, ('le', le))} {cumulative}"
+            yield f"{self.name}_sum{self._format_labels(key)} {total:.6f}"
+            yield f"{self.name}_count{self._format_labels(key)} {count}"
+
+class MetricsRegistry:
+    """Minimal in-process metrics registry rendered in the Prometheus text format"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+    
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames, self._lock))
+    
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, self._lock, buckets=buckets))
+    
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+    
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "storyboard_stage_seconds", "Time spent in each storyboard generation stage", ["stage"]
+)
+IMAGEN_ATTEMPTS = registry.counter(
+    "imagen_attempts", "Imagen API attempts by outcome (success, empty, error)", ["outcome"]
+)
+PANELS = registry.counter(
+    "storyboard_panels", "Panels produced, by generation method", ["method"]
+)
+STORYBOARDS = registry.counter(
+    "storyboards", "Storyboard requests by mode and outcome", ["mode", "outcome"]
+)
+PROMPT_REUSE = registry.counter(
+    "prompt_reuse_lookups", "Prompt reuse index lookups by result (exact, near, miss)", ["result"]
+)
+PROMPT_REUSE_SUSPECT = registry.counter(
+    "prompt_reuse_suspect", "Near-match reuses whose visual elements differ from the source panel"
+)
+
+# Per-request stage totals, shared by every task spawned while handling the request
+_stage_breakdown: ContextVar[Optional[dict]] = ContextVar("stage_breakdown", default=None)
+
+def start_stage_breakdown() -> dict:
+    """Start collecting stage timings for the current request and return the live breakdown"""
+    breakdown = {}
+    _stage_breakdown.set(breakdown)
+    return breakdown
+
+def record_stage(name: str, seconds: float):
+    """Record a measured stage in the histogram and in the current request's breakdown"""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    breakdown = _stage_breakdown.get()
+    if breakdown is not None:
+        with registry._lock:
+            entry = breakdown.setdefault(name, {"count": 0, "seconds": 0.0})
+            entry["count"] += 1
+            entry["seconds"] += seconds
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block (sync or async code) as a generation stage, traced as a span"""
+    started = time.perf_counter()
+    try:
+        with span(name):
+            yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
@@ -0,0 +1,50 @@
+from typing import Dict
+
+class PdfStreamWriter:
+    """
+    Minimal PDF serializer that emits the file as a sequence of byte chunks,
+    so documents can be streamed without being assembled in memory.
+    Objects may be written in any order; the cross-reference table is
+    built from the offsets recorded along the way.
+    """
+    
+    def __init__(self):
+        self.offset = 0
+        self.offsets: Dict[int, int] = {}
+    
+    def header(self) -> bytes:
+        # The binary comment marks the file as binary for transfer tools
+        return self._emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    
+    def object(self, number: int, body: str) -> bytes:
+        """Serialize an indirect object with a dictionary or value body"""
+        self.offsets[number] = self.offset
+        return self._emit(f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1"))
+    
+    def stream(self, number: int, entries: str, data: bytes) -> bytes:
+        """Serialize a stream object; entries are extra dictionary keys"""
+        self.offsets[number] = self.offset
+        head = f"{number} 0 obj\n<< {entries} /Length {len(data)} >>\nstream\n".encode("latin-1")
+        return self._emit(head + data + b"\nendstream\nendobj\n")
+    
+    def trailer(self, root: int) -> bytes:
+        """Serialize the cross-reference table and trailer; call last"""
+        size = max(self.offsets) + 1
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        for number in range(1, size):
+            if number in self.offsets:
+                lines.append(f"{self.offsets[number]:010d} 00000 n \n")
+            else:
+                lines.append("0000000000 65535 f \n")
+        lines.append(f"trailer\n<< /Size {size} /Root {root} 0 R >>\nstartxref\n{self.offset}\n%%EOF\n")
+        return self._emit("".join(lines).encode("latin-1"))
+    
+    def _emit(self, data: bytes) -> bytes:
+        self.offset += len(data)
+        return data
+
+def pdf_text(text: str) -> str:
+    """Escape text as a PDF literal string in the standard fonts' encoding"""
+    encoded = text.encode("cp1252", errors="replace").decode("latin-1")
+    escaped = encoded.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return f"({escaped})"
@@ -0,0 +1,208 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Images are traced at the first of these fractions of their size whose
+# skeleton stays under MAX_SKELETON_PIXELS (busy, textured images are traced
+# coarser); strokes are scaled back up
+WORK_SCALES = (0.5, 0.25, 0.125)
+MAX_SKELETON_PIXELS = 30000
+
+# Erosion passes that separate thin lines from filled regions; thicker
+# areas are reduced to their outline before skeletonizing
+FILL_EROSION = 3
+
+MIN_PATH_PIXELS = 4  # Shorter skeleton fragments are noise
+MAX_PATHS = 300  # Longest paths kept; ordering is quadratic in the path count
+POINT_STEP = 3  # Keep every Nth traced pixel as a path vertex
+MAX_CACHED_IMAGES = 64
+
+# Extracted strokes per image content hash
+_STROKE_CACHE: "OrderedDict[str, List[List[Tuple[float, float]]]]" = OrderedDict()
+
+# 8-neighbour offsets in Zhang-Suen order P2..P9 (clockwise from north)
+_NEIGHBOURS = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]
+
+def extract_strokes(image: Image.Image) -> List[List[Tuple[float, float]]]:
+    """
+    Trace the dark line work of a raster image as stroke paths, ordered
+    so that each stroke starts near where the previous one ended.
+    Returns: a list of paths, each a list of (x, y) points in image coordinates
+    """
+    digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+    digest.update(f"{image.mode}{image.size}".encode())
+    key = digest.hexdigest()
+    
+    strokes = _STROKE_CACHE.get(key)
+    if strokes is not None:
+        _STROKE_CACHE.move_to_end(key)
+        return strokes
+    
+    gray_image = image.convert("L")
+    for work_scale in WORK_SCALES:
+        work_size = (max(1, int(image.width * work_scale)), max(1, int(image.height * work_scale)))
+        gray = np.asarray(gray_image.resize(work_size, Image.BILINEAR))
+        ink = binarize(gray)
+        skeleton = skeletonize(ink & ~erode(ink, FILL_EROSION))
+        if np.count_nonzero(skeleton) <= MAX_SKELETON_PIXELS:
+            break
+    
+    paths = trace_paths(skeleton)
+    if len(paths) > MAX_PATHS:
+        paths = sorted(paths, key=len, reverse=True)[:MAX_PATHS]
+    paths = order_paths(paths)
+    
+    scale = 1 / work_scale
+    strokes = [
+        [(x * scale, y * scale) for y, x in path[::POINT_STEP] + path[-1:]]
+        for path in paths
+    ]
+    logger.debug("Extracted %d strokes from %s image", len(strokes), image.size)
+    
+    _STROKE_CACHE[key] = strokes
+    if len(_STROKE_CACHE) > MAX_CACHED_IMAGES:
+        _STROKE_CACHE.popitem(last=False)
+    return strokes
+
+def binarize(gray: np.ndarray) -> np.ndarray:
+    """Mark pixels darker than the Otsu threshold as ink"""
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    
+    weight_dark = np.cumsum(histogram)
+    weight_light = weight_dark[-1] - weight_dark
+    sum_dark = np.cumsum(histogram * levels)
+    mean_dark = sum_dark / np.maximum(weight_dark, 1)
+    mean_light = (sum_dark[-1] - sum_dark) / np.maximum(weight_light, 1)
+    between_variance = weight_dark * weight_light * (mean_dark - mean_light) ** 2
+    
+    threshold = int(np.argmax(between_variance))
+    return gray <= threshold
+
+def erode(mask: np.ndarray, passes: int) -> np.ndarray:
+    """Binary erosion with a 3x3 square, repeated passes times"""
+    for _ in range(passes):
+        padded = np.pad(mask, 1)
+        eroded = padded[1:-1, 1:-1].copy()
+        for dy, dx in _NEIGHBOURS:
+            eroded &= padded[1 + dy:padded.shape[0] - 1 + dy, 1 + dx:padded.shape[1] - 1 + dx]
+        mask = eroded
+    return mask
+
+def skeletonize(mask: np.ndarray) -> np.ndarray:
+    """Thin a binary mask to one-pixel-wide lines (Zhang-Suen, vectorized)"""
+    skeleton = np.pad(mask, 1).astype(np.uint8)
+    height, width = skeleton.shape
+    
+    while True:
+        changed = False
+        for first_pass in (True, False):
+            p = [
+                skeleton[1 + dy:height - 1 + dy, 1 + dx:width - 1 + dx]
+                for dy, dx in _NEIGHBOURS
+            ]
+            neighbours = sum(n.astype(np.int8) for n in p)
+            transitions = sum(
+                ((p[i] == 0) & (p[(i + 1) % 8] == 1)).astype(np.int8) for i in range(8)
+            )
+            p2, p4, p6, p8 = p[0], p[2], p[4], p[6]
+            if first_pass:
+                clear = (p2 & p4 & p6) == 0
+                clear &= (p4 & p6 & p8) == 0
+            else:
+                clear = (p2 & p4 & p8) == 0
+                clear &= (p2 & p6 & p8) == 0
+            
+            center = skeleton[1:-1, 1:-1]
+            remove = (center == 1) & (neighbours >= 2) & (neighbours <= 6) & (transitions == 1) & clear
+            if remove.any():
+                center[remove] = 0
+                changed = True
+        if not changed:
+            break
+    
+    return skeleton[1:-1, 1:-1].astype(bool)
+
+def trace_paths(skeleton: np.ndarray) -> List[List[Tuple[int, int]]]:
+    """Walk a skeleton into pixel paths, starting from line ends, then closed loops"""
+    height, width = skeleton.shape
+    padded = np.pad(skeleton, 1)
+    neighbour_count = sum(
+        padded[1 + dy:height + 1 + dy, 1 + dx:width + 1 + dx].astype(np.int8)
+        for dy, dx in _NEIGHBOURS
+    )
+    
+    ys, xs = np.nonzero(skeleton)
+    endpoints = skeleton & (neighbour_count == 1)
+    ey, ex = np.nonzero(endpoints)
+    
+    # Flat indices over the padded grid so neighbour lookups never go out of bounds
+    stride = width + 2
+    on = padded.ravel().copy()
+    offsets = [dy * stride + dx for dy, dx in _NEIGHBOURS]
+    # Prefer straight continuations over diagonal ones
+    offsets = offsets[0::2] + offsets[1::2]
+    
+    starts = [(y + 1) * stride + x + 1 for y, x in zip(ey.tolist(), ex.tolist())]
+    starts += [(y + 1) * stride + x + 1 for y, x in zip(ys.tolist(), xs.tolist())]
+    
+    paths = []
+    for start in starts:
+        if not on[start]:
+            continue
+        on[start] = False
+        path = [start]
+        current = start
+        while True:
+            for offset in offsets:
+                candidate = current + offset
+                if on[candidate]:
+                    on[candidate] = False
+                    path.append(candidate)
+                    current = candidate
+                    break
+            else:
+                break
+        
+        if len(path) >= MIN_PATH_PIXELS:
+            paths.append([(index // stride - 1, index % stride - 1) for index in path])
+    
+    return paths
+
+def order_paths(paths: List[List[Tuple[int, int]]]) -> List[List[Tuple[int, int]]]:
+    """
+    Order paths greedily from the top-left so each starts at the closest
+    remaining end to the previous one, reversing paths where that is shorter.
+    """
+    if not paths:
+        return []
+    
+    heads = np.array([path[0] for path in paths], dtype=np.float64)
+    tails = np.array([path[-1] for path in paths], dtype=np.float64)
+    done = np.zeros(len(paths), dtype=bool)
+    position = np.zeros(2)
+    
+    ordered = []
+    for _ in range(len(paths)):
+        to_head = ((heads - position) ** 2).sum(axis=1)
+        to_tail = ((tails - position) ** 2).sum(axis=1)
+        to_head[done] = np.inf
+        to_tail[done] = np.inf
+        
+        best_head, best_tail = int(np.argmin(to_head)), int(np.argmin(to_tail))
+        if to_head[best_head] <= to_tail[best_tail]:
+            index, path = best_head, paths[best_head]
+        else:
+            index, path = best_tail, paths[best_tail][::-1]
+        
+        done[index] = True
+        ordered.append(path)
+        position = np.array(path[-1], dtype=np.float64)
+    
+    return ordered
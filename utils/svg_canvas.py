@@ -0,0 +1,112 @@
+import logging
+from typing import List
+from xml.sax.saxutils import escape, quoteattr
+
+logger = logging.getLogger(__name__)
+
+class SvgCanvas:
+    """
+    Vector drawing surface with the subset of the ImageDraw API used by the
+    panel renderers, so the same drawing calls can produce SVG instead of PNG.
+    """
+    
+    def __init__(self, width: int, height: int, background: str = "white"):
+        self.width = width
+        self.height = height
+        self.background = background
+        self.elements: List[str] = []
+    
+    def copy(self) -> "SvgCanvas":
+        """Return a canvas with a copy of the elements drawn so far"""
+        canvas = SvgCanvas(self.width, self.height, self.background)
+        canvas.elements = list(self.elements)
+        return canvas
+    
+    def line(self, xy, fill=None, width=1):
+        """Draw a line or polyline through the given points"""
+        points = self._points(xy)
+        self.elements.append(
+            f'<polyline points="{self._format_points(points)}" fill="none" '
+            f'stroke={quoteattr(fill or "black")} stroke-width="{width}"/>'
+        )
+    
+    def polygon(self, xy, fill=None, outline=None, width=1):
+        """Draw a closed polygon"""
+        points = self._points(xy)
+        self.elements.append(
+            f'<polygon points="{self._format_points(points)}" '
+            f'{self._paint(fill, outline, width)}/>'
+        )
+    
+    def rectangle(self, xy, fill=None, outline=None, width=1):
+        """Draw a rectangle; like Pillow, the outline is drawn inside the box"""
+        x0, y0, x1, y1 = self._box(xy, outline, width)
+        self.elements.append(
+            f'<rect x="{x0:g}" y="{y0:g}" width="{x1 - x0:g}" height="{y1 - y0:g}" '
+            f'{self._paint(fill, outline, width)}/>'
+        )
+    
+    def ellipse(self, xy, fill=None, outline=None, width=1):
+        """Draw an ellipse inscribed in the bounding box"""
+        x0, y0, x1, y1 = self._box(xy, outline, width)
+        self.elements.append(
+            f'<ellipse cx="{(x0 + x1) / 2:g}" cy="{(y0 + y1) / 2:g}" '
+            f'rx="{(x1 - x0) / 2:g}" ry="{(y1 - y0) / 2:g}" '
+            f'{self._paint(fill, outline, width)}/>'
+        )
+    
+    def text(self, xy, text, fill=None, font=None):
+        """Draw text with its top-left corner at xy, as ImageDraw.text does"""
+        x, y = xy
+        size = getattr(font, "size", 10)
+        ascent = font.getmetrics()[0] if hasattr(font, "getmetrics") else size
+        family = font.getname()[0] if hasattr(font, "getname") else "sans-serif"
+        
+        self.elements.append(
+            f'<text x="{x:g}" y="{y + ascent:g}" font-family={quoteattr(f"{family}, sans-serif")} '
+            f'font-size="{size}" fill={quoteattr(fill or "black")} xml:space="preserve">'
+            f'{escape(text)}</text>'
+        )
+    
+    def textbbox(self, xy, text, font=None):
+        """Measure text with the same font metrics the raster renderer uses"""
+        x, y = xy
+        left, top, right, bottom = font.getbbox(text)
+        return (x + left, y + top, x + right, y + bottom)
+    
+    def to_svg(self) -> str:
+        """Serialize the canvas as a standalone SVG document"""
+        header = (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width}" height="{self.height}" '
+            f'viewBox="0 0 {self.width} {self.height}">'
+        )
+        background = f'<rect width="100%" height="100%" fill={quoteattr(self.background)}/>'
+        return "\n".join([header, background, *self.elements, "</svg>"])
+    
+    def save(self, path: str):
+        """Write the SVG document to disk"""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_svg())
+        logger.debug("SVG saved: %s (%d elements)", path, len(self.elements))
+    
+    def _points(self, xy):
+        """Normalize flat or paired coordinate sequences to (x, y) pairs"""
+        xy = list(xy)
+        if xy and not isinstance(xy[0], (tuple, list)):
+            return list(zip(xy[0::2], xy[1::2]))
+        return xy
+    
+    def _format_points(self, points) -> str:
+        return " ".join(f"{x:g},{y:g}" for x, y in points)
+    
+    def _box(self, xy, outline, width):
+        """Convert a Pillow bounding box to SVG geometry with an inset stroke"""
+        (x0, y0), (x1, y1) = self._points(xy)
+        inset = width / 2 if outline else 0
+        return x0 + inset, y0 + inset, x1 - inset + 1, y1 - inset + 1
+    
+    def _paint(self, fill, outline, width) -> str:
+        fill_attr = f"fill={quoteattr(fill)}" if fill else 'fill="none"'
+        if outline:
+            return f'{fill_attr} stroke={quoteattr(outline)} stroke-width="{width}"'
+        return fill_attr
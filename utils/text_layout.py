@@ -0,0 +1,182 @@
+import logging
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from utils.fonts import get_font, DEFAULT_FAMILY
+
+logger = logging.getLogger(__name__)
+
+ELLIPSIS = "\u2026"
+MIN_SCALED_SIZE = 12  # Smallest font size when shrinking text to fit a height
+
+# Per-font character advance widths, keyed by font object id
+# (fonts come from the process-wide registry, so ids stay valid)
+_ADVANCE_CACHE: Dict[int, Dict[str, float]] = {}
+
+class TextLine(NamedTuple):
+    """A positioned line of text, ready to draw"""
+    x: int
+    y: int
+    text: str
+    font: object
+    fill: str
+
+def measure_text(text: str, font) -> float:
+    """Measure the advance width of text from cached per-character widths"""
+    advances = _ADVANCE_CACHE.get(id(font))
+    if advances is None:
+        advances = _ADVANCE_CACHE[id(font)] = {}
+    
+    width = 0.0
+    for char in text:
+        advance = advances.get(char)
+        if advance is None:
+            advance = advances[char] = font.getlength(char)
+        width += advance
+    return width
+
+def wrap_text(text: str, font, max_width: float) -> List[str]:
+    """Wrap text greedily by measured pixel width"""
+    space = measure_text(" ", font)
+    lines = []
+    current_line = []
+    current_width = 0.0
+    
+    for word in text.split():
+        word_width = measure_text(word, font)
+        
+        # Break words that cannot fit on a line of their own
+        while word_width > max_width and len(word) > 1:
+            if current_line:
+                lines.append(" ".join(current_line))
+                current_line, current_width = [], 0.0
+            head, word = _split_to_width(word, font, max_width)
+            lines.append(head)
+            word_width = measure_text(word, font)
+        
+        needed = word_width if not current_line else current_width + space + word_width
+        if needed <= max_width:
+            current_line.append(word)
+            current_width = needed
+        else:
+            if current_line:
+                lines.append(" ".join(current_line))
+            current_line = [word]
+            current_width = word_width
+    
+    if current_line:
+        lines.append(" ".join(current_line))
+    
+    return lines
+
+def fit_text(text: str, max_width: float, size: int, max_lines: Optional[int] = None,
+             min_size: Optional[int] = None, family: str = DEFAULT_FAMILY) -> Tuple[object, List[str]]:
+    """
+    Wrap text at the largest font size, from size down to min_size, that fits
+    in max_lines. At min_size, lines beyond max_lines are dropped and the last
+    kept line ends with an ellipsis.
+    Returns: (font, lines)
+    """
+    min_size = min(min_size or size, size)
+    
+    # Step down by 2px, always trying min_size itself last
+    for candidate in list(range(size, min_size, -2)) + [min_size]:
+        font = get_font(candidate, family)
+        lines = wrap_text(text, font, max_width)
+        if max_lines is None or len(lines) <= max_lines:
+            return font, lines
+    
+    logger.debug("Text does not fit in %d lines at %dpx, truncating", max_lines, min_size)
+    lines = lines[:max_lines]
+    if lines:
+        lines[-1] = ellipsize(lines[-1], font, max_width)
+    return font, lines
+
+def ellipsize(line: str, font, max_width: float) -> str:
+    """Shorten a line, at a word boundary where possible, so it fits max_width with an ellipsis"""
+    line = line.rstrip()
+    while line and measure_text(line + ELLIPSIS, font) > max_width:
+        head = line.rsplit(" ", 1)[0] if " " in line else line[:-1]
+        line = head.rstrip(" ,;:-")
+    return line + ELLIPSIS
+
+def layout_text(blocks: List[dict], width: int, start_y: int,
+                max_y: Optional[int] = None) -> Tuple[List[TextLine], int]:
+    """
+    Lay out text blocks top to bottom. With max_y, blocks
+    that would run past it are scaled down to fit, and any lines still
+    below max_y are dropped.
+    
+    Each block is a dict with:
+        text, size, fill          - content, font size and color
+        max_width                 - wrap width (default: the full width)
+        align                     - "center" (default) or "left"
+        x                         - left edge for left-aligned blocks
+        line_height, gap          - line advance and space after the block
+        max_lines, min_size       - shrink to fit between size and min_size
+        family                    - font family from the font registry
+    Returns: (positioned lines, y position after the last block)
+    """
+    placed, y = _layout_blocks(blocks, width, start_y)
+    
+    # Text height scales roughly linearly with the sizes; a few passes settle wrapping changes
+    for _ in range(3):
+        if max_y is None or not blocks or y - blocks[-1].get("gap", 0) <= max_y:
+            break
+        scale = (max_y - start_y) / (y - start_y)
+        blocks = [_scale_block(block, scale) for block in blocks]
+        placed, y = _layout_blocks(blocks, width, start_y)
+    
+    if max_y is not None:
+        fitting = [line for line in placed if line.y + line.font.size <= max_y]
+        if len(fitting) < len(placed):
+            logger.debug("Text runs past y=%d, dropping %d lines", max_y, len(placed) - len(fitting))
+            placed = fitting
+    return placed, y
+
+def _scale_block(block: dict, scale: float) -> dict:
+    scaled = dict(block)
+    for key in ("size", "min_size", "line_height", "gap"):
+        if key in scaled:
+            scaled[key] = max(MIN_SCALED_SIZE if key in ("size", "min_size") else 0, int(scaled[key] * scale))
+    return scaled
+
+def _layout_blocks(blocks: List[dict], width: int, start_y: int) -> Tuple[List[TextLine], int]:
+    placed = []
+    y = start_y
+    
+    for block in blocks:
+        max_width = block.get("max_width", width)
+        font, lines = fit_text(
+            block["text"], max_width, block["size"],
+            max_lines=block.get("max_lines"),
+            min_size=block.get("min_size"),
+            family=block.get("family", DEFAULT_FAMILY)
+        )
+        line_height = block.get("line_height", font.size + 6)
+        
+        for line in lines:
+            if block.get("align", "center") == "center":
+                x = int((width - measure_text(line, font)) // 2)
+            else:
+                x = block.get("x", 0)
+            placed.append(TextLine(x, y, line, font, block.get("fill", "black")))
+            y += line_height
+        
+        y += block.get("gap", 0)
+    
+    return placed, y
+
+def draw_text_lines(draw, lines: List[TextLine]):
+    """Draw positioned lines on an ImageDraw or SvgCanvas"""
+    for line in lines:
+        draw.text((line.x, line.y), line.text, fill=line.fill, font=line.font)
+
+def _split_to_width(word: str, font, max_width: float) -> Tuple[str, str]:
+    """Split a word into the longest prefix that fits max_width and the rest"""
+    width = 0.0
+    for i, char in enumerate(word):
+        width += measure_text(char, font)
+        if width > max_width:
+            cut = max(i, 1)
+            return word[:cut], word[cut:]
+    return word, ""
@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from utils.config import settings
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "imagen_visual_generator"
+SPAN_KIND_INTERNAL = 1
+STATUS_OK, STATUS_ERROR = 1, 2
+
+class Span:
+    """One timed operation in a task's trace"""
+    
+    __slots__ = ("trace_id", "span_id", "parent_id", "task_id", "name", "attributes",
+                 "start_ns", "end_ns", "status", "status_message")
+    
+    def __init__(self, trace_id: str, parent_id: Optional[str], task_id: str, name: str, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.task_id = task_id
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_OK
+        self.status_message = ""
+    
+    def to_otlp(self) -> dict:
+        """Span in the OTLP/JSON encoding"""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": self.status},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        encoded = {"boolValue": value}
+    elif isinstance(value, int):
+        encoded = {"intValue": str(value)}
+    elif isinstance(value, float):
+        encoded = {"doubleValue": value}
+    else:
+        encoded = {"stringValue": str(value)}
+    return {"key": key, "value": encoded}
+
+class TraceStore:
+    """
+    Finished spans of recent tasks, kept in memory for the waterfall view and,
+    if an export path is set, appended to an OTLP/JSON lines file by a
+    background writer thread, so request handlers never wait on the disk.
+    The file is rotated once it reaches max_export_bytes.
+    """
+    
+    def __init__(self, export_path: str = settings.TRACE_EXPORT_PATH, max_tasks: int = settings.TRACE_MAX_TASKS,
+                 max_export_bytes: int = settings.TRACE_EXPORT_MAX_BYTES):
+        self.export_path = export_path
+        self.max_export_bytes = max_export_bytes
+        self.max_tasks = max_tasks
+        self._spans: "OrderedDict[str, List[Span]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue: "queue.SimpleQueue[Span]" = queue.SimpleQueue()
+        self._writer = None
+    
+    def add(self, span: Span):
+        with self._lock:
+            spans = self._spans.get(span.task_id)
+            if spans is None:
+                spans = self._spans[span.task_id] = []
+                while len(self._spans) > self.max_tasks:
+                    self._spans.popitem(last=False)
+            spans.append(span)
+        
+        if self.export_path:
+            if self._writer is None:
+                self._start_writer()
+            self._queue.put(span)
+    
+    def spans(self, task_id: str) -> List[Span]:
+        with self._lock:
+            return list(self._spans.get(task_id, []))
+    
+    def _start_writer(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_forever, name="trace-export", daemon=True)
+                self._writer.start()
+    
+    def _write_forever(self):
+        """Append spans as OTLP/JSON export requests, batching whatever is queued"""
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            request = {"resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": [span.to_otlp() for span in batch]}],
+            }]}
+            try:
+                self._rotate()
+                with open(self.export_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(request, separators=(",", ":")) + "\n")
+            except OSError as e:
+                logger.warning("Could not export %s spans to %s: %s", len(batch), self.export_path, e)
+
+    def _rotate(self):
+        """Move a full export file to <path>.1, replacing the previous one"""
+        if self.max_export_bytes <= 0:
+            return
+        try:
+            if os.path.getsize(self.export_path) >= self.max_export_bytes:
+                os.replace(self.export_path, f"{self.export_path}.1")
+        except FileNotFoundError:
+            pass
+
+trace_store = TraceStore()
+
+# Trace of the task being handled and the innermost open span
+_trace: ContextVar[Optional[tuple]] = ContextVar("trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+def start_trace(task_id: str):
+    """Attach the current context (and tasks spawned from it) to a task's trace"""
+    try:
+        trace_id = uuid.UUID(task_id).hex
+    except ValueError:
+        trace_id = os.urandom(16).hex()
+    _trace.set((trace_id, task_id))
+    _current_span.set(None)
+
+def current_task_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace[1] if trace else None
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Record the enclosed block (sync or async code) as a child of the current
+    span. Does nothing outside a trace. Exceptions mark the span as failed.
+    """
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+    
+    parent = _current_span.get()
+    current = Span(trace[0], parent.span_id if parent else None, trace[1], name, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = STATUS_ERROR
+        current.status_message = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+        trace_store.add(current)
+
+def mark_error(message: str):
+    """Mark the current span as failed without an exception (e.g. an empty response)"""
+    current = _current_span.get()
+    if current is not None:
+        current.status = STATUS_ERROR
+        current.status_message = message
+
+def waterfall(task_id: str) -> List[Dict]:
+    """A task's spans in start order, with depth and offsets for a waterfall view"""
+    spans = sorted(trace_store.spans(task_id), key=lambda s: s.start_ns)
+    if not spans:
+        return []
+    
+    by_id = {s.span_id: s for s in spans}
+    origin = spans[0].start_ns
+    rows = []
+    for s in spans:
+        depth, parent = 0, by_id.get(s.parent_id)
+        while parent is not None:
+            depth += 1
+            parent = by_id.get(parent.parent_id)
+        rows.append({
+            "name": s.name,
+            "span_id": s.span_id,
+            "parent_span_id": s.parent_id,
+            "depth": depth,
+            "start_ms": round((s.start_ns - origin) / 1e6, 2),
+            "duration_ms": round((s.end_ns - s.start_ns) / 1e6, 2),
+            "status": "error" if s.status == STATUS_ERROR else "ok",
+            "status_message": s.status_message,
+            "attributes": s.attributes,
+        })
+    return rows
+
+def format_waterfall(rows: List[Dict], width: int = 60) -> str:
+    """Plain-text rendering of waterfall rows, one bar per span"""
+    if not rows:
+        return ""
+    total = max(row["start_ms"] + row["duration_ms"] for row in rows) or 1
+    label_width = max(2 * row["depth"] + len(row["name"]) for row in rows)
+    lines = []
+    for row in rows:
+        label = ("  " * row["depth"] + row["name"]).ljust(label_width)
+        start = int(row["start_ms"] / total * width)
+        length = max(1, int(row["duration_ms"] / total * width))
+        bar = (" " * start + ("!" if row["status"] == "error" else "#") * length).ljust(width + 1)
+        lines.append(f"{label} |{bar}| {row['start_ms']:>9.1f} +{row['duration_ms']:.1f} ms")
+    return "\n".join(lines) + "\n"
+
+class TraceContextFilter(logging.Filter):
+    """Add the current task id (or "-") to log records as task_id"""
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.task_id = current_task_id() or "-"
+        return True
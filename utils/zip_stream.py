@@ -0,0 +1,65 @@
+import os
+import time
+import zipfile
+import logging
+from typing import Iterable, Iterator, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+class _ChunkSink:
+    """Write-only, unseekable file object that hands written bytes back to a generator"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def stream_zip(entries: Iterable[Tuple[str, Union[str, bytes], bool]]) -> Iterator[bytes]:
+    """
+    Build a ZIP archive on the fly and yield it in chunks.
+    
+    Each entry is (archive name, file path or in-memory bytes, compress).
+    Files are copied in CHUNK_SIZE pieces, so memory use does not grow with
+    the archive. Already-compressed content should pass compress=False to be
+    stored as is.
+    """
+    sink = _ChunkSink()
+    # An unseekable sink makes zipfile write sizes and CRCs after each entry
+    with zipfile.ZipFile(sink, "w") as archive:
+        for name, content, compress in entries:
+            modified = time.time() if isinstance(content, bytes) else os.path.getmtime(content)
+            info = zipfile.ZipInfo(name, date_time=time.localtime(modified)[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+            # A known size lets zipfile switch to ZIP64 headers for huge files
+            info.file_size = len(content) if isinstance(content, bytes) else os.path.getsize(content)
+            
+            with archive.open(info, "w") as target:
+                if isinstance(content, bytes):
+                    target.write(content)
+                else:
+                    with open(content, "rb") as source:
+                        while chunk := source.read(CHUNK_SIZE):
+                            target.write(chunk)
+                            yield from _drained(sink)
+            yield from _drained(sink)
+    
+    # Central directory
+    yield from _drained(sink)
+
+def _drained(sink: _ChunkSink) -> Iterator[bytes]:
+    """Yield whatever the sink has buffered, if anything"""
+    data = sink.drain()
+    if data:
+        yield data